@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/24 10:15
+@Author  : lbfeng
+@File    : batch_orders.py
+"""
+import os
+import sys
+import logging
+import argparse
+import datetime
+import yaml
+import pandas as pd
+from sqlalchemy import text, bindparam
+import primer_design
+from primer_design import db_handler, emit, poll_audit_status, get_email_status_many, update_email_status_many, \
+    write_vendor_order, ensure_monitor_schema, CmsError, REVIEW_APPROVED, REVIEW_PENDING
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+# Columns added by the database that are not part of the order data
+DB_COLUMNS = ['id', 'auto_id', 'CreatedAt', 'UpdatedAt']
+
+
+def read_sql(query, params):
+    with db_handler.get_engine().connect() as conn:
+        return pd.read_sql(query, conn, params=params)
+
+
+def pending_samples(mold, since):
+    """
+    Returns the samples of a vendor whose order has not been sent yet and whose design finished within the window.
+
+    :param mold: Vendor key stored in monitor_order.OrderCompany (e.g. 'sh', 'hz', 'sg', 'dg').
+    :param since: Earliest DesignDate of the window.
+    :return: DataFrame with SampleID, OrderFile and DesignDate.
+    """
+    ensure_monitor_schema()
+    query = text("""
+        SELECT SampleID, OrderFile, DesignDate FROM monitor_order
+        WHERE EmailSent = 0 AND OrderCompany = :mold AND DesignDate >= :since
+        ORDER BY DesignDate
+    """)
+    return read_sql(query, {'mold': mold, 'since': since.strftime('%Y-%m-%d %H:%M:%S')})
+
+
+def latest_rows(df, key):
+    """
+    Drops the rows of earlier designs of a sample, keeping the most recently inserted row per key.
+    """
+    order_col = next((col for col in ['auto_id', 'id'] if col in df.columns), None)
+    if order_col:
+        df = df.sort_values(order_col)
+    df = df.drop_duplicates(key, keep='last')
+    return df.drop(columns=[col for col in DB_COLUMNS if col in df.columns])
+
+
+def load_orders(sample_ids, mold):
+    """
+    Reads the primer order rows and the primer pairs of the trial sheet of many samples in two queries.
+
+    :param sample_ids: List of sample IDs.
+    :param mold: Vendor key stored in primer_order.OrderingCompany.
+    :return: Tuple of (df_order, df_trial), sorted by primer name.
+    """
+    query = text("""
+        SELECT * FROM primer_order WHERE OrderingCompany = :mold AND sampleSn IN :sample_ids
+    """).bindparams(bindparam('sample_ids', expanding=True))
+    df_order = read_sql(query, {'mold': mold, 'sample_ids': sample_ids})
+
+    # A sample designed more than once keeps only the order of its last design
+    last_design = df_order.groupby('sampleSn')['DesignDate'].transform('max')
+    df_order = latest_rows(df_order[df_order['DesignDate'] == last_design], ['sampleSn', 'PrimerName'])
+
+    query = text("""
+        SELECT * FROM primer_combined WHERE sampleSn IN :sample_ids
+    """).bindparams(bindparam('sample_ids', expanding=True))
+    df_trial = latest_rows(read_sql(query, {'sample_ids': sample_ids}), ['sampleSn', 'primerID'])
+    df_trial = df_trial[df_trial['F_id'].isin(df_order['PrimerName'])]
+
+    return (df_order.sort_values('PrimerName').reset_index(drop=True),
+            df_trial.sort_values('F_id').reset_index(drop=True))
+
+
+def review_samples(df_pending, skip_review):
+    """
+    Checks the CMS review status of the pending samples.
+
+    :return: Tuple of (approved, terminated, waiting) dictionaries sample ID -> review status.
+    """
+    approved, terminated, waiting = {}, {}, {}
+    for sample_id in df_pending['SampleID']:
+        if skip_review:
+            approved[sample_id] = None
+            continue
+        try:
+            polled = poll_audit_status(sample_id)
+        except CmsError as e:
+            # One sample the CMS cannot answer for does not stop the batch; it is checked again in the next one
+            logger.warning(f'Review status of {sample_id} not available: {e}')
+            waiting[sample_id] = None
+            continue
+        if polled is None:
+            # CMS request budget spent; the sample is checked again in the next batch
+            waiting[sample_id] = None
+            continue
+        status_abbr, status_desc = polled
+        review_status = f'{status_abbr}({status_desc})'
+        if status_abbr in REVIEW_APPROVED:
+            approved[sample_id] = review_status
+        elif status_abbr in REVIEW_PENDING:
+            waiting[sample_id] = review_status
+        else:
+            terminated[sample_id] = review_status
+    return approved, terminated, waiting
+
+
+def batch_order(mold, order_dir, since, skip_review=False, min_samples=1, dry_run=False, debug=False):
+    """
+    Consolidates the approved samples of one vendor into a single order workbook and a single order email,
+    then marks all of them as sent with one database update.
+
+    :param mold: Vendor key (e.g. 'sh', 'hz', 'sg', 'dg').
+    :param order_dir: Directory where the consolidated order workbook is saved.
+    :param since: Earliest DesignDate of the samples collected.
+    :param skip_review: Order every pending sample without checking the CMS review status.
+    :param min_samples: Minimum number of approved samples for a batch to be sent.
+    :param dry_run: Write the workbook but send no email and update no database record.
+    :param debug: Send to the debug addresses and keep EmailSent at 0.
+    :return: Path of the consolidated workbook, or None if no batch was sent.
+    """
+    setup = config['emails']['setup']
+    toaddrs = setup['log_toaddrs'] if debug else setup['order_toaddrs']
+    qc_toaddrs = setup['log_toaddrs'] if debug else setup['qc_toaddrs']
+    cc = setup['log_cc'] if debug else setup['cc']
+
+    df_pending = pending_samples(mold, since)
+    if df_pending.empty:
+        logger.info(f'No pending {mold} orders since {since}.')
+        return None
+
+    approved, terminated, waiting = review_samples(df_pending, skip_review)
+    if waiting:
+        logger.info(f"{len(waiting)} {mold} samples are still under review: {', '.join(waiting)}")
+
+    if terminated and not dry_run:
+        lines = '\n'.join(f'{sample_id}：{status}' for sample_id, status in terminated.items())
+        emit(f'样本状态检测异常警告 - {len(terminated)} 个样本',
+             f'警告：以下样本状态检测异常，订单不会发送。\n{lines}\n请立即检查相关数据并采取适当措施。',
+             to_addrs=qc_toaddrs)
+        update_email_status_many(list(terminated), 'monitor_order', review_status=terminated, email_sent=2)
+
+    if len(approved) < min_samples:
+        logger.info(f'{len(approved)} approved {mold} samples, fewer than {min_samples}; the batch waits.')
+        return None
+
+    # Orders sent meanwhile, e.g. by a review status callback, are not ordered again
+    email_status = get_email_status_many(list(approved), 'monitor_order')
+    sample_ids = [sample_id for sample_id in approved if email_status.get(sample_id) == 0]
+    if len(sample_ids) < min_samples:
+        return None
+
+    df_order, df_trial = load_orders(sample_ids, mold)
+    missing = sorted(set(sample_ids) - set(df_order['sampleSn']))
+    if missing:
+        logger.warning(f"No primer order rows for {', '.join(missing)}; they are left for the next batch.")
+        sample_ids = [sample_id for sample_id in sample_ids if sample_id not in missing]
+        if len(sample_ids) < min_samples:
+            return None
+
+    batch_id = f'BATCH-{mold.upper()}-{len(sample_ids)}'
+    batch_file = write_vendor_order(mold, df_order, df_trial, order_dir, batch_id)
+    logger.info(f'{len(sample_ids)} samples, {df_order.shape[0]} primers written to {batch_file}.')
+    if dry_run:
+        return batch_file
+
+    sample_lines = '\n'.join(f'{sample_id}：{approved[sample_id] or "跳过审核"}' for sample_id in sample_ids)
+    subject = f'样本引物合成订购 (批量自动发送) - {len(sample_ids)} 个样本 {datetime.date.today()}'
+    message = f'样本数量：{len(sample_ids)}\n引物数量：{df_order.shape[0]}\n样本ID与CMS审核结果：\n{sample_lines}\n' \
+              f'引物结果：{os.path.basename(batch_file)}（见附件）'
+    emit(subject, message, attachments=[batch_file], to_addrs=toaddrs, cc_addrs=cc, kind='batch_order')
+
+    update_email_status_many(sample_ids, 'monitor_order',
+                             review_status=None if skip_review else {s: approved[s] for s in sample_ids},
+                             email_sent=0 if debug else 1)
+    return batch_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send the approved samples of each vendor as one consolidated '
+                                                 'primer order.')
+    parser.add_argument('-o', '--output_dir', required=True, dest='output_dir',
+                        help='Directory where the consolidated order workbooks are saved.')
+    parser.add_argument('-m', '--mold', action='append', dest='molds',
+                        choices=[mold for mold in config['order_layouts'] if mold in config['order_template']],
+                        help='Vendor to batch; may be repeated. Defaults to all vendors.')
+    parser.add_argument('--window-hours', type=float, dest='window_hours',
+                        help='Collect samples designed within this many hours. Default from config.yaml.')
+    parser.add_argument('--min-samples', type=int, dest='min_samples',
+                        help='Minimum number of approved samples to send a batch. Default from config.yaml.')
+    parser.add_argument('--skip-review', action='store_true', dest='skip_review',
+                        help='Order every pending sample without checking the CMS review status.')
+    parser.add_argument('--dry-run', action='store_true', dest='dry_run',
+                        help='Write the consolidated workbooks without sending email or updating the database.')
+    parser.add_argument('--debug', action='store_true', dest='debug',
+                        help='Run in debug mode.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    debug = args.debug if args.debug else config.get('DEBUG', False)
+    # emit reads the debug flag of primer_design
+    primer_design.DEBUG = debug
+
+    batch_config = config.get('batch_orders') or {}
+    window_hours = args.window_hours if args.window_hours is not None else batch_config.get('window_hours', 24)
+    min_samples = args.min_samples if args.min_samples is not None else batch_config.get('min_samples', 1)
+    since = datetime.datetime.now() - datetime.timedelta(hours=window_hours)
+    order_dir = os.path.join(os.path.abspath(args.output_dir), 'primer_order')
+
+    molds = args.molds or [mold for mold in config['order_layouts'] if mold in config['order_template']]
+    failed = False
+    for mold in molds:
+        try:
+            batch_order(mold, order_dir, since, skip_review=args.skip_review, min_samples=min_samples,
+                        dry_run=args.dry_run, debug=debug)
+        except Exception as e:
+            logger.error(f'Batch order of {mold} failed: {e}')
+            failed = True
+
+    # The periodic batch run also sends the QC digest once it is due
+    primer_design.flush_qc_digest()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/11/02 10:15
+@Author  : lbfeng
+@File    : job_api.py
+"""
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import inspect
+import logging
+import argparse
+import threading
+import contextlib
+import yaml
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import worker_pool
+from primer_design import design_sample
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+# Parameters of design_sample given by the job itself rather than by the caller
+JOB_ARGUMENTS = ('sampleID', 'input_file', 'output_dir', 'mold')
+DESIGN_PARAMETERS = [name for name in inspect.signature(design_sample).parameters if name not in JOB_ARGUMENTS]
+
+FINISHED = ('done', 'failed')
+
+
+def job_hash(sample_id, mold, loci, params):
+    """
+    Hashes the content of a job: the same sample, vendor, loci and parameters give the same job ID, so that
+    a repeated submission returns the existing job instead of designing the sample again.
+    """
+    content = json.dumps({'sampleSn': sample_id, 'mold': mold, 'loci': loci, 'params': params},
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()[:20]
+
+
+class JobStore:
+    """
+    Persistent record of the submitted jobs and their state on the worker pool, so that a restart keeps the
+    job IDs, the results and the idempotency of resubmissions.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    sample_id TEXT NOT NULL,
+                    kwargs TEXT NOT NULL,
+                    job_dir TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    pool_id TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    progress TEXT,
+                    result TEXT,
+                    error TEXT,
+                    error_type TEXT,
+                    exit_code INTEGER,
+                    submitted REAL NOT NULL,
+                    started REAL,
+                    finished REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, submitted);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return contextlib.closing(conn)
+
+    @staticmethod
+    def _job(row):
+        if row is None:
+            return None
+        job = dict(row)
+        for key in ('kwargs', 'progress', 'result'):
+            job[key] = json.loads(job[key]) if job[key] else None
+        return job
+
+    def add(self, job_id, sample_id, kwargs, job_dir):
+        """
+        Records a new job. A job that failed before is queued again; any other existing job is left as it is.
+
+        :return: Tuple of (job dictionary, True if the job was queued by this call).
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            job = self._job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+            if job is None:
+                conn.execute('INSERT INTO jobs (id, sample_id, kwargs, job_dir, submitted) VALUES (?, ?, ?, ?, ?)',
+                             (job_id, sample_id, json.dumps(kwargs, ensure_ascii=False), job_dir, time.time()))
+            elif job['status'] == 'failed':
+                conn.execute("""
+                    UPDATE jobs SET status = 'queued', pool_id = NULL, attempts = 0, progress = NULL, result = NULL,
+                    error = NULL, error_type = NULL, exit_code = NULL, submitted = ?, started = NULL, finished = NULL
+                    WHERE id = ?
+                """, (time.time(), job_id))
+            created = job is None or job['status'] == 'failed'
+            job = self._job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+            conn.execute('COMMIT')
+        return job, created
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            return self._job(conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone())
+
+    def undispatched(self):
+        """
+        Returns the queued jobs that have not been handed to the worker pool yet, oldest first.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT * FROM jobs WHERE status = 'queued' AND pool_id IS NULL ORDER BY submitted
+            """).fetchall()
+        return [self._job(row) for row in rows]
+
+    def dispatched(self):
+        """
+        Returns the unfinished jobs that are on the worker pool.
+        """
+        with self._connect() as conn:
+            rows = conn.execute("""
+                SELECT * FROM jobs WHERE status IN ('queued', 'running') AND pool_id IS NOT NULL
+            """).fetchall()
+        return [self._job(row) for row in rows]
+
+    def update(self, job_id, **fields):
+        for key in ('progress', 'result'):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {', '.join(f'{key} = ?' for key in fields)} WHERE id = ?",
+                         (*fields.values(), job_id))
+
+    def prune(self, retention_days):
+        """
+        Deletes the finished jobs older than retention_days together with their job directories.
+
+        :return: Number of jobs deleted.
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT id, job_dir FROM jobs WHERE status IN (?, ?) AND finished < ?',
+                                (*FINISHED, time.time() - retention_days * 86400)).fetchall()
+            conn.executemany('DELETE FROM jobs WHERE id = ?', [(row['id'],) for row in rows])
+        for row in rows:
+            shutil.rmtree(row['job_dir'], ignore_errors=True)
+        return len(rows)
+
+    def stats(self, recent=20):
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            rows = conn.execute('SELECT id, sample_id, status, submitted, finished, error FROM jobs '
+                                'ORDER BY submitted DESC LIMIT ?', (recent,)).fetchall()
+        return {'counts': counts, 'recent': [dict(row) for row in rows]}
+
+
+class JobRunner(threading.Thread):
+    """
+    Hands the queued jobs to the worker pool and copies their status, progress and result back into the store.
+    Jobs wait in the store while the pool is not running; jobs the pool lost (pool restarted) are dispatched
+    again up to max_attempts times.
+    """
+
+    def __init__(self, store, socket_path, poll_seconds=2, max_attempts=3, retention_days=30):
+        super().__init__(daemon=True)
+        self.store = store
+        self.socket_path = socket_path
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.retention_days = retention_days
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.pool_available = True
+        self.pruned = 0
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.dispatch()
+                self.refresh()
+                if not self.pool_available:
+                    logger.info(f'Worker pool on {self.socket_path} is available again.')
+                    self.pool_available = True
+            except OSError as e:
+                if self.pool_available:
+                    logger.warning(f'Worker pool on {self.socket_path} is not available, jobs wait in the queue: {e}')
+                    self.pool_available = False
+            except Exception as e:
+                logger.error(f'Job dispatch failed: {e}')
+            if self.retention_days and time.time() - self.pruned > 3600:
+                self.store.prune(self.retention_days)
+                self.pruned = time.time()
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+
+    def dispatch(self):
+        for job in self.store.undispatched():
+            reply = worker_pool.submit(self.socket_path, None, log_path=os.path.join(job['job_dir'], 'job.log'),
+                                       wait=False, timeout=30, kwargs=job['kwargs'])
+            if 'error' in reply:
+                self.store.update(job['id'], status='failed', error=reply['error'], error_type='PoolError',
+                                  finished=time.time())
+                continue
+            self.store.update(job['id'], pool_id=reply['id'], attempts=job['attempts'] + 1)
+
+    def refresh(self):
+        jobs = self.store.dispatched()
+        if not jobs:
+            return
+        replies = worker_pool.job_status(self.socket_path, [job['pool_id'] for job in jobs])
+        for job in jobs:
+            pool_job = replies.get(job['pool_id'])
+            if pool_job is None:
+                if job['attempts'] < self.max_attempts:
+                    logger.warning(f'Job {job["id"]} was lost by the worker pool and is dispatched again.')
+                    self.store.update(job['id'], status='queued', pool_id=None)
+                else:
+                    self.store.update(job['id'], status='failed', error='lost by the worker pool',
+                                      error_type='PoolError', finished=time.time())
+                continue
+            if pool_job['status'] == job['status'] and pool_job.get('progress') == job['progress']:
+                continue
+            self.store.update(job['id'], status=pool_job['status'], progress=pool_job.get('progress'),
+                              started=pool_job.get('started'), finished=pool_job.get('finished'),
+                              exit_code=pool_job.get('exit_code'), result=pool_job.get('result'),
+                              error=pool_job.get('error'), error_type=pool_job.get('error_type'))
+
+
+def job_view(job):
+    """
+    Public part of a job as returned by the status endpoint.
+    """
+    return {
+        'id': job['id'],
+        'sampleSn': job['sample_id'],
+        'status': job['status'],
+        'progress': job['progress'],
+        'submitted': job['submitted'],
+        'started': job['started'],
+        'finished': job['finished'],
+        'error': job['error'],
+        'error_type': job['error_type'],
+    }
+
+
+class JobHandler(BaseHTTPRequestHandler):
+    store = None
+    runner = None
+    jobs_dir = None
+    token = None
+    max_body = 20 * 1024 * 1024
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        return not self.token or self.headers.get('Authorization') == f'Bearer {self.token}'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if parts == ['health']:
+            return self._send(200, {'status': 'ok', 'pool': self.runner.pool_available})
+        if not self._authorized():
+            return self._send(401, {'error': 'unauthorized'})
+        if parts == ['jobs']:
+            recent = int(parse_qs(url.query).get('recent', ['20'])[0])
+            return self._send(200, self.store.stats(recent))
+        if len(parts) < 2 or parts[0] != 'jobs' or len(parts) > 3:
+            return self._send(404, {'error': 'not found'})
+
+        job = self.store.get(parts[1])
+        if job is None:
+            return self._send(404, {'error': f'unknown job: {parts[1]}'})
+        endpoint = parts[2] if len(parts) == 3 else None
+
+        if endpoint is None:
+            return self._send(200, job_view(job))
+        if endpoint == 'progress':
+            end = job['finished'] or time.time()
+            return self._send(200, {'id': job['id'], 'status': job['status'], 'progress': job['progress'],
+                                    'elapsed': round(end - (job['started'] or end), 1)})
+        if endpoint == 'result':
+            if job['status'] not in FINISHED:
+                return self._send(409, {'error': f'job is {job["status"]}', 'status': job['status']})
+            return self._send(200, {'id': job['id'], 'status': job['status'], 'exit_code': job['exit_code'],
+                                    'result': job['result'], 'error': job['error'], 'error_type': job['error_type']})
+        if endpoint == 'order':
+            order_file = (job['result'] or {}).get('order_file')
+            if not order_file or not os.path.isfile(order_file):
+                return self._send(404, {'error': 'job has no order file', 'status': job['status']})
+            with open(order_file, 'rb') as f:
+                data = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(order_file)}"')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return None
+        return self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            return self._send(404, {'error': 'not found'})
+        if not self._authorized():
+            return self._send(401, {'error': 'unauthorized'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        if length > self.max_body:
+            return self._send(413, {'error': f'request body larger than {self.max_body} bytes'})
+        try:
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+            sample_id = str(payload['sampleSn']).strip()
+            mold = str(payload['mold']).strip()
+            loci = payload['loci']
+            params = payload.get('params') or {}
+            if not isinstance(loci, list) or not loci or not all(isinstance(row, dict) for row in loci):
+                raise ValueError('loci must be a non-empty list of rows')
+            if not isinstance(params, dict):
+                raise ValueError('params must be an object')
+        except (ValueError, KeyError, TypeError) as e:
+            return self._send(400, {'error': f'expected JSON with sampleSn, mold, loci and params: {e}'})
+
+        molds = [mold for mold in config['order_layouts'] if mold in config['order_template']]
+        if mold not in molds:
+            return self._send(400, {'error': f'unknown mold: {mold}, expected one of {molds}'})
+        if not re.fullmatch(r'[\w.-]+', sample_id):
+            return self._send(400, {'error': f'invalid sampleSn: {sample_id}'})
+        unknown = sorted(set(params) - set(DESIGN_PARAMETERS))
+        if unknown:
+            return self._send(400, {'error': f'unknown params: {unknown}', 'params': DESIGN_PARAMETERS})
+
+        job_id = job_hash(sample_id, mold, loci, params)
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        input_file = os.path.join(job_dir, f'{sample_id}.csv')
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+            if not os.path.exists(input_file):
+                tmp_path = f'{input_file}.tmp'
+                pd.DataFrame(loci).to_csv(tmp_path, index=False)
+                os.replace(tmp_path, input_file)
+        except (OSError, ValueError) as e:
+            return self._send(400, {'error': f'loci cannot be written: {e}'})
+
+        kwargs = dict(params, sampleID=sample_id, input_file=input_file, output_dir=job_dir, mold=mold)
+        job, created = self.store.add(job_id, sample_id, kwargs, job_dir)
+        if created:
+            self.runner.wake.set()
+            logger.info(f'Job {job_id} of {sample_id} queued.')
+        return self._send(202 if created else 200, dict(job_view(job), created=created))
+
+
+def serve(host, port, store, runner, jobs_dir, token=None, max_body_mb=20):
+    """
+    Creates the job server.
+
+    :param host: Interface to listen on.
+    :param port: Port to listen on.
+    :param store: JobStore of the jobs.
+    :param runner: JobRunner that dispatches the jobs to the worker pool.
+    :param jobs_dir: Directory of the loci files, logs and outputs of the jobs.
+    :param token: Bearer token required by the job endpoints, or None for none.
+    :param max_body_mb: Largest accepted request body.
+    :return: The server instance; call serve_forever to handle requests.
+    """
+    JobHandler.store = store
+    JobHandler.runner = runner
+    JobHandler.jobs_dir = os.path.abspath(jobs_dir)
+    JobHandler.token = token
+    JobHandler.max_body = int(float(max_body_mb) * 1024 * 1024)
+    os.makedirs(JobHandler.jobs_dir, exist_ok=True)
+    server = ThreadingHTTPServer((host, port), JobHandler)
+    logger.info(f'Design jobs accepted on http://{host}:{server.server_port}/jobs')
+    return server
+
+
+def main():
+    api_config = config.get('job_api') or {}
+    pool_config = config.get('worker_pool') or {}
+
+    parser = argparse.ArgumentParser(description='Local HTTP service that accepts primer design jobs and runs them '
+                                                 'on the worker pool.')
+    parser.add_argument('--host', default=api_config.get('host', '127.0.0.1'), dest='host',
+                        help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=int(api_config.get('port', 8092)), dest='port',
+                        help='Port to listen on.')
+    parser.add_argument('--socket', default=pool_config.get('socket', './primer_cache/worker_pool.sock'),
+                        dest='socket', help='Unix socket of the worker pool.')
+    parser.add_argument('--stats', action='store_true', dest='stats',
+                        help='Print the job counts and the most recent jobs.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    store = JobStore(api_config.get('path', './primer_cache/job_api.sqlite'))
+    if args.stats:
+        print(json.dumps(store.stats(), ensure_ascii=False, indent=2))
+        return
+
+    runner = JobRunner(store, args.socket,
+                       poll_seconds=float(api_config.get('poll_seconds', 2)),
+                       max_attempts=int(api_config.get('max_attempts', 3)),
+                       retention_days=float(api_config.get('retention_days', 30)))
+    runner.start()
+    token = os.environ.get('JOB_API_TOKEN') or api_config.get('token')
+    server = serve(args.host, args.port, store, runner, api_config.get('jobs_dir', './primer_cache/jobs'),
+                   token=token, max_body_mb=api_config.get('max_body_mb', 20))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stopping.set()
+        runner.wake.set()
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
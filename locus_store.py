@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/19 14:10
+@Author  : lbfeng
+@File    : locus_store.py
+"""
+import os
+import json
+import sqlite3
+import logging
+import datetime
+import threading
+
+logger = logging.getLogger(__name__)
+
+PAIR_COLUMNS = ['ID', 'TemplateID', 'ForwardPrimer(Fp)', 'ReversePrimer(Rp)', 'sampleID', 'Suffix']
+
+# Version of the database layout, stored in PRAGMA user_version
+SCHEMA_VERSION = 2
+
+
+def bed_template_ids(result_string):
+    """
+    Converts a BED submission string into the TemplateIDs MFEPrimer reports for it.
+
+    :param result_string: BED string submitted to MFEPrimer (chrom, start, end per line).
+    :return: List of TemplateIDs, e.g. ['chr1:100-102'].
+    """
+    template_ids = []
+    for line in result_string.splitlines():
+        fields = line.split()
+        if len(fields) >= 3:
+            template_ids.append(f'{fields[0]}:{fields[1]}-{fields[2]}')
+    return template_ids
+
+
+class LocusStore:
+    """
+    Cross-sample store of every primer pair a design service returned for a locus, keyed by
+    (TemplateID, reference, parameter hash, service), with per-locus design attempt counts. The service
+    (scheme and host of the design URL) keeps results of a local stand-in apart from MFEPrimer results. Only submissions of a single
+    locus count as attempts; a locus lost in a multiplex may have been knocked out by another locus, so those
+    losses are kept in separate multiplex counters that never mark a locus as failing.
+    Lookups are served from an in-memory index per (reference, parameter hash, service); writes of this process update
+    the index in place, and a version counter bumped by every write reloads it after writes of other processes.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: Path of the SQLite database file.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self._index = {}
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION and conn.execute(
+                    "SELECT 1 FROM sqlite_master WHERE name IN ('locus_primers', 'locus_attempts')").fetchone():
+                # 旧版本未区分设计服务 (可能混入 mfe_stub 结果)，且把多重 PCR 中丢失的位点计为失败，无法迁移
+                logger.warning(f'Dropping the locus store {self.db_path} written by an older version, rebuild it '
+                               f'with locus_store.py --backfill and primer_atlas.py.')
+                conn.executescript("""
+                    DROP TABLE IF EXISTS locus_primers;
+                    DROP TABLE IF EXISTS locus_attempts;
+                    DROP TABLE IF EXISTS locus_imports;
+                """)
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS locus_primers (
+                    template_id TEXT NOT NULL,
+                    reference TEXT NOT NULL,
+                    params_hash TEXT NOT NULL,
+                    service TEXT NOT NULL,
+                    forward TEXT NOT NULL,
+                    reverse TEXT NOT NULL,
+                    amp_size INTEGER,
+                    metrics TEXT,
+                    seen_count INTEGER NOT NULL DEFAULT 1,
+                    source TEXT,
+                    last_sample TEXT,
+                    first_seen TEXT,
+                    last_seen TEXT,
+                    PRIMARY KEY (template_id, reference, params_hash, service, forward, reverse)
+                );
+                CREATE TABLE IF NOT EXISTS locus_attempts (
+                    template_id TEXT NOT NULL,
+                    reference TEXT NOT NULL,
+                    params_hash TEXT NOT NULL,
+                    service TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    successes INTEGER NOT NULL DEFAULT 0,
+                    multiplex_attempts INTEGER NOT NULL DEFAULT 0,
+                    multiplex_successes INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (template_id, reference, params_hash, service)
+                );
+                CREATE TABLE IF NOT EXISTS locus_imports (
+                    sample_id TEXT NOT NULL,
+                    suffix TEXT NOT NULL,
+                    reference TEXT NOT NULL,
+                    params_hash TEXT NOT NULL,
+                    service TEXT NOT NULL,
+                    PRIMARY KEY (sample_id, suffix, reference, params_hash, service)
+                );
+                CREATE TABLE IF NOT EXISTS locus_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 0),
+                    version INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO locus_version (id, version) VALUES (0, 0);
+            """)
+            conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def record(self, df_res, reference, params_hash, service, submitted_ids=None, sample_id=None, source='design',
+               count_attempts=True, import_key=None):
+        """
+        Adds the primer pairs of an MFEPrimer result to the store.
+
+        :param df_res: DataFrame of primer design results (one row per primer pair).
+        :param reference: Reference genome used for the design, e.g. 'hg19.fa'.
+        :param params_hash: Hash of the primer design parameters.
+        :param service: Design service the result came from, see primer_cache.service_id.
+        :param submitted_ids: TemplateIDs that were submitted; used to count design attempts per locus.
+        :param sample_id: Sample the result belongs to.
+        :param source: Origin of the result, e.g. 'design' or 'atlas'.
+        :param count_attempts: Count design attempts; off for results whose submission is unknown.
+        :param import_key: (sample_id, suffix) of an imported result; a result imported before is skipped.
+        :return: Number of primer pairs recorded.
+        """
+        now = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        metric_columns = [col for col in df_res.columns if col not in PAIR_COLUMNS]
+        metrics = json.loads(df_res[metric_columns].to_json(orient='records')) if metric_columns else [{}] * len(df_res)
+        amp_sizes = df_res['AmpSize(bp)'].tolist() if 'AmpSize(bp)' in df_res.columns else [None] * len(df_res)
+
+        rows = [
+            (template_id, reference, params_hash, service, str(fp).upper(), str(rp).upper(),
+             None if amp_size is None or amp_size != amp_size else int(amp_size), json.dumps(metric), source, sample_id, now, now)
+            for template_id, fp, rp, amp_size, metric in zip(df_res['TemplateID'], df_res['ForwardPrimer(Fp)'],
+                                                             df_res['ReversePrimer(Rp)'], amp_sizes, metrics)
+        ]
+        returned = set(df_res['TemplateID'])
+        submitted = list(submitted_ids or returned) if count_attempts else []
+        solo = int(len(submitted) == 1)
+        attempts = [(template_id, reference, params_hash, service, solo, solo * int(template_id in returned),
+                     1 - solo, (1 - solo) * int(template_id in returned))
+                    for template_id in submitted]
+
+        with self._lock, self._connect() as conn:
+            if import_key is not None and not conn.execute("""
+                INSERT OR IGNORE INTO locus_imports (sample_id, suffix, reference, params_hash, service)
+                VALUES (?, ?, ?, ?, ?)
+            """, (*import_key, reference, params_hash, service)).rowcount:
+                return 0
+            conn.executemany("""
+                INSERT INTO locus_primers (template_id, reference, params_hash, service, forward, reverse, amp_size,
+                                           metrics, source, last_sample, first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (template_id, reference, params_hash, service, forward, reverse) DO UPDATE SET
+                    seen_count = seen_count + 1, metrics = excluded.metrics, last_sample = excluded.last_sample,
+                    last_seen = excluded.last_seen
+            """, rows)
+            conn.executemany("""
+                INSERT INTO locus_attempts (template_id, reference, params_hash, service, attempts, successes,
+                                            multiplex_attempts, multiplex_successes)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (template_id, reference, params_hash, service) DO UPDATE SET
+                    attempts = attempts + excluded.attempts, successes = successes + excluded.successes,
+                    multiplex_attempts = multiplex_attempts + excluded.multiplex_attempts,
+                    multiplex_successes = multiplex_successes + excluded.multiplex_successes
+            """, attempts)
+            conn.execute('UPDATE locus_version SET version = version + 1')
+            version = conn.execute('SELECT version FROM locus_version').fetchone()[0]
+
+            for key, (pairs, stats, index_version) in list(self._index.items()):
+                if index_version != version - 1:
+                    # 其他进程也有写入，下次查询时重新加载索引
+                    del self._index[key]
+                elif key == (reference, params_hash, service):
+                    # 只有本进程写入，直接更新内存索引
+                    self._update_index(key, rows, attempts, version)
+                else:
+                    self._index[key] = (pairs, stats, version)
+
+        return len(rows)
+
+    def _update_index(self, key, rows, attempts, version):
+        """
+        Applies the rows just written by record to the cached index of one reference and parameter set,
+        the same way the upserts changed the tables.
+        """
+        pairs, stats, _ = self._index[key]
+        touched = set()
+        for template_id, _, _, _, fp, rp, amp_size, metric, source, _, _, _ in rows:
+            template_pairs = pairs.setdefault(template_id, [])
+            pair = next((pair for pair in template_pairs
+                         if pair['ForwardPrimer(Fp)'] == fp and pair['ReversePrimer(Rp)'] == rp), None)
+            if pair is None:
+                template_pairs.append({
+                    'TemplateID': template_id, 'ForwardPrimer(Fp)': fp, 'ReversePrimer(Rp)': rp,
+                    'AmpSize(bp)': amp_size, 'metrics': json.loads(metric), 'seen_count': 1, 'source': source
+                })
+            else:
+                pair['seen_count'] += 1
+                pair['metrics'] = json.loads(metric)
+            touched.add(template_id)
+        for template_id in touched:
+            pairs[template_id].sort(key=lambda pair: pair['seen_count'], reverse=True)
+
+        # Only single-locus attempts are kept in the index, see validate_panel
+        for template_id, _, _, _, solo, success, _, _ in attempts:
+            count, successes = stats.get(template_id, (0, 0))
+            stats[template_id] = (count + solo, successes + success)
+
+        self._index[key] = (pairs, stats, version)
+
+    def _load_index(self, reference, params_hash, service):
+        """
+        Loads all primer pairs and attempt counts for one reference, parameter set and service into memory.
+        """
+        key = (reference, params_hash, service)
+        with self._lock, self._connect() as conn:
+            # 读事务保证版本号与加载的数据一致
+            conn.execute('BEGIN')
+            version = conn.execute('SELECT version FROM locus_version').fetchone()[0]
+            if key in self._index and self._index[key][2] == version:
+                return self._index[key][:2]
+
+            pairs, stats = {}, {}
+            cursor = conn.execute("""
+                SELECT template_id, forward, reverse, amp_size, metrics, seen_count, source
+                FROM locus_primers WHERE reference = ? AND params_hash = ? AND service = ?
+                ORDER BY template_id, seen_count DESC
+            """, key)
+            for template_id, fp, rp, amp_size, metrics, seen_count, source in cursor:
+                pairs.setdefault(template_id, []).append({
+                    'TemplateID': template_id, 'ForwardPrimer(Fp)': fp, 'ReversePrimer(Rp)': rp,
+                    'AmpSize(bp)': amp_size, 'metrics': json.loads(metrics or '{}'),
+                    'seen_count': seen_count, 'source': source
+                })
+            cursor = conn.execute("""
+                SELECT template_id, attempts, successes FROM locus_attempts
+                WHERE reference = ? AND params_hash = ? AND service = ?
+            """, key)
+            for template_id, attempts, successes in cursor:
+                stats[template_id] = (attempts, successes)
+
+            self._index[key] = (pairs, stats, version)
+            return pairs, stats
+
+    def lookup_panel(self, template_ids, reference, params_hash, service):
+        """
+        Looks up the stored primer pairs for every locus of a candidate panel.
+
+        :param template_ids: TemplateIDs of the panel.
+        :param reference: Reference genome used for the design.
+        :param params_hash: Hash of the primer design parameters.
+        :param service: Design service, see primer_cache.service_id.
+        :return: Dictionary of TemplateID -> list of primer pairs, most frequently returned first.
+                 Loci without stored pairs are omitted.
+        """
+        pairs, _ = self._load_index(reference, params_hash, service)
+        return {template_id: pairs[template_id] for template_id in template_ids if template_id in pairs}
+
+    def validate_panel(self, template_ids, reference, params_hash, service, min_attempts=3):
+        """
+        Splits a candidate panel by what the store knows about each locus.
+
+        :param template_ids: TemplateIDs of the panel.
+        :param reference: Reference genome used for the design.
+        :param params_hash: Hash of the primer design parameters.
+        :param service: Design service, see primer_cache.service_id.
+        :param min_attempts: Single-locus attempts without any success before a locus counts as undesignable.
+        :return: Tuple of (known, unknown, failing) TemplateID lists.
+        """
+        pairs, stats = self._load_index(reference, params_hash, service)
+        known, unknown, failing = [], [], []
+        for template_id in template_ids:
+            attempts, successes = stats.get(template_id, (0, 0))
+            if template_id in pairs:
+                known.append(template_id)
+            elif attempts >= min_attempts and successes == 0:
+                failing.append(template_id)
+            else:
+                unknown.append(template_id)
+        return known, unknown, failing
+
+    def backfill(self, db_handler, reference, params_hash, service, table_name='mfe_primers'):
+        """
+        Fills the store from the primer design history saved in the database. Every result (sampleID, Suffix)
+        is imported once, so running the backfill again only adds new results. The submissions of the history
+        are unknown, so no design attempts are counted.
+
+        :param db_handler: primkit DatabaseHandler connected to the results database.
+        :param reference: Reference genome the history was designed with.
+        :param params_hash: Hash of the parameters the history was designed with.
+        :param service: Design service the history was designed with, see primer_cache.service_id.
+        :param table_name: Table holding the MFEPrimer results.
+        :return: Number of primer pairs recorded.
+        """
+        df = db_handler.query_df(f'SELECT * FROM {table_name}')
+        df = df.drop(columns=['id', 'auto_id'], errors='ignore')
+        count = 0
+        for (sample_id, suffix), df_result in df.groupby(['sampleID', 'Suffix'], sort=False):
+            count += self.record(df_result, reference, params_hash, service, sample_id=sample_id, source='backfill',
+                                 count_attempts=False, import_key=(str(sample_id), str(suffix)))
+        return count
+
+
+def main():
+    import argparse
+    from primer_design import config, db_handler, init_locus_store, locus_key
+
+    parser = argparse.ArgumentParser(description='Per-locus primer pair store.')
+    parser.add_argument('--backfill', action='store_true', dest='backfill',
+                        help='Fill the store from the mfe_primers table.')
+    parser.add_argument('--url', default=config['mfe_primer'], dest='url',
+                        help='URL of the design service the history was designed with and lookups are made for.')
+    parser.add_argument('template_ids', nargs='*',
+                        help='TemplateIDs to look up, example: chr1:114716125-114716128')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+    store = init_locus_store()
+    key = locus_key(args.url)
+
+    if args.backfill:
+        count = store.backfill(db_handler, *key)
+        logger.info(f'Recorded {count} primer pairs from the mfe_primers table.')
+
+    for template_id, pairs in store.lookup_panel(args.template_ids, *key).items():
+        for pair in pairs:
+            print(f"{template_id}\t{pair['ForwardPrimer(Fp)']}\t{pair['ReversePrimer(Rp)']}\t{pair['seen_count']}")
+
+
+if __name__ == '__main__':
+    main()
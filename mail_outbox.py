@@ -0,0 +1,606 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/24 15:40
+@Author  : lbfeng
+@File    : mail_outbox.py
+"""
+import os
+import json
+import hashlib
+import time
+import datetime
+import atexit
+import socket
+import smtplib
+import sqlite3
+import logging
+import argparse
+import threading
+import contextlib
+import yagmail
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+
+def is_permanent(error):
+    """
+    Checks whether sending the same message again cannot succeed: a missing attachment, refused recipients
+    or a 5xx reply of the server.
+    """
+    if isinstance(error, (FileNotFoundError, smtplib.SMTPRecipientsRefused)):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500 and \
+        not isinstance(error, smtplib.SMTPAuthenticationError)
+
+
+def subject_hash(subject):
+    return hashlib.sha1(subject.encode('utf-8')).hexdigest()
+
+
+class SentLedger:
+    """
+    Local ledger of sent emails, indexed by subject hash and by (sample, kind), so that an entry point can check
+    in one indexed lookup whether an email was already sent instead of scanning the Sent folder over IMAP.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: Path of the SQLite database file; usually the outbox database.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            create_ledger(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def record(self, subject, sample_id=None, kind=None, sent=None):
+        with self._connect() as conn:
+            record_sent(conn, subject, sample_id, kind, sent or time.time())
+
+    def was_sent(self, subject=None, sample_id=None, kind=None, within_days=None):
+        """
+        Checks whether an email was sent, by its subject or by its sample and kind.
+
+        :param subject: Full subject of the email.
+        :param sample_id: Sample of the email; used with kind when no subject is given.
+        :param kind: Kind of the email, e.g. 'order'.
+        :param within_days: Only look back this many days; None looks at the whole ledger.
+        :return: True if a matching email was sent.
+        """
+        since = time.time() - within_days * 86400 if within_days else 0
+        with self._connect() as conn:
+            if subject is not None:
+                row = conn.execute('SELECT 1 FROM sent_mail WHERE subject_hash = ? AND sent >= ? LIMIT 1',
+                                   (subject_hash(subject), since)).fetchone()
+            else:
+                row = conn.execute('SELECT 1 FROM sent_mail WHERE sample_id = ? AND kind = ? AND sent >= ? LIMIT 1',
+                                   (sample_id, kind, since)).fetchone()
+        return row is not None
+
+    def entries(self, sample_id):
+        """
+        Returns the emails sent for a sample as (sent time, kind, subject) tuples.
+        """
+        with self._connect() as conn:
+            return [(datetime.datetime.fromtimestamp(sent).strftime('%Y-%m-%d %H:%M:%S'), kind, subject)
+                    for sent, kind, subject in conn.execute(
+                        'SELECT sent, kind, subject FROM sent_mail WHERE sample_id = ? ORDER BY sent', (sample_id,))]
+
+
+def create_ledger(conn):
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS sent_mail (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            subject_hash TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            sample_id TEXT,
+            kind TEXT,
+            sent REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_sent_mail_hash ON sent_mail (subject_hash, sent);
+        CREATE INDEX IF NOT EXISTS idx_sent_mail_sample ON sent_mail (sample_id, kind, sent);
+    """)
+
+
+def record_sent(conn, subject, sample_id, kind, sent):
+    conn.execute('INSERT INTO sent_mail (subject_hash, subject, sample_id, kind, sent) VALUES (?, ?, ?, ?, ?)',
+                 (subject_hash(subject), subject, sample_id, kind, sent))
+
+
+class Outbox:
+    """
+    Persistent queue of outgoing emails in a SQLite database shared by every process of the host.
+    Messages are claimed with a lease, so several sender workers never send the same message twice and
+    a message claimed by a process that died is sent again by another one.
+    """
+
+    def __init__(self, db_path, lease_seconds=600, history_days=30):
+        """
+        :param db_path: Path of the SQLite database file.
+        :param lease_seconds: A message being sent longer than this is treated as abandoned.
+        :param history_days: Sent and failed messages are kept this many days for the metrics.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.lease_seconds = float(lease_seconds)
+        self.history_days = float(history_days)
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    subject TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    to_addrs TEXT NOT NULL,
+                    cc_addrs TEXT,
+                    bcc_addrs TEXT,
+                    attachments TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued REAL NOT NULL,
+                    next_attempt REAL NOT NULL,
+                    claimed REAL,
+                    owner TEXT,
+                    sent REAL,
+                    last_error TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt);
+            """)
+            # Columns added after the first release of the outbox
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(outbox)')]
+            for column in ['subject_hash', 'sample_id', 'kind']:
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE outbox ADD COLUMN {column} TEXT')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_outbox_subject ON outbox (subject_hash, status)')
+            create_ledger(conn)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def enqueue(self, subject, message, to_addrs, cc_addrs=None, bcc_addrs=None, attachments=None, sample_id=None,
+                kind=None):
+        """
+        Adds a message to the outbox.
+
+        :param sample_id: Sample of the message, recorded in the sent mail ledger.
+        :param kind: Kind of the message, e.g. 'order', recorded in the sent mail ledger.
+        :return: ID of the queued message.
+        """
+        now = time.time()
+        attachments = [os.path.abspath(path) for path in attachments] if attachments else None
+        with self._connect() as conn:
+            return conn.execute("""
+                INSERT INTO outbox (subject, message, to_addrs, cc_addrs, bcc_addrs, attachments, enqueued, next_attempt,
+                                    subject_hash, sample_id, kind)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (subject, message, json.dumps(list(to_addrs)), json.dumps(cc_addrs), json.dumps(bcc_addrs),
+                  json.dumps(attachments), now, now, subject_hash(subject), sample_id, kind)).lastrowid
+
+    def is_pending(self, subject):
+        """
+        Checks whether a message with this subject is queued or being sent.
+        """
+        with self._connect() as conn:
+            return conn.execute("""
+                SELECT 1 FROM outbox WHERE subject_hash = ? AND status IN ('queued', 'sending') LIMIT 1
+            """, (subject_hash(subject),)).fetchone() is not None
+
+    def claim(self):
+        """
+        Claims the oldest message that is due.
+
+        :return: Dictionary of the message, or None if no message is due.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Messages of processes that died or exceeded their lease go back to the queue
+                for message_id, owner in conn.execute("SELECT id, owner FROM outbox WHERE status = 'sending'").fetchall():
+                    host, _, pid = (owner or '').rpartition(':')
+                    if host == socket.gethostname() and pid.isdigit() and not rate_limiter.pid_alive(int(pid)):
+                        conn.execute("UPDATE outbox SET status = 'queued' WHERE id = ?", (message_id,))
+                conn.execute("UPDATE outbox SET status = 'queued' WHERE status = 'sending' AND claimed < ?",
+                             (now - self.lease_seconds,))
+
+                row = conn.execute("""
+                    SELECT id, subject, message, to_addrs, cc_addrs, bcc_addrs, attachments, attempts, enqueued
+                    FROM outbox WHERE status = 'queued' AND next_attempt <= ?
+                    ORDER BY next_attempt, id LIMIT 1
+                """, (now,)).fetchone()
+                if row:
+                    conn.execute("UPDATE outbox SET status = 'sending', claimed = ?, owner = ? WHERE id = ?",
+                                 (now, self.owner, row[0]))
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+        if not row:
+            return None
+        return {'id': row[0], 'subject': row[1], 'message': row[2], 'to_addrs': json.loads(row[3]),
+                'cc_addrs': json.loads(row[4]), 'bcc_addrs': json.loads(row[5]), 'attachments': json.loads(row[6]),
+                'attempts': row[7], 'enqueued': row[8]}
+
+    def mark_sent(self, message_id):
+        """
+        Marks a message as sent and records it in the sent mail ledger, in one transaction.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute("UPDATE outbox SET status = 'sent', sent = ?, attempts = attempts + 1 WHERE id = ?",
+                         (now, message_id))
+            row = conn.execute('SELECT subject, sample_id, kind FROM outbox WHERE id = ?', (message_id,)).fetchone()
+            if row:
+                record_sent(conn, row[0], row[1], row[2], now)
+            conn.execute('COMMIT')
+
+    def mark_retry(self, message_id, error, delay):
+        with self._connect() as conn:
+            conn.execute("""
+                UPDATE outbox SET status = 'queued', attempts = attempts + 1, next_attempt = ?, last_error = ?
+                WHERE id = ?
+            """, (time.time() + delay, str(error)[:1000], message_id))
+
+    def mark_failed(self, message_id, error):
+        with self._connect() as conn:
+            conn.execute("UPDATE outbox SET status = 'failed', attempts = attempts + 1, last_error = ? WHERE id = ?",
+                         (str(error)[:1000], message_id))
+
+    def pending(self, message_ids):
+        """
+        Returns the IDs among message_ids that are still queued or being sent.
+        """
+        if not message_ids:
+            return []
+        placeholders = ', '.join('?' * len(message_ids))
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                f"SELECT id FROM outbox WHERE status IN ('queued', 'sending') AND id IN ({placeholders})",
+                list(message_ids))]
+
+    def requeue_failed(self):
+        """
+        Puts every failed message back into the queue with a fresh attempt count.
+
+        :return: Number of requeued messages.
+        """
+        with self._connect() as conn:
+            return conn.execute("""
+                UPDATE outbox SET status = 'queued', attempts = 0, next_attempt = ? WHERE status = 'failed'
+            """, (time.time(),)).rowcount
+
+    def purge(self):
+        """
+        Deletes sent and failed messages older than the history period.
+        """
+        with self._connect() as conn:
+            conn.execute("DELETE FROM outbox WHERE status IN ('sent', 'failed') AND enqueued < ?",
+                         (time.time() - self.history_days * 86400,))
+
+    def stats(self):
+        """
+        Returns the queue depth, the failures and the queue latency (enqueue to sent) of recent messages.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+            oldest = conn.execute("SELECT MIN(enqueued) FROM outbox WHERE status IN ('queued', 'sending')").fetchone()[0]
+            latency = [row[0] for row in conn.execute(
+                "SELECT sent - enqueued FROM outbox WHERE status = 'sent' ORDER BY id DESC LIMIT 1000")]
+            retried = conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'sent' AND attempts > 1").fetchone()[0]
+            errors = conn.execute("""
+                SELECT id, subject, attempts, last_error FROM outbox WHERE status = 'failed' ORDER BY id DESC LIMIT 5
+            """).fetchall()
+
+        return {
+            'queued': counts.get('queued', 0),
+            'sending': counts.get('sending', 0),
+            'sent': counts.get('sent', 0),
+            'failed': counts.get('failed', 0),
+            'retried': retried,
+            'oldest_queued_seconds': round(now - oldest, 1) if oldest else 0.0,
+            'latency_p50': round(rate_limiter.percentile(latency, 50), 3),
+            'latency_p95': round(rate_limiter.percentile(latency, 95), 3),
+            'latency_max': round(max(latency), 3) if latency else 0.0,
+            'recent_failures': [{'id': i, 'subject': s, 'attempts': a, 'error': e} for i, s, a, e in errors],
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"Mail outbox: {stats['queued']} queued, {stats['sent']} sent, {stats['failed']} failed, "
+                    f"queue latency p50 {stats['latency_p50']}s / p95 {stats['latency_p95']}s.")
+
+
+class SmtpSender:
+    """
+    Sends messages over one logged-in SMTP connection that is reused between messages and closed after an
+    idle period. The message is built by yagmail, as pt.EmailManager does.
+    """
+
+    def __init__(self, login, idle_seconds=60, timeout=30):
+        """
+        :param login: The emails.login section of config.yaml (host, port, user, password, from_alias and
+                      optionally ssl: false for a plain connection upgraded with STARTTLS).
+        :param idle_seconds: The connection is closed after this many seconds without a message.
+        :param timeout: Socket timeout of the SMTP connection in seconds.
+        """
+        self.login = login
+        self.idle_seconds = float(idle_seconds)
+        self.timeout = timeout
+        self.builder = yagmail.SMTP(user={login['user']: login.get('from_alias', '')}, password=login['password'],
+                                    host=login['host'], port=login['port'])
+        self.smtp = None
+        self.last_used = 0
+        self.logins = 0
+        self.messages = 0
+
+    def connect(self):
+        if self.login.get('ssl', True):
+            self.smtp = smtplib.SMTP_SSL(self.login['host'], self.login['port'], timeout=self.timeout)
+        else:
+            self.smtp = smtplib.SMTP(self.login['host'], self.login['port'], timeout=self.timeout)
+            self.smtp.starttls()
+        self.smtp.login(self.login['user'], self.login['password'])
+        self.logins += 1
+        logger.info(f"Connected to SMTP {self.login['host']}:{self.login['port']} as {self.login['user']}.")
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.smtp = None
+
+    def close_if_idle(self):
+        if self.smtp is not None and time.time() - self.last_used > self.idle_seconds:
+            self.close()
+
+    def send(self, to_addrs, subject, message, cc_addrs=None, bcc_addrs=None, attachments=None):
+        """
+        Sends one message, reconnecting once if the server closed the pooled connection.
+        """
+        for path in attachments or []:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f'Attachment not found: {path}')
+        recipients, msg_string = self.builder.prepare_send(to=to_addrs, subject=subject, contents=[message],
+                                                           attachments=attachments, cc=cc_addrs, bcc=bcc_addrs)
+        for attempt in range(2):
+            if self.smtp is None:
+                self.connect()
+            try:
+                self.smtp.sendmail(self.login.get('from', self.login['user']), recipients, msg_string)
+                break
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                self.smtp = None
+                if attempt:
+                    raise
+                logger.info(f'SMTP connection was closed ({e}), reconnecting.')
+        self.last_used = time.time()
+        self.messages += 1
+
+
+class OutboxWorker(threading.Thread):
+    """
+    Background thread that sends the messages of the outbox through a pooled SMTP sender, at most at the
+    provider's rate, retrying failed messages with exponential backoff.
+    """
+
+    def __init__(self, outbox, sender, limiter=None, max_attempts=5, backoff_seconds=30, max_backoff_seconds=1800,
+                 poll_interval=1.0):
+        """
+        :param outbox: Outbox instance.
+        :param sender: SmtpSender instance.
+        :param limiter: RateLimiter shared by all senders of the host, or None for no rate limit.
+        :param max_attempts: A message that failed this many times is marked failed.
+        :param backoff_seconds: Delay before the first retry; doubled on every further retry.
+        :param max_backoff_seconds: Upper bound of the retry delay.
+        :param poll_interval: Seconds between two checks of an empty outbox.
+        """
+        super().__init__(name='mail-outbox', daemon=True)
+        self.outbox = outbox
+        self.sender = sender
+        self.limiter = limiter
+        self.max_attempts = int(max_attempts)
+        self.backoff_seconds = float(backoff_seconds)
+        self.max_backoff_seconds = float(max_backoff_seconds)
+        self.poll_interval = float(poll_interval)
+        self.stopping = threading.Event()
+
+    def deliver(self, item):
+        try:
+            slot = self.limiter.slot('outbox') if self.limiter else contextlib.nullcontext()
+            with slot:
+                self.sender.send(item['to_addrs'], item['subject'], item['message'], cc_addrs=item['cc_addrs'],
+                                 bcc_addrs=item['bcc_addrs'], attachments=item['attachments'])
+        except Exception as e:
+            attempts = item['attempts'] + 1
+            if is_permanent(e) or attempts >= self.max_attempts:
+                self.outbox.mark_failed(item['id'], e)
+                logger.error(f"Email '{item['subject']}' failed after {attempts} attempts: {e}")
+            else:
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+                self.outbox.mark_retry(item['id'], e, delay)
+                logger.warning(f"Email '{item['subject']}' failed ({e}), retrying in {delay:.0f}s.")
+            return False
+
+        self.outbox.mark_sent(item['id'])
+        logger.info(f"Email '{item['subject']}' sent after {time.time() - item['enqueued']:.1f}s in the outbox.")
+        return True
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                item = self.outbox.claim()
+            except sqlite3.Error as e:
+                logger.error(f'Mail outbox is not readable: {e}')
+                item = None
+            if item is None:
+                self.sender.close_if_idle()
+                self.stopping.wait(self.poll_interval)
+                continue
+            self.deliver(item)
+        self.sender.close()
+
+    def stop(self, timeout=None):
+        self.stopping.set()
+        self.join(timeout)
+
+
+class MailService:
+    """
+    Enqueues messages and sends them from a background worker of this process, so the caller returns
+    immediately. On exit the process waits up to flush_timeout seconds for its own messages; messages still
+    waiting for a retry stay in the outbox for the next process or the mail_outbox.py --serve daemon.
+    """
+
+    def __init__(self, outbox, worker_factory, flush_timeout=120):
+        self.outbox = outbox
+        self.worker_factory = worker_factory
+        self.flush_timeout = float(flush_timeout)
+        self.worker = None
+        self.message_ids = []
+        self._lock = threading.Lock()
+
+    def send(self, to_addrs, subject, message, cc_addrs=None, bcc_addrs=None, attachments=None, sample_id=None,
+             kind=None):
+        message_id = self.outbox.enqueue(subject, message, to_addrs, cc_addrs=cc_addrs, bcc_addrs=bcc_addrs,
+                                         attachments=attachments, sample_id=sample_id, kind=kind)
+        with self._lock:
+            self.message_ids.append(message_id)
+            if self.worker is None:
+                self.worker = self.worker_factory()
+                self.worker.start()
+                atexit.register(self.flush)
+        logger.info(f"Email '{subject}' queued in the outbox.")
+        return message_id
+
+    def flush(self, timeout=None):
+        """
+        Waits until the messages enqueued by this process have been sent or have failed, then stops the worker.
+
+        :return: IDs of the messages still waiting in the outbox.
+        """
+        timeout = self.flush_timeout if timeout is None else timeout
+        deadline = time.time() + timeout
+        pending = self.outbox.pending(self.message_ids)
+        while pending and time.time() < deadline and self.worker and self.worker.is_alive():
+            time.sleep(0.2)
+            pending = self.outbox.pending(pending)
+        if self.worker:
+            self.worker.stop(timeout=max(1.0, deadline - time.time()))
+            self.worker = None
+        if pending:
+            logger.warning(f'{len(pending)} emails are still waiting in the outbox {self.outbox.db_path}.')
+        return pending
+
+
+def open_outbox(config):
+    """
+    Opens the outbox configured in the outbox section of config.yaml.
+
+    :param config: Dictionary of config.yaml.
+    :return: Tuple of (Outbox, worker factory), or None if the outbox is disabled.
+    """
+    outbox_config = config.get('outbox') or {}
+    if not outbox_config.get('enabled', True):
+        return None
+
+    path = outbox_config.get('path', './primer_cache/outbox.sqlite')
+    outbox = Outbox(path, lease_seconds=int(outbox_config.get('lease_minutes', 10)) * 60,
+                    history_days=outbox_config.get('history_days', 30))
+
+    def worker_factory():
+        limiter = rate_limiter.RateLimiter(os.path.join(os.path.dirname(outbox.db_path), 'outbox_limiter.sqlite'),
+                                           rate_per_minute=outbox_config.get('rate_per_minute', 20),
+                                           burst=outbox_config.get('burst', 5),
+                                           max_concurrency=outbox_config.get('max_connections', 2),
+                                           label='邮件')
+        sender = SmtpSender(config['emails']['login'], idle_seconds=outbox_config.get('idle_seconds', 60))
+        return OutboxWorker(outbox, sender, limiter=limiter, max_attempts=outbox_config.get('max_attempts', 5),
+                            backoff_seconds=outbox_config.get('backoff_seconds', 30),
+                            max_backoff_seconds=int(outbox_config.get('max_backoff_minutes', 30)) * 60)
+
+    return outbox, worker_factory
+
+
+def open_ledger(config):
+    """
+    Opens the sent mail ledger, kept in the outbox database whether or not the outbox is enabled.
+    """
+    return SentLedger((config.get('outbox') or {}).get('path', './primer_cache/outbox.sqlite'))
+
+
+def init_mail_service(config):
+    """
+    Creates the mail service of this process from config.yaml.
+
+    :return: A MailService instance, or None if the outbox is disabled.
+    """
+    opened = open_outbox(config)
+    if opened is None:
+        return None
+    outbox, worker_factory = opened
+    return MailService(outbox, worker_factory, flush_timeout=(config.get('outbox') or {}).get('flush_timeout', 120))
+
+
+def main():
+    import yaml
+
+    parser = argparse.ArgumentParser(description='Send the queued emails of the mail outbox or print its metrics.')
+    parser.add_argument('--serve', action='store_true', dest='serve',
+                        help='Keep sending queued emails until interrupted.')
+    parser.add_argument('--retry-failed', action='store_true', dest='retry_failed',
+                        help='Put failed emails back into the queue.')
+    parser.add_argument('--sent', dest='sample_id',
+                        help='List the emails of the sent mail ledger for a sample ID.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    with open('config.yaml', 'r', encoding='utf-8') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    if args.sample_id:
+        for sent, kind, subject in open_ledger(config).entries(args.sample_id):
+            print(f'{sent}\t{kind or ""}\t{subject}')
+        return
+
+    opened = open_outbox(config)
+    if opened is None:
+        parser.error('The outbox is disabled in config.yaml.')
+    outbox, worker_factory = opened
+
+    if args.retry_failed:
+        logger.info(f'{outbox.requeue_failed()} failed emails requeued.')
+
+    if args.serve:
+        worker = worker_factory()
+        worker.start()
+        try:
+            while worker.is_alive():
+                time.sleep(60)
+                outbox.purge()
+                outbox.log_stats()
+        except KeyboardInterrupt:
+            worker.stop(timeout=30)
+        return
+
+    print(json.dumps(outbox.stats(), indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/21 09:40
+@Author  : lbfeng
+@File    : mfe_session.py
+"""
+import io
+import os
+import re
+import gzip
+import time
+import queue
+import logging
+import threading
+import requests
+import pandas as pd
+import urllib3
+import primkit as pt
+from urllib.parse import urlparse
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+XSRF_NAME = '_xsrf'
+
+
+class ResultReader(pt.FileReader):
+    """
+    primkit FileReader that parses an MFEPrimer result held in memory instead of a file on disk.
+    """
+
+    def __init__(self, data, **kwargs):
+        """
+        :param data: Bytes of the downloaded result file.
+        """
+        super().__init__(**kwargs)
+        self.data = data
+
+    def _try_read_csv(self, file_path, sep, header):
+        df = pd.read_csv(io.BytesIO(self.data), sep=sep, header=header)
+        if self.drop_end_rows > 0:
+            df = df.iloc[:-self.drop_end_rows]
+        if df.empty:
+            raise ValueError(f"File is empty or contains insufficient rows: {file_path}")
+        return df
+
+    def _read_csv_custom_logic(self, file_path, sep, header):
+        lines = self.data.decode('utf-8').splitlines(keepends=True)
+        if not lines:
+            raise ValueError(f"File is empty: {file_path}")
+
+        processed_lines = self._process_lines(lines, header)
+        if not processed_lines:
+            self._handle_error(f'Failed to process file: {file_path}')
+
+        df = pd.read_csv(io.StringIO('\n'.join(processed_lines)), sep=sep)
+        if self.drop_end_rows > 0:
+            df = df.iloc[:-self.drop_end_rows]
+        return df
+
+
+class EmptyResult(ValueError):
+    """
+    Raised when an MFEPrimer result file is empty or cannot be parsed, which is what MFEPrimer returns
+    when no locus of a submission gets primers.
+    """
+
+
+def read_result(data, label='<memory>'):
+    """
+    Parses the bytes of an MFEPrimer result file into a DataFrame.
+
+    :param data: Bytes of the downloaded result file.
+    :param label: Name used in log and error messages, e.g. the archive path.
+    :return: DataFrame of primer design results.
+    :raises EmptyResult: If the result file is empty or unreadable.
+    """
+    if not data.strip():
+        raise EmptyResult(f'Result file is empty: {label}')
+    try:
+        return ResultReader(data).read_csv(label)
+    except ValueError as e:
+        raise EmptyResult(str(e)) from e
+
+
+def write_archive(data, path, compress=False):
+    """
+    Writes a result file that is already in memory to an archive file, as ArchiveWriter does for a download.
+
+    :param data: Bytes of the result file.
+    :param path: Path of the archive file.
+    :param compress: Gzip compress the archive file if set.
+    """
+    tmp_path = f'{path}.part'
+    with (gzip.open(tmp_path, 'wb') if compress else open(tmp_path, 'wb')) as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class ArchiveWriter(threading.Thread):
+    """
+    Writes downloaded chunks to an archive file in the background, optionally gzip compressed.
+    The chunks go to a .part file that only replaces the archive file after close; after abort it is deleted.
+    """
+
+    ABORT = object()
+
+    def __init__(self, path, compress=False):
+        super().__init__(name=f'archive-{path}')
+        self.path = path
+        self.compress = compress
+        self.chunks = queue.Queue()
+
+    def write(self, chunk):
+        self.chunks.put(chunk)
+
+    def close(self):
+        """
+        Marks the download as complete.
+        """
+        self.chunks.put(None)
+
+    def abort(self):
+        """
+        Marks the download as failed, the partial file is deleted instead of archived.
+        """
+        self.chunks.put(self.ABORT)
+
+    def run(self):
+        tmp_path = f'{self.path}.part'
+        complete = False
+        try:
+            with (gzip.open(tmp_path, 'wb') if self.compress else open(tmp_path, 'wb')) as f:
+                while True:
+                    chunk = self.chunks.get()
+                    if chunk is None or chunk is self.ABORT:
+                        complete = chunk is None
+                        break
+                    f.write(chunk)
+            if complete:
+                os.replace(tmp_path, self.path)
+                logger.info(f'{self.path} archived.')
+            else:
+                logger.warning(f'Download of {self.path} failed, not archived.')
+        except Exception as e:
+            logger.error(f'Failed to archive {self.path}: {e}')
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
+class TokenRejected(Exception):
+    """
+    Raised when MFEPrimer rejects the XSRF token of a submission.
+    """
+
+
+class MfeSession:
+    """
+    Keeps one pooled HTTP session, the cookies and the XSRF token of the MFEPrimer site and reuses them
+    for every fetch, submit, status check and download. The token page is only fetched again when the
+    server rejects the token or the optional token lifetime has passed.
+    """
+
+    def __init__(self, url, token_ttl=0, check_interval=3, max_wait=1800, pool_size=10, timeout=(10, 30)):
+        """
+        :param url: URL of the MFEPrimer multiplex page, e.g. https://mfeprimer3.igenetech.com/muld.
+        :param token_ttl: Seconds after which the token is refreshed proactively; 0 keeps it until rejected.
+        :param check_interval: Seconds between two task status checks.
+        :param max_wait: Maximum number of seconds to wait for a task to finish.
+        :param pool_size: Maximum number of pooled connections.
+        :param timeout: A tuple (connect_timeout, read_timeout) in seconds.
+        """
+        self.url = url
+        parsed = urlparse(url)
+        self.root_url = f'{parsed.scheme}://{parsed.netloc}'
+        self.token_ttl = token_ttl
+        self.check_interval = check_interval
+        self.max_wait = max_wait
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(pt.get_headers())
+        self.session.verify = False
+
+        self.token = None
+        self.token_time = 0
+        self._lock = threading.Lock()
+
+        self.token_fetches = 0
+        self.token_reuses = 0
+        self.token_rejections = 0
+
+    def token_valid(self):
+        if self.token is None:
+            return False
+        return not self.token_ttl or time.time() - self.token_time < self.token_ttl
+
+    def get_token(self, force=False):
+        """
+        Returns the cached XSRF token, fetching the token page only if there is no valid token.
+
+        :param force: Fetch a new token even if the cached one is still valid.
+        :return: The XSRF token.
+        """
+        with self._lock:
+            if not force and self.token_valid():
+                self.token_reuses += 1
+                return self.token
+
+            response = self.session.get(self.url, timeout=self.timeout)
+            if response.status_code != 200:
+                raise ValueError(f'Error fetching data from {self.url}: Status code {response.status_code}')
+
+            soup = BeautifulSoup(response.content, 'html.parser')
+            token_element = soup.find('input', {'name': XSRF_NAME})
+            if token_element is None:
+                raise ValueError(f'CSRF token not found at {self.url}')
+
+            self.token = token_element['value']
+            self.token_time = time.time()
+            self.token_fetches += 1
+            logger.info(f'Fetched a new MFEPrimer token from {self.url}.')
+            return self.token
+
+    def submit(self, result_string, params):
+        """
+        Submits a multiplex design job and returns the task URL.
+
+        :param result_string: BED string of the loci to design.
+        :param params: Dictionary of primer design parameters.
+        :return: URL of the task status page.
+        """
+        token = self.get_token()
+        try:
+            return self._submit(token, result_string, params)
+        except TokenRejected:
+            self.token_rejections += 1
+            logger.warning('MFEPrimer rejected the cached token, fetching a new one.')
+            return self._submit(self.get_token(force=True), result_string, params)
+
+    def _submit(self, token, result_string, params):
+        post_data = pt.prepare_post_data(token, result_string, custom_params=params)
+        response = self.session.post(self.url, data=post_data, timeout=self.timeout)
+        if response.status_code == 403:
+            raise TokenRejected(response.text[:200])
+        if response.status_code != 200:
+            raise Exception(f'POST request failed with status code: {response.status_code}')
+
+        soup = BeautifulSoup(response.text, 'html.parser')
+        task_link_element = soup.find('a', href=re.compile(r'/muld/'))
+        if task_link_element is None:
+            if XSRF_NAME in response.text:
+                raise TokenRejected('Task link not found, the submission form was returned again.')
+            raise Exception('Task link not found in MFEPrimer response.')
+
+        task_link = f"{self.root_url}{task_link_element.get('href')}"
+        logger.info(f'Task link found: {task_link}')
+        return task_link
+
+    def wait(self, task_url):
+        """
+        Polls the task status page until the result can be downloaded.
+
+        :param task_url: URL of the task status page.
+        :return: Download URL of the result file.
+        """
+        deadline = time.time() + self.max_wait
+        while time.time() < deadline:
+            response = self.session.get(task_url, timeout=self.timeout)
+            if response.status_code != 200:
+                raise Exception(f'Failed to check task status. HTTP status code: {response.status_code}')
+
+            soup = BeautifulSoup(response.text, 'html.parser')
+            status_span = soup.find('span', id='shuaxin')
+            if status_span and status_span.text.strip() == 'Done':
+                download_link_element = soup.find('a', href=re.compile(r'/muld/.*?/download'))
+                if download_link_element:
+                    download_url = f"{self.root_url}{download_link_element.get('href')}"
+                    logger.info(f'File available for download: {download_url}')
+                    return download_url
+            time.sleep(self.check_interval)
+
+        raise Exception(f'Task {task_url} did not finish within {self.max_wait} seconds.')
+
+    def design(self, result_string, params):
+        """
+        Submits a design job and waits for it to finish.
+
+        :param result_string: BED string of the loci to design.
+        :param params: Dictionary of primer design parameters.
+        :return: Download URL of the result file.
+        """
+        return self.wait(self.submit(result_string, params))
+
+    def fetch_result(self, down_url, archive_path=None, compress=False, chunk_size=65536):
+        """
+        Streams a result file into memory. The bytes are teed into an archive file by a background
+        thread, so the caller can parse the result as soon as the last chunk has arrived.
+
+        :param down_url: URL of the result file.
+        :param archive_path: Path of the archive file, or None to skip archiving.
+        :param compress: Gzip compress the archive file if set.
+        :param chunk_size: Size of the chunks read from the response.
+        :return: Bytes of the result file.
+        """
+        writer = None
+        if archive_path:
+            writer = ArchiveWriter(archive_path, compress=compress)
+            writer.start()
+
+        buffer = io.BytesIO()
+        try:
+            with self.session.get(down_url, stream=True, timeout=self.timeout) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    buffer.write(chunk)
+                    if writer:
+                        writer.write(chunk)
+        except BaseException:
+            if writer:
+                writer.abort()
+            raise
+        if writer:
+            writer.close()
+
+        return buffer.getvalue()
+
+    def log_stats(self):
+        """
+        Logs how many token page fetches were saved by reusing the session.
+        """
+        logger.info(f'MFEPrimer session: {self.token_fetches} token fetches, {self.token_reuses} reuses '
+                    f'({self.token_reuses} round trips saved), {self.token_rejections} rejected tokens.')
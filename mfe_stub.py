@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/21 15:30
+@Author  : lbfeng
+@File    : mfe_stub.py
+"""
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+import argparse
+import threading
+import yaml
+from urllib.parse import parse_qs, urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+COLUMNS = ['ID', 'TemplateID', 'ForwardPrimer(Fp)', 'ReversePrimer(Rp)', 'FpTm', 'RpTm', 'FpGC(%)', 'RpGC(%)',
+           'AmpSize(bp)', 'AmpGC(%)']
+
+
+def sample_latency(spec, rng):
+    """
+    Draws a latency in seconds from a distribution spec.
+
+    :param spec: A number (fixed latency) or a dictionary such as {'dist': 'uniform', 'low': 1, 'high': 3},
+                 {'dist': 'lognormal', 'median': 20, 'sigma': 0.5} or {'dist': 'exponential', 'mean': 5}.
+    :param rng: random.Random instance.
+    :return: Latency in seconds.
+    """
+    if not spec:
+        return 0
+    if isinstance(spec, (int, float)):
+        return float(spec)
+
+    dist = spec.get('dist', 'fixed')
+    if dist == 'uniform':
+        return rng.uniform(spec['low'], spec['high'])
+    if dist == 'lognormal':
+        return rng.lognormvariate(0, spec.get('sigma', 0.5)) * spec['median']
+    if dist == 'exponential':
+        return rng.expovariate(1 / spec['mean'])
+    return float(spec.get('value', 0))
+
+
+def fake_primer(template_id, strand, size=22):
+    """
+    Returns a deterministic pseudo primer sequence for a locus.
+    """
+    digest = hashlib.sha256(f'{template_id}{strand}'.encode('utf-8')).digest()
+    return ''.join('ACGT'[b % 4] for b in digest[:size]).lower()
+
+
+class StubState:
+    """
+    Shared state of the stand-in service: issued tokens, jobs and request counters.
+    """
+
+    def __init__(self, settings, seed=None):
+        self.settings = settings
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.jobs = {}
+        self.stats = {'token': 0, 'submit': 0, 'status': 0, 'download': 0, 'rejected': 0, 'failed': 0}
+
+    def count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def latency(self, name):
+        with self.lock:
+            return sample_latency(self.settings.get('latency', {}).get(name), self.rng)
+
+    def fail(self, name):
+        with self.lock:
+            failed = self.rng.random() < float(self.settings.get('failure_rate', {}).get(name, 0))
+        if failed:
+            self.count('failed')
+        return failed
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.time()
+        return token
+
+    def token_valid(self, token):
+        ttl = float(self.settings.get('token_ttl', 0))
+        with self.lock:
+            issued = self.tokens.get(token)
+        return issued is not None and (not ttl or time.time() - issued < ttl)
+
+    def create_job(self, template_ids):
+        job_id = uuid.uuid4().hex[:16]
+        with self.lock:
+            self.jobs[job_id] = {
+                'done_at': time.time() + sample_latency(self.settings.get('latency', {}).get('job'), self.rng),
+                'template_ids': template_ids,
+            }
+        return job_id
+
+    def kept_loci(self, template_ids):
+        """
+        Applies the drop rules to a submitted multiplex.
+
+        drop_loci: regex patterns of loci that never get primers.
+        poison_loci: regex patterns of loci that knock out other loci of the same multiplex
+                     with probability poison_knockout.
+        drop_rate: probability that any other locus is dropped.
+        The draws are seeded by the multiplex, so the same submission always gives the same result.
+        """
+        rules = self.settings.get('drop_rules', {})
+        drop = [re.compile(p) for p in rules.get('drop_loci', [])]
+        poison = [re.compile(p) for p in rules.get('poison_loci', [])]
+        rng = random.Random('\n'.join(template_ids))
+
+        poisoned = any(p.search(x) for p in poison for x in template_ids)
+        kept = []
+        for template_id in template_ids:
+            if any(p.search(template_id) for p in drop):
+                continue
+            is_poison = any(p.search(template_id) for p in poison)
+            if poisoned and not is_poison and rng.random() < float(rules.get('poison_knockout', 0.5)):
+                continue
+            if rng.random() < float(rules.get('drop_rate', 0)):
+                continue
+            kept.append(template_id)
+        return kept
+
+
+def render_result(template_ids):
+    """
+    Renders a result file in the MFEPrimer multiplex CSV layout: three preamble lines,
+    the header, one row per primer pair and a trailing summary line.
+    """
+    lines = ['MFEPrimer-3.0 multiplex PCR design (local stand-in)', 'Database,hg19.fa', 'Generated,' +
+             time.strftime('%Y-%m-%d %H:%M:%S'), ','.join(COLUMNS)]
+    for i, template_id in enumerate(template_ids, start=1):
+        rng = random.Random(template_id)
+        lines.append(','.join(str(x) for x in [
+            f'T1P{i}', template_id, fake_primer(template_id, 'F'), fake_primer(template_id, 'R'),
+            round(rng.uniform(58, 62), 2), round(rng.uniform(58, 62), 2), round(rng.uniform(40, 60), 2),
+            round(rng.uniform(40, 60), 2), rng.randint(80, 120), round(rng.uniform(40, 60), 2)
+        ]))
+    lines.append(f'Total,{len(template_ids)}' + ',' * (len(COLUMNS) - 2))
+    return '\n'.join(lines) + '\n'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    state = None
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send(self, status, body, content_type='text/html; charset=utf-8', headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        state = self.state
+
+        if path == '/muld':
+            state.count('token')
+            time.sleep(state.latency('token'))
+            token = state.issue_token()
+            body = f'<html><body><form method="post"><input type="hidden" name="_xsrf" value="{token}">' \
+                   f'<textarea name="BedInput"></textarea></form></body></html>'
+            return self._send(200, body, headers={'Set-Cookie': f'_xsrf={token}; Path=/'})
+
+        if path == '/stats':
+            with state.lock:
+                body = json.dumps({**state.stats, 'jobs': len(state.jobs)})
+            return self._send(200, body, content_type='application/json')
+
+        match = re.fullmatch(r'/muld/(\w+)(/download)?', path)
+        if not match or match.group(1) not in state.jobs:
+            return self._send(404, 'Not Found')
+
+        job_id, job = match.group(1), state.jobs[match.group(1)]
+        if match.group(2):
+            state.count('download')
+            time.sleep(state.latency('download'))
+            if state.fail('download'):
+                return self._send(500, 'Internal Server Error')
+            body = render_result(state.kept_loci(job['template_ids']))
+            return self._send(200, body, content_type='text/csv; charset=utf-8')
+
+        state.count('status')
+        if time.time() < job['done_at']:
+            body = '<span class="badge badge-danger" id="shuaxin">Running...</span>'
+        else:
+            body = f'<span class="badge badge-success" id="shuaxin">Done</span>' \
+                   f'<a href="/muld/{job_id}/download">Download</a>'
+        return self._send(200, body)
+
+    def do_POST(self):
+        state = self.state
+        if urlparse(self.path).path.rstrip('/') != '/muld':
+            return self._send(404, 'Not Found')
+
+        length = int(self.headers.get('Content-Length', 0))
+        form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+        state.count('submit')
+        time.sleep(state.latency('submit'))
+
+        if not state.token_valid(form.get('_xsrf')):
+            state.count('rejected')
+            return self._send(403, "XSRF cookie does not match POST argument")
+        if state.fail('submit'):
+            return self._send(500, 'Internal Server Error')
+
+        template_ids = []
+        for line in form.get('BedInput', '').splitlines():
+            fields = line.split()
+            if len(fields) >= 3:
+                template_ids.append(f'{fields[0]}:{fields[1]}-{fields[2]}')
+
+        job_id = state.create_job(template_ids)
+        return self._send(200, f'<a href="/muld/{job_id}/">{job_id}</a>')
+
+
+def serve(host, port, settings, seed=None):
+    """
+    Creates the stand-in server.
+
+    :param host: Interface to listen on.
+    :param port: Port to listen on.
+    :param settings: Dictionary with latency, failure_rate, token_ttl and drop_rules.
+    :param seed: Seed of the latency and failure draws.
+    :return: The server instance; call serve_forever to handle requests.
+    """
+    StubHandler.state = StubState(settings, seed=seed)
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    logger.info(f'MFEPrimer stand-in listening on http://{host}:{server.server_port}/muld')
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local MFEPrimer stand-in service for testing and benchmarking.')
+    parser.add_argument('--host', default='127.0.0.1', dest='host',
+                        help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=8090, dest='port',
+                        help='Port to listen on.')
+    parser.add_argument('--seed', type=int, default=None, dest='seed',
+                        help='Seed of the latency and failure draws.')
+    parser.add_argument('--settings', dest='settings',
+                        help='YAML file overriding the mfe_stub section of config.yaml.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    settings = dict(config.get('mfe_stub') or {})
+    if args.settings:
+        with open(args.settings, 'r', encoding='utf-8') as f:
+            settings.update(yaml.load(f, Loader=yaml.FullLoader) or {})
+
+    server = serve(args.host, args.port, settings, seed=args.seed)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/28 10:05
+@Author  : lbfeng
+@File    : monitor_schema.py
+"""
+import json
+import logging
+import argparse
+import datetime
+import contextlib
+from sqlalchemy import MetaData, Table, Column, Integer, String, Text, DateTime, DDL, event, inspect, text
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+# Same columns as the table create_df_table used to derive from the order info DataFrame, so existing
+# tables and new ones hold the same rows
+monitor_order = Table(
+    'monitor_order', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('SampleID', String(255), nullable=False),
+    Column('OrderFile', Text),
+    Column('ReviewStatus', String(255)),
+    Column('EmailSent', Integer, server_default=text('0')),
+    Column('DesignDate', DateTime),
+    Column('OrderDate', DateTime),
+    Column('OrderCompany', String(255)),
+    Column('CreatedAt', DateTime, server_default=text('CURRENT_TIMESTAMP')),
+    Column('UpdatedAt', DateTime, server_default=text('CURRENT_TIMESTAMP')),
+)
+event.listen(monitor_order, 'after_create', DDL(
+    'ALTER TABLE monitor_order MODIFY `UpdatedAt` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP'
+).execute_if(dialect='mysql'))
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', Integer, primary_key=True, autoincrement=False),
+    Column('description', String(255), nullable=False),
+    Column('applied', DateTime, nullable=False),
+)
+
+
+def index_names(conn, table_name):
+    return {index['name'] for index in inspect(conn).get_indexes(table_name)}
+
+
+def create_monitor_order(conn):
+    if not inspect(conn).has_table('monitor_order'):
+        monitor_order.create(conn)
+
+
+def dedupe_sample_ids(conn):
+    """
+    Keeps only the most recent row of each sample; concurrent upserts could insert a sample twice.
+    """
+    pk = inspect(conn).get_pk_constraint('monitor_order')['constrained_columns'][0]
+    result = conn.execute(text(f"""
+        DELETE FROM monitor_order WHERE {pk} NOT IN (
+            SELECT keep_id FROM (SELECT MAX({pk}) AS keep_id FROM monitor_order GROUP BY SampleID) AS keep
+        )
+    """))
+    if result.rowcount:
+        logger.warning(f'Removed {result.rowcount} duplicate monitor_order rows.')
+
+
+def unique_sample_id(conn):
+    if 'uq_monitor_order_SampleID' not in index_names(conn, 'monitor_order'):
+        conn.execute(text('CREATE UNIQUE INDEX uq_monitor_order_SampleID ON monitor_order (SampleID)'))
+
+
+def index_pending_orders(conn):
+    # Pending orders of a vendor (batch_orders, the review poller): WHERE EmailSent = 0 AND OrderCompany = ...
+    if 'ix_monitor_order_EmailSent_OrderCompany' not in index_names(conn, 'monitor_order'):
+        conn.execute(text('CREATE INDEX ix_monitor_order_EmailSent_OrderCompany '
+                          'ON monitor_order (EmailSent, OrderCompany)'))
+
+
+# Applied in order; each migration runs once and is recorded in schema_migrations.
+# Append new migrations at the end, never renumber or edit an applied one.
+MIGRATIONS = [
+    (1, 'create monitor_order', create_monitor_order),
+    (2, 'remove duplicate SampleID rows of monitor_order', dedupe_sample_ids),
+    (3, 'unique key on monitor_order.SampleID', unique_sample_id),
+    (4, 'index on monitor_order (EmailSent, OrderCompany)', index_pending_orders),
+]
+
+
+@contextlib.contextmanager
+def migration_lock(conn, timeout=60):
+    """
+    Serializes migrations of concurrent processes; MySQL only, other databases lock the tables themselves.
+    """
+    if conn.dialect.name != 'mysql':
+        yield
+        return
+    if not conn.execute(text('SELECT GET_LOCK(:name, :timeout)'), {'name': 'monitor_schema', 'timeout': timeout}).scalar():
+        raise TimeoutError('Another process holds the monitor_schema migration lock.')
+    try:
+        yield
+    finally:
+        conn.execute(text('SELECT RELEASE_LOCK(:name)'), {'name': 'monitor_schema'})
+
+
+def applied_versions(conn):
+    if not inspect(conn).has_table('schema_migrations'):
+        return set()
+    return {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def migrate(engine):
+    """
+    Applies the migrations of the monitor database that have not been applied yet.
+
+    :param engine: SQLAlchemy engine of the monitor database.
+    :return: List of the versions applied by this call.
+    """
+    with engine.connect() as conn:
+        if {version for version, _, _ in MIGRATIONS} <= applied_versions(conn):
+            return []
+
+        applied = []
+        with migration_lock(conn):
+            schema_migrations.create(conn, checkfirst=True)
+            conn.commit()
+            done = applied_versions(conn)
+            for version, description, apply in MIGRATIONS:
+                if version in done:
+                    continue
+                apply(conn)
+                conn.execute(schema_migrations.insert().values(version=version, description=description,
+                                                               applied=datetime.datetime.now()))
+                conn.commit()
+                logger.info(f'Applied monitor schema migration {version}: {description}')
+                applied.append(version)
+        return applied
+
+
+def main():
+    import primer_design
+
+    parser = argparse.ArgumentParser(description='Apply the schema migrations of the monitor database.')
+    parser.add_argument('--status', action='store_true', dest='status',
+                        help='Only show the applied and pending migrations.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    engine = primer_design.db_handler.get_engine()
+    if not args.status:
+        migrate(engine)
+    with engine.connect() as conn:
+        done = applied_versions(conn)
+    print(json.dumps({
+        'applied': [f'{version}: {description}' for version, description, _ in MIGRATIONS if version in done],
+        'pending': [f'{version}: {description}' for version, description, _ in MIGRATIONS if version not in done],
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/23 09:30
+@Author  : lbfeng
+@File    : order_layout.py
+"""
+import copy
+import logging
+import itertools
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils.indexed_list import IndexedList
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+# Style tables of an openpyxl Workbook; openpyxl has no public API to share them between workbooks
+STYLE_TABLES = ['_fonts', '_fills', '_borders', '_alignments', '_protections', '_number_formats', '_cell_styles']
+
+
+def order_rows(df_order, layout):
+    """
+    Arranges the primer order rows as the vendor expects them.
+
+    :param df_order: DataFrame from process_primer_order (PrimerName, Sequence, TubeCount, ...), sorted by PrimerName.
+    :param layout: Vendor layout dictionary (see order_layouts in config.yaml).
+    :return: List of DataFrames, one per block; blocks are separated by layout['gap_rows'] empty rows.
+    """
+    blocks = layout.get('blocks')
+    if not blocks:
+        return [df_order]
+
+    # Each block holds the primers whose name ends with the block suffix, e.g. all forward (F) then all reverse (R)
+    names = df_order['PrimerName'].astype(str)
+    return [df_order[names.str.endswith(suffix)] for suffix in blocks]
+
+
+def write_columns(ws, start_row, columns):
+    """
+    Writes column arrays into a worksheet, one pass per column.
+
+    :param ws: openpyxl worksheet.
+    :param start_row: Row of the first value.
+    :param columns: Dictionary of column number -> list of values.
+    """
+    for column, values in columns.items():
+        for row, value in enumerate(values, start=start_row):
+            ws.cell(row, column).value = value
+
+
+def render_order(wb, layout, df_order, df_trial):
+    """
+    Renders a primer order into a vendor template workbook.
+
+    The layout gives the order sheet, the first row, a column number -> df_order column mapping, constant
+    values written next to every primer, and the block order with separator rows.
+    The trial sheet gets the primer pair table appended, with or without its header.
+
+    :param wb: openpyxl Workbook of the vendor template (a fresh copy, modified in place).
+    :param layout: Vendor layout dictionary (see order_layouts in config.yaml).
+    :param df_order: DataFrame from process_primer_order.
+    :param df_trial: DataFrame of primer pairs for the trial sheet.
+    :return: The workbook.
+    """
+    ws = wb[layout['sheet']]
+    row = int(layout['start_row'])
+    gap_rows = int(layout.get('gap_rows', 0))
+
+    for i, df_block in enumerate(order_rows(df_order, layout)):
+        if i and gap_rows:
+            # Separator rows between blocks stay empty even if the template has content there
+            write_columns(ws, row, {int(column): [None] * gap_rows for column in layout['columns']})
+            row += gap_rows
+
+        columns = {int(column): df_block[name].tolist() for column, name in layout['columns'].items()}
+        for column, value in (layout.get('constants') or {}).items():
+            columns[int(column)] = [value] * df_block.shape[0]
+
+        write_columns(ws, row, columns)
+        row += df_block.shape[0]
+
+    trial = layout.get('trial_sheet')
+    if trial:
+        ws_trial = wb[trial]
+        if layout.get('trial_header', False):
+            ws_trial.append(df_trial.columns.tolist())
+        for values in df_trial.astype(object).where(pd.notna(df_trial), None).values.tolist():
+            ws_trial.append(values)
+
+    return wb
+
+
+def order_row_values(df_order, layout):
+    """
+    Yields the cells of every row of the order sheet, block separators included.
+
+    :return: Iterator of dictionaries column number -> value; separator rows clear the mapped columns.
+    """
+    columns = [(int(column), name) for column, name in layout['columns'].items()]
+    constants = {int(column): value for column, value in (layout.get('constants') or {}).items()}
+    gap_rows = int(layout.get('gap_rows', 0))
+
+    for i, df_block in enumerate(order_rows(df_order, layout)):
+        if i and gap_rows:
+            for _ in range(gap_rows):
+                yield {column: None for column, _ in columns}
+        names = [name for _, name in columns]
+        for values in df_block[names].itertuples(index=False, name=None):
+            row = dict(constants)
+            row.update(zip((column for column, _ in columns), values))
+            yield row
+
+
+def copy_cell(ws, src, value=_MISSING):
+    """
+    Creates a write-only cell with the value and style of a template cell.
+    """
+    cell = WriteOnlyCell(ws, value=src.value if value is _MISSING else value)
+    if src.has_style:
+        # The workbook shares the template's style tables (see stream_order), so the style ids stay valid
+        cell._style = copy.copy(src._style)
+    return cell
+
+
+def template_rows(src):
+    """
+    Reads a template worksheet into a dictionary of row number -> {column number: cell}, keeping only cells
+    that hold a value or a style.
+    """
+    rows = {}
+    for row in src.iter_rows():
+        for cell in row:
+            if cell.value is not None or cell.has_style:
+                rows.setdefault(cell.row, {})[cell.column] = cell
+    return rows
+
+
+def stream_sheet(ws, src, data_start=None, data_rows=(), append_rows=()):
+    """
+    Streams one template sheet into a write-only sheet. Rows before data_start are copied from the template,
+    data rows are laid over the template rows from data_start on, then the remaining template rows are copied
+    and append_rows are added.
+
+    :param ws: Write-only worksheet.
+    :param src: Template worksheet.
+    :param data_start: Row of the first data row, or None if the sheet gets no data rows.
+    :param data_rows: Iterator of dictionaries column number -> value.
+    :param append_rows: Iterator of value lists appended after the template rows.
+    """
+    rows = template_rows(src)
+    max_row = max(rows, default=0)
+
+    # Sheet level formatting of the template
+    for key, dimension in src.column_dimensions.items():
+        if dimension.width:
+            ws.column_dimensions[key].width = dimension.width
+        ws.column_dimensions[key].hidden = dimension.hidden
+    for range_ in src.merged_cells.ranges:
+        ws.merged_cells.add(str(range_))
+    for validation in src.data_validations.dataValidation:
+        ws.data_validations.append(copy.copy(validation))
+    ws.conditional_formatting = src.conditional_formatting
+    ws.freeze_panes = src.freeze_panes
+    ws.sheet_state = src.sheet_state
+
+    def emit(r, cells, values=None):
+        if r in src.row_dimensions and src.row_dimensions[r].height:
+            ws.row_dimensions[r].height = src.row_dimensions[r].height
+        values = values or {}
+        line = [None] * max(list(cells) + list(values), default=0)
+        for column, (cell, value) in cells.items():
+            line[column - 1] = copy_cell(ws, cell, values.get(column, value))
+        for column, value in values.items():
+            if column not in cells:
+                line[column - 1] = value
+        ws.append(line)
+
+    def template_cells(r):
+        return {column: (cell, _MISSING) for column, cell in rows.get(r, {}).items()}
+
+    r = 1
+    if data_start is not None:
+        for r in range(1, data_start):
+            emit(r, template_cells(r))
+        r = data_start
+        for values in data_rows:
+            emit(r, template_cells(r), values)
+            r += 1
+
+    for r in range(r, max_row + 1):
+        emit(r, template_cells(r))
+    for values in append_rows:
+        ws.append(values)
+
+
+def stream_order(path, template_wb, layout, df_order, df_trial):
+    """
+    Writes a primer order with a write-only workbook, so the rows are streamed to disk instead of
+    being built up in memory. The template sheets, including the header block of the order sheet,
+    are copied with their values, styles, merged cells, column widths, row heights and data validations;
+    images and charts of the template are not copied.
+
+    :param path: Path of the xlsx file to write.
+    :param template_wb: openpyxl Workbook of the vendor template.
+    :param layout: Vendor layout dictionary (see order_layouts in config.yaml).
+    :param df_order: DataFrame from process_primer_order.
+    :param df_trial: DataFrame of primer pairs for the trial sheet.
+    :return: The path.
+    """
+    wb = Workbook(write_only=True)
+    # Start from the template's style tables, so that unstyled cells keep the template's default style
+    for name in STYLE_TABLES:
+        setattr(wb, name, IndexedList(getattr(template_wb, name)))
+    wb._differential_styles = copy.deepcopy(template_wb._differential_styles)
+    trial = layout.get('trial_sheet')
+
+    for src in template_wb.worksheets:
+        ws = wb.create_sheet(src.title)
+        if src.title == layout['sheet']:
+            stream_sheet(ws, src, data_start=int(layout['start_row']), data_rows=order_row_values(df_order, layout))
+        elif src.title == trial:
+            header = [df_trial.columns.tolist()] if layout.get('trial_header', False) else []
+            rows = (list(values) for values in df_trial.astype(object).where(pd.notna(df_trial), None)
+                    .itertuples(index=False, name=None))
+            stream_sheet(ws, src, append_rows=itertools.chain(header, rows))
+        else:
+            stream_sheet(ws, src)
+
+    wb.save(path)
+    return path
+
+
+def write_sidecars(df, base_path, formats, chunk_rows=10000):
+    """
+    Writes machine readable copies of the order next to the workbook, chunk by chunk.
+
+    :param df: DataFrame of the order rows.
+    :param base_path: Path without extension; '.csv' and '.parquet' are appended.
+    :param formats: Iterable of 'csv' and/or 'parquet'.
+    :param chunk_rows: Rows per written chunk (Parquet row group).
+    :return: List of written paths.
+    """
+    paths = []
+    if 'csv' in formats:
+        path = f'{base_path}.csv'
+        df.to_csv(path, index=False, chunksize=chunk_rows, encoding='utf-8-sig')
+        paths.append(path)
+    if 'parquet' in formats:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = f'{base_path}.parquet'
+        writer = None
+        try:
+            for start in range(0, max(len(df), 1), chunk_rows):
+                table = pa.Table.from_pandas(df.iloc[start:start + chunk_rows], preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        paths.append(path)
+    return paths
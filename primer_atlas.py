@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/20 10:20
+@Author  : lbfeng
+@File    : primer_atlas.py
+"""
+import os
+import json
+import logging
+import argparse
+import threading
+import concurrent.futures
+import primer_cache
+import primer_design
+from primer_design import config, db_handler, read_hots_file, prepare_hotspots, hotspot_template_ids
+
+logger = logging.getLogger(__name__)
+
+
+def template_id_to_bed(template_id):
+    """
+    Converts a TemplateID such as 'chr1:100-102' back into a BED line.
+    """
+    chrom, span = template_id.rsplit(':', 1)
+    start, end = span.split('-')
+    return f'{chrom}\t{start}\t{end}'
+
+
+def load_hotspot_groups():
+    """
+    Collects the hotspot loci of every CANCER_TYPE_ID in the hotspot file.
+
+    :return: Dictionary of group name -> list of TemplateIDs. A locus shared by several cancer types
+             is only kept in the first group it appears in.
+    """
+    df_hots, cancer_ids = read_hots_file()
+    groups, seen = {}, set()
+    for cancer_id in cancer_ids:
+        template_ids = [x for x in hotspot_template_ids(prepare_hotspots(df_hots, [cancer_id])).drop_duplicates()
+                        if x not in seen]
+        seen.update(template_ids)
+        if template_ids:
+            groups[f'hots-{cancer_id}'] = template_ids
+    return groups
+
+
+def load_driver_group(min_samples):
+    """
+    Collects the driver loci that were selected in at least min_samples samples.
+
+    :param min_samples: Minimum number of samples a driver locus must appear in.
+    :return: List of TemplateIDs.
+    """
+    query = f"""
+        SELECT TemplateID, COUNT(DISTINCT sampleSn) AS samples FROM mrd_selection
+        WHERE driver = 1 GROUP BY TemplateID HAVING samples >= {int(min_samples)}
+    """
+    try:
+        df = db_handler.query_df(query)
+    except Exception as e:
+        logger.warning(f'Unable to read recurrent driver loci from mrd_selection: {e}')
+        return []
+    return df['TemplateID'].dropna().tolist()
+
+
+class AtlasState:
+    """
+    Records finished atlas jobs in a JSON file so that an interrupted run can be resumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.done = json.load(f).get('done', {})
+
+    def mark_done(self, job_key, group, submitted, returned):
+        with self._lock:
+            self.done[job_key] = {'group': group, 'submitted': submitted, 'returned': returned}
+            tmp_path = f'{self.path}.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'done': self.done}, f)
+            os.replace(tmp_path, self.path)
+
+
+def run_job(url, outcome_dir, state, group, template_ids, round_num):
+    """
+    Designs one multiplex of atlas loci and records the returned primer pairs in the locus store.
+
+    :return: List of TemplateIDs that came back with primers.
+    """
+    PRIMER_PARAMS = config['PRIMER_PARAMS']
+    result_string = '\n'.join(template_id_to_bed(x) for x in template_ids)
+    job_key = primer_cache.make_key(result_string, PRIMER_PARAMS, url)
+    if job_key in state.done:
+        return None
+
+    df_res, _ = primer_design.design_primers_core(url, outcome_dir, f'atlas-{group}', result_string,
+                                                  file_suffix=f'r{round_num}-{job_key[:8]}')
+    primer_design.locus_db.record(df_res, *primer_design.locus_key(url), submitted_ids=template_ids,
+                                  sample_id=group, source='atlas')
+    returned = df_res['TemplateID'].tolist()
+    state.mark_done(job_key, group, len(template_ids), len(returned))
+    return returned
+
+
+def build_atlas(groups, url, outcome_dir, chunk_sizes, workers):
+    """
+    Pre-designs primers for every locus in the groups. Each round submits the loci that are still
+    missing in smaller multiplexes, so a locus that only fails next to others is resolved in a later round.
+
+    :param groups: Dictionary of group name -> list of TemplateIDs.
+    :param url: URL of the primer design service (MFEPrimer or a local stand-in).
+    :param outcome_dir: Directory for result files and the resume state.
+    :param chunk_sizes: Multiplex size of each round, e.g. [20, 5, 1].
+    :param workers: Number of concurrent design jobs.
+    """
+    key = primer_design.locus_key(url)
+    state = AtlasState(os.path.join(outcome_dir, 'atlas_state.json'))
+
+    for round_num, chunk_size in enumerate(chunk_sizes, start=1):
+        jobs = []
+        for group, template_ids in groups.items():
+            known, unknown, failing = primer_design.locus_db.validate_panel(template_ids, *key)
+            jobs.extend((group, unknown[i:i + chunk_size]) for i in range(0, len(unknown), chunk_size))
+
+        logger.info(f'Atlas round {round_num}: {len(jobs)} jobs of up to {chunk_size} loci.')
+        if not jobs:
+            break
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(run_job, url, outcome_dir, state, group, ids, round_num): group
+                       for group, ids in jobs}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'Atlas job for {futures[future]} failed: {e}')
+
+    for group, template_ids in groups.items():
+        known, unknown, failing = primer_design.locus_db.validate_panel(template_ids, *key, min_attempts=1)
+        logger.info(f'{group}: {len(known)} loci with primers, {len(failing)} loci without primers, '
+                    f'{len(unknown)} loci not designed.')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pre-design primers for hotspot and recurrent driver loci.')
+    parser.add_argument('-o', '--output_dir', default='./primer_atlas', dest='output_dir',
+                        help='Output directory for atlas results and the resume state.')
+    parser.add_argument('--url', default=config['mfe_primer'], dest='url',
+                        help='URL for primer design API (MFEPrimer or a local stand-in).')
+    parser.add_argument('--workers', type=int, default=4, dest='workers',
+                        help='Number of concurrent design jobs.')
+    parser.add_argument('--chunk-sizes', default='20,5,1', dest='chunk_sizes',
+                        help='Comma separated multiplex size of each design round.')
+    parser.add_argument('--min-samples', type=int, default=3, dest='min_samples',
+                        help='Minimum number of samples a driver locus must appear in.')
+    parser.add_argument('--skip-hot', action='store_true', dest='skip_hot',
+                        help='Do not design hotspot loci.')
+    parser.add_argument('--skip-driver', action='store_true', dest='skip_driver',
+                        help='Do not design recurrent driver loci.')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                        help='Do not read or write the MFEPrimer result cache.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    outcome_dir = os.path.abspath(args.output_dir)
+    os.makedirs(outcome_dir, exist_ok=True)
+    primer_design.result_cache = primer_design.init_result_cache(no_cache=args.no_cache)
+    primer_design.locus_db = primer_design.init_locus_store()
+    primer_design.design_limiter = primer_design.init_rate_limiter()
+    if primer_design.locus_db is None:
+        parser.error('The locus store is disabled in config.yaml; the atlas has nowhere to store primers.')
+
+    groups = {} if args.skip_hot else load_hotspot_groups()
+    if not args.skip_driver:
+        driver_ids = load_driver_group(args.min_samples)
+        if driver_ids:
+            groups['driver'] = driver_ids
+
+    chunk_sizes = [int(x) for x in args.chunk_sizes.split(',') if x.strip()]
+    build_atlas(groups, args.url, outcome_dir, chunk_sizes, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/19 09:30
+@Author  : lbfeng
+@File    : primer_cache.py
+"""
+import os
+import re
+import gzip
+import json
+import time
+import hashlib
+import logging
+import pandas as pd
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_bed(result_string):
+    """
+    Normalises a BED submission string so that cosmetic differences do not change the cache key.
+    Blank lines are dropped, fields are re-joined with tabs and the locus order is preserved,
+    because the order decides the primer IDs (T1P1, T1P2, ...) returned by MFEPrimer.
+
+    :param result_string: BED string submitted to MFEPrimer (chrom, start, end per line).
+    :return: The normalised BED string.
+    """
+    lines = []
+    for line in result_string.splitlines():
+        fields = re.split(r'\s+', line.strip())
+        if fields and fields[0]:
+            lines.append('\t'.join(fields))
+    return '\n'.join(lines)
+
+
+def params_hash(params):
+    """
+    Returns a stable hash of the primer design parameters.
+
+    :param params: Dictionary of primer design parameters, e.g. config['PRIMER_PARAMS'].
+    :return: Hex digest of the parameters.
+    """
+    payload = json.dumps({str(k): str(v) for k, v in (params or {}).items()}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def service_id(url):
+    """
+    Returns the scheme and host of a primer design service, so that results of different services
+    (MFEPrimer, a local stand-in started by mfe_stub.py) are never mixed up.
+
+    :param url: URL of the primer design service, e.g. 'http://mfeprimer.example.com/muld'.
+    :return: String such as 'http://mfeprimer.example.com'.
+    """
+    parsed = urlparse(url or '')
+    return f'{parsed.scheme}://{parsed.netloc}'.lower()
+
+
+def make_key(result_string, params, url):
+    """
+    Builds the content address of a primer design submission.
+
+    :param result_string: BED string submitted to MFEPrimer.
+    :param params: Dictionary of primer design parameters.
+    :param url: URL of the primer design service the submission is sent to.
+    :return: Hex digest identifying the submission.
+    """
+    payload = normalize_bed(result_string) + '\n#' + params_hash(params) + '\n@' + service_id(url)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PrimerCache:
+    """
+    On-disk cache of parsed MFEPrimer results, stored as one parquet file per submission next to the
+    gzip-compressed result file as downloaded, so that a hit can archive the same file as a miss.
+    Entries are evicted by age and, least recently used first, by total size and entry count.
+    """
+
+    def __init__(self, cache_dir, max_size_mb=512, max_entries=5000, max_age_days=30, refresh=False):
+        """
+        :param cache_dir: Directory holding the cache entries.
+        :param max_size_mb: Maximum total size of the cache in MB.
+        :param max_entries: Maximum number of cached submissions.
+        :param max_age_days: Entries older than this are treated as misses and removed.
+        :param refresh: If True, lookups always miss but new results are still stored.
+        """
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = int(float(max_size_mb) * 1024 * 1024)
+        self.max_entries = int(max_entries)
+        self.max_age = float(max_age_days) * 86400
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.parquet')
+
+    @staticmethod
+    def raw_path(path):
+        return path[:-len('.parquet')] + '.raw.gz'
+
+    def get_raw(self, key):
+        """
+        Returns the MFEPrimer result file of a cached submission as downloaded.
+
+        :param key: Key returned by make_key.
+        :return: Bytes of the result file, or None if the entry has none.
+        """
+        try:
+            with gzip.open(self.raw_path(self.path(key)), 'rb') as f:
+                return f.read()
+        except (OSError, EOFError):
+            return None
+
+    def get(self, key):
+        """
+        Looks up a cached result.
+
+        :param key: Key returned by make_key.
+        :return: The cached DataFrame, or None on a miss.
+        """
+        path = self.path(key)
+        if self.refresh or not os.path.exists(path):
+            self.misses += 1
+            return None
+
+        if not os.path.exists(self.raw_path(path)):
+            # Entries written before the result file was cached cannot reproduce the archived result file
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        if time.time() - os.path.getmtime(path) > self.max_age:
+            logger.info(f'Primer cache entry {key[:12]} expired, removing it.')
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            df = pd.read_parquet(path)
+        except Exception as e:
+            logger.warning(f'Primer cache entry {key[:12]} is unreadable and will be removed: {e}')
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        # 访问时间用于 LRU 淘汰，保留修改时间用于过期判断
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        self.hits += 1
+        return df
+
+    def put(self, key, df, raw=None):
+        """
+        Stores a parsed result and evicts old entries if the cache grows too large.
+
+        :param key: Key returned by make_key.
+        :param df: DataFrame parsed from the MFEPrimer result file.
+        :param raw: Bytes of the result file as downloaded.
+        :return: Path of the cache entry.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if raw is not None:
+            # Written before the parquet file, so that every readable entry has its result file
+            tmp_path = f'{self.raw_path(path)}.{os.getpid()}.tmp'
+            with gzip.open(tmp_path, 'wb') as f:
+                f.write(raw)
+            os.replace(tmp_path, self.raw_path(path))
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        self.evict()
+        return path
+
+    def evict(self):
+        """
+        Removes expired entries, then the least recently used ones until the size and count limits hold.
+        """
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.parquet'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                    raw_size = os.path.getsize(self.raw_path(path)) if os.path.exists(self.raw_path(path)) else 0
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    self._remove(path)
+                else:
+                    entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size + raw_size, path))
+
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        while entries and (total_size > self.max_size or len(entries) > self.max_entries):
+            _, size, path = entries.pop(0)
+            self._remove(path)
+            total_size -= size
+
+    @classmethod
+    def _remove(cls, path):
+        for entry_path in (path, cls.raw_path(path)):
+            try:
+                os.remove(entry_path)
+            except FileNotFoundError:
+                pass
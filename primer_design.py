@@ -11,6 +11,7 @@ import re
 import sys
 import json
 import time
+import hashlib
 import pandas as pd
 import numpy as np
 import primkit as pt
@@ -19,12 +20,23 @@ import logging
 import argparse
 import yaml
 import datetime
-import openpyxl
+import contextlib
+import concurrent.futures
 from urllib.parse import urlparse
-from sqlalchemy import text
+from sqlalchemy import text, bindparam
 from sqlalchemy.exc import SQLAlchemyError
 import warnings
 import http_api
+import primer_cache
+import locus_store
+import mfe_session
+import rate_limiter
+import mail_outbox
+import qc_digest
+import review_schedule
+import monitor_schema
+import template_cache
+import order_layout
 
 warnings.filterwarnings("ignore", category=UserWarning, module="openpyxl")
 
@@ -35,6 +47,147 @@ httpApi = http_api.HttpApi()
 
 sid = 0
 
+# MFEPrimer 结果缓存，在 design_sample 中根据命令行参数初始化
+result_cache = None
+
+# 跨样本位点引物库，在 design_sample 中初始化
+locus_db = None
+
+# MFEPrimer 会话，按 URL 复用 token、cookies 与连接池
+mfe_sessions = {}
+
+# 跨进程的远程设计任务限流器与当前样本的优先级（距退出阈值的天数，越小越优先），在 design_sample 中初始化
+design_limiter = None
+design_priority = None
+
+# CMS 审核状态：审核通过 / 检测中
+REVIEW_APPROVED = ['YWC', 'YSH', 'BGYSH']
+REVIEW_PENDING = ['JCZ', 'DSH', 'BGDSH']
+
+# 邮件发件箱服务，首次发送邮件时初始化；为 None 且已初始化时表示直接发送
+mail_service = None
+mail_ledger = None
+mail_service_ready = False
+
+# 非紧急质控通知的汇总缓存，首次使用时初始化
+qc_notices = None
+qc_notices_ready = False
+
+# CMS 审核状态检测：历史审核时长模型（定期刷新）、每周期请求预算与本进程已记录的样本状态
+review_model = None
+review_model_loaded = 0
+cms_budget = None
+cms_budget_ready = False
+review_status_seen = {}
+
+# 解析后的热点文件 (路径与版本, DataFrame, CANCER_TYPE_ID 列表)
+hots_cache = None
+
+# monitor_order 表结构迁移是否已检查（每个进程一次）
+monitor_schema_ready = False
+
+# 设计进度回调，由 worker_pool.py 的工作进程设置，参数为 (stage, info)
+progress_hook = None
+
+
+class DesignError(Exception):
+    """
+    Raised when the design of a sample cannot go on. exit_code is the exit code of the command line.
+    """
+    exit_code = 1
+
+    def __init__(self, message, sample_id=None):
+        super().__init__(message)
+        self.sample_id = sample_id
+
+
+class LociFileError(DesignError):
+    """
+    The loci file cannot be read or its cancer type cannot be resolved.
+    """
+
+
+class HotspotFileError(DesignError):
+    """
+    The hotspots file of config.yaml cannot be read.
+    """
+
+
+class CmsError(DesignError):
+    """
+    The CMS system could not be queried or does not know the sample.
+    """
+
+
+class QcError(DesignError):
+    """
+    The sample or its primer results failed a quality control check; the reviewers have been notified.
+    """
+
+
+class OrderError(DesignError):
+    """
+    The order could not be written, or its monitor_order record is in an unexpected state.
+    """
+
+
+class ReviewTerminated(DesignError):
+    """
+    The CMS review of the sample ended without approval; the order will not be sent.
+    """
+
+
+class SampleStopped(DesignError):
+    """
+    The sample needs no primer design ('skipped') or was handed to the reviewers ('held'). Not an error.
+    """
+    exit_code = 0
+
+    def __init__(self, message, sample_id=None, status='skipped'):
+        super().__init__(message, sample_id)
+        self.status = status
+
+
+class SampleResult:
+    """
+    Outcome of design_sample.
+
+    status is 'ordered' when the order file was written, 'skipped' when the sample needs no primer design and
+    'held' when it was handed to the reviewers. review is the outcome of check_order with run_order, else None.
+    """
+
+    def __init__(self, sample_id, status, order_file=None, primers=0, review=None, message='', seconds=0.0):
+        self.sample_id = sample_id
+        self.status = status
+        self.order_file = order_file
+        self.primers = primers
+        self.review = review
+        self.message = message
+        self.seconds = seconds
+
+    def to_dict(self):
+        return {'sample_id': self.sample_id, 'status': self.status, 'order_file': self.order_file,
+                'primers': self.primers, 'review': self.review, 'message': self.message,
+                'seconds': round(self.seconds, 3)}
+
+    def __repr__(self):
+        return f'SampleResult({self.sample_id!r}, {self.status!r}, order_file={self.order_file!r})'
+
+
+def report_progress(stage, **info):
+    """
+    Reports the stage of the current sample to progress_hook, if one is set. A failing hook never stops the design.
+
+    :param stage: 'checks', 'loci', 'driver', 'design', 'order' or 'review'.
+    :param info: Details of the stage, e.g. iteration and primers of 'design'.
+    """
+    if progress_hook is None:
+        return
+    try:
+        progress_hook(stage, info)
+    except Exception as e:
+        logger.warning(f'Progress of stage {stage} not reported: {e}')
+
 
 def doBack(info, path):
     global sid
@@ -57,9 +210,11 @@ db_url = f"mysql+pymysql://{db_config['user']}:{db_config['passwd']}@{db_config[
 db_handler = pt.DatabaseHandler(db_url)
 
 
-def emit(subject, message, attachments=None, to_addrs=None, cc_addrs=None, bcc_addrs=None):
+def emit(subject, message, attachments=None, to_addrs=None, cc_addrs=None, bcc_addrs=None, reason=None,
+         sample_id=None, kind=None, once=False):
     """
-    Sends an email with the given parameters.
+    Sends an email with the given parameters. With the outbox enabled in config.yaml the email is queued
+    and the call returns immediately.
 
     :param subject: Subject of the email.
     :param message: Body of the email.
@@ -67,17 +222,83 @@ def emit(subject, message, attachments=None, to_addrs=None, cc_addrs=None, bcc_a
     :param to_addrs: List of email addresses to send the email to. Default is taken from config.
     :param cc_addrs: List of email addresses for CC. Default is None.
     :param bcc_addrs: List of email addresses for BCC. Default is None.
+    :param reason: Reason of a non-critical QC notification (see qc_digest.REASONS). Such notifications are
+                   collected into a digest unless the digest is disabled or the reason is configured as immediate.
+    :param sample_id: Sample the email is about, used to group the digest and recorded in the sent mail ledger.
+    :param kind: Kind of the email recorded in the sent mail ledger, e.g. 'order'. Defaults to the reason.
+    :param once: Skip the email if one with the same subject is in the sent mail ledger or still queued;
+                 True looks at the whole ledger, a number only at that many past days.
     """
-    email_manager = pt.EmailManager(config['emails']['login'], use_yagmail=True)
+    global mail_service, mail_ledger, mail_service_ready
 
     default_to_addrs = config['emails']['setup']['log_toaddrs'] if DEBUG else config['emails']['setup']['qc_toaddrs']
     to_addrs = to_addrs if to_addrs is not None else default_to_addrs
 
+    if reason and not (attachments or cc_addrs or bcc_addrs):
+        digest = get_qc_digest()
+        if digest and reason not in ((config.get('qc_digest') or {}).get('immediate') or []):
+            digest.add(reason, sample_id, subject, message, to_addrs)
+            flush_qc_digest()
+            return
+
     subject_prefix = '【MRD引物设计-测试】' if DEBUG else '【MRD引物设计】'
     subject = subject_prefix + subject
 
+    if not mail_service_ready:
+        mail_service = mail_outbox.init_mail_service(config)
+        mail_ledger = mail_outbox.open_ledger(config)
+        mail_service_ready = True
+
+    kind = kind or reason
+    if once:
+        within_days = None if once is True else once
+        if mail_ledger.was_sent(subject, within_days=within_days) or (mail_service and
+                                                                        mail_service.outbox.is_pending(subject)):
+            logger.info(f"Email '{subject}' was already sent, skipped.")
+            return
+
+    # The message is queued and sent by the outbox worker over a pooled SMTP connection
+    if mail_service:
+        mail_service.send(to_addrs, subject, message, cc_addrs=cc_addrs, bcc_addrs=bcc_addrs, attachments=attachments,
+                          sample_id=sample_id, kind=kind)
+        return
+
+    email_manager = pt.EmailManager(config['emails']['login'], use_yagmail=True)
     email_manager.send_email(to_addrs=to_addrs, subject=subject, message=message, cc_addrs=cc_addrs,
                              bcc_addrs=bcc_addrs, attachments=attachments)
+    mail_ledger.record(subject, sample_id=sample_id, kind=kind)
+
+
+def get_qc_digest():
+    """
+    Returns the QC notification digest of config.yaml, opening it on first use.
+
+    :return: A QcDigest instance, or None if the digest is disabled.
+    """
+    global qc_notices, qc_notices_ready
+    if not qc_notices_ready:
+        qc_notices = qc_digest.open_digest(config)
+        qc_notices_ready = True
+    return qc_notices
+
+
+def flush_qc_digest(force=False):
+    """
+    Sends the buffered QC notifications as digest emails if the oldest one has waited the digest interval.
+    Errors are logged and the notifications stay in the buffer, so that callers such as daemon loops keep running.
+
+    :param force: Send the digest now, e.g. at the end of a batch.
+    :return: Number of notifications sent.
+    """
+    digest = get_qc_digest()
+    if digest is None:
+        return 0
+    try:
+        return digest.flush(lambda subject, message, to_addrs: emit(subject, message, to_addrs=to_addrs),
+                            force=force)
+    except Exception as e:
+        logger.error(f'Failed to send the QC digest: {e}')
+        return 0
 
 
 def check_sample_date(sample_id, send_email=True, email_interval=None, exit_threshold=None):
@@ -88,7 +309,7 @@ def check_sample_date(sample_id, send_email=True, email_interval=None, exit_thre
     :param sample_id: The sample ID, e.g., 'NGS231115-194WX'.
     :param send_email: Flag indicating whether to send an email.
     :param email_interval: The interval in days at which to send emails.
-    :param exit_threshold: If set and the date difference exceeds this value, the program will exit.
+    :param exit_threshold: If set and the date difference exceeds this value, QcError is raised.
     :return: None
     """
     # Extract the date using a regular expression
@@ -113,7 +334,7 @@ def check_sample_date(sample_id, send_email=True, email_interval=None, exit_thre
                 subject = f"样本日期检查严重警告 - {sample_id}"
                 message = f"严重警告：样本ID {sample_id} 日期检查\n样本日期: {sample_date}\n当前日期: {current_date}\n日期差距: {date_difference} 天\n警告：样本日期与当前日期的差距已超过阈值 {exit_threshold} 天。\n程序将自动退出以防止进一步的数据处理。\n请立即检查相关数据并采取适当措施。"
                 emit(subject, message)
-            sys.exit(1)
+            raise QcError(msg, sample_id)
 
         if date_difference > email_interval:
             msg = f"Warning: The sample {sample_id} date differs from the current date by {date_difference} days, exceeding the interval of {email_interval} days."
@@ -121,7 +342,7 @@ def check_sample_date(sample_id, send_email=True, email_interval=None, exit_thre
             if send_email:
                 subject = f"样本日期检查警告 - {sample_id}"
                 message = f"警告：样本ID {sample_id} 日期检查\n样本日期: {sample_date}\n当前日期: {current_date}\n日期差距: {date_difference} 天\n提示：样本日期与当前日期的差距已超过设定的 {email_interval} 天。\n请检查相关数据以确保样本的有效性和时效性。"
-                emit(subject, message)
+                emit(subject, message, reason='date_warning', sample_id=sample_id)
         else:
             logger.info(
                 f"The sample {sample_id} date differs from the current date by {date_difference} days, which does not exceed the interval of {email_interval} days.")
@@ -137,14 +358,12 @@ def get_cms_accessToken():
         response = requests.post(postUrl, params=postData, headers=headers)
         if response.status_code == 200:
             accessToken = json.loads(response.text)['data']['accessToken']
-            logger.info(f'AccessToken obtained successfully, accessToken: {accessToken}')
-            return accessToken
-        else:
-            logger.error('ERROR: response.status_code is not equal to 200.')
-            sys.exit(1)
     except Exception as e:
-        logger.error(f'ERROR: Error getting sample audit status of cms system. The specific reason is {e}')
-        sys.exit(1)
+        raise CmsError(f'ERROR: Error getting sample audit status of cms system. The specific reason is {e}') from e
+    if response.status_code != 200:
+        raise CmsError('ERROR: response.status_code is not equal to 200.')
+    logger.info(f'AccessToken obtained successfully, accessToken: {accessToken}')
+    return accessToken
 
 
 def get_project_name(sampleSn):
@@ -162,16 +381,15 @@ def get_project_name(sampleSn):
     try:
         result = requests.get(sampleInfo_url, params=payload)
         dicts = json.loads(result.text)
-        if len(dicts["data"]) > 0:
-            project_id = dicts["data"][0]["itemName"]
-            logger.info(f'Successfully obtained project ID, project ID: {project_id}')
-            return project_id
-        else:
-            logger.error('ERROR: Sample ID does not exist in cms system!')
-            sys.exit(1)
+        data = dicts["data"]
+        project_id = data[0]["itemName"] if len(data) > 0 else None
     except Exception as e:
-        logger.error(f'ERROR: An error occurred while getting the project name for the sample. Reason: {e}')
-        sys.exit(1)
+        raise CmsError(f'ERROR: An error occurred while getting the project name for the sample. Reason: {e}',
+                       sampleSn) from e
+    if project_id is None:
+        raise CmsError('ERROR: Sample ID does not exist in cms system!', sampleSn)
+    logger.info(f'Successfully obtained project ID, project ID: {project_id}')
+    return project_id
 
 
 def get_project_type(project_name):
@@ -213,17 +431,16 @@ def get_sample_status(sampleSn):
     try:
         result = requests.get(sample_info_url, params=payload)
         dicts = json.loads(result.text)
-        if len(dicts["data"]) > 0:
-            sample_status = dicts["data"][0]["sampleStatusShow"]
-            logging.info(f'Successfully obtained sampleStatus, sampleStatus: {sample_status}')
-            return sample_status
-        else:
-            logger.error('ERROR: Sample ID does not exist in cms system!')
-            sys.exit(1)
+        data = dicts["data"]
+        sample_status = data[0]["sampleStatusShow"] if len(data) > 0 else None
     except Exception as e:
-        logger.error(
-            f'ERROR: An error occurred while getting the item ID of the sample for the cms system. The specific reason is {e}')
-        sys.exit(1)
+        raise CmsError(
+            f'ERROR: An error occurred while getting the item ID of the sample for the cms system. The specific reason is {e}',
+            sampleSn) from e
+    if sample_status is None:
+        raise CmsError('ERROR: Sample ID does not exist in cms system!', sampleSn)
+    logging.info(f'Successfully obtained sampleStatus, sampleStatus: {sample_status}')
+    return sample_status
 
 
 def get_audit_status(sampleSn):
@@ -243,6 +460,89 @@ def get_audit_status(sampleSn):
     return status_abbr, status_desc
 
 
+def get_cms_budget():
+    """
+    Returns the CMS request budget of config.yaml, opening it on first use.
+
+    :return: A CmsBudget instance, or None if the budget is disabled.
+    """
+    global cms_budget, cms_budget_ready
+    if not cms_budget_ready:
+        cms_budget = review_schedule.open_budget(config)
+        cms_budget_ready = True
+    return cms_budget
+
+
+def get_review_model():
+    """
+    Returns the review latency model, rebuilt from the order history every refresh_hours.
+
+    :return: A LatencyModel instance, or None if adaptive polling is disabled.
+    """
+    global review_model, review_model_loaded
+    schedule_config = config.get('review_schedule') or {}
+    if not schedule_config.get('enabled', False):
+        return None
+    if review_model is None or time.time() - review_model_loaded > float(schedule_config.get('refresh_hours', 6)) * 3600:
+        try:
+            review_model = review_schedule.build_model(config, db_handler.get_engine(), REVIEW_APPROVED)
+        except SQLAlchemyError as e:
+            logger.warning(f'Review latency history could not be read, the fixed check interval is used: {e}')
+            review_model = review_schedule.LatencyModel({}, default_minutes=int(config['check_interval_minutes']))
+        review_model_loaded = time.time()
+    return review_model
+
+
+def record_review_status(sampleSn, status_abbr, status_desc):
+    """
+    Appends a review status observation to review_status_log, the history behind the adaptive polling.
+    """
+    df = pd.DataFrame({'SampleID': [sampleSn], 'Status': [status_abbr], 'ReviewStatus': [status_desc],
+                       'ObservedAt': [pd.to_datetime(datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'))]})
+    try:
+        save_to_database(df, 'review_status_log')
+    except Exception as e:
+        # The log only feeds the polling schedule; the order flow goes on without it
+        logger.warning(f'Review status of {sampleSn} not logged: {e}')
+
+
+def poll_audit_status(sampleSn):
+    """
+    Retrieves the audit status within the CMS request budget and logs status changes in review_status_log.
+
+    :param sampleSn: The sample number to check the status for.
+    :return: A tuple containing the audit status code and its description, or None if the CMS request budget
+             of the current cycle is spent.
+    """
+    budget = get_cms_budget()
+    if budget is not None and not budget.take():
+        logger.info(f'CMS request budget of this cycle is spent; the status check of {sampleSn} is postponed.')
+        return None
+
+    status_abbr, status_desc = get_audit_status(sampleSn)
+    if review_status_seen.get(sampleSn) != status_abbr:
+        record_review_status(sampleSn, status_abbr, status_desc)
+        review_status_seen[sampleSn] = status_abbr
+    return status_abbr, status_desc
+
+
+def next_check_minutes(status_abbr, status_since, design_time):
+    """
+    Returns the minutes to wait before the next review status check of a sample: adaptive from the review
+    latency history when enabled, otherwise the fixed check_interval_minutes.
+
+    :param status_abbr: Current review status abbreviation.
+    :param status_since: Time the sample was first seen in the current status.
+    :param design_time: Time the sample design finished.
+    """
+    model = get_review_model()
+    if model is None:
+        return int(config['check_interval_minutes'])
+    now = datetime.datetime.now()
+    return model.next_interval(status_abbr, (now - status_since).total_seconds() / 3600,
+                               (now - design_time).total_seconds() / 3600)
+
+
 def handle_mrd_sample(sampleID, send_email=True):
     """
     Handles the MRD sample ID by determining its project type and sending email notifications if necessary.
@@ -254,13 +554,13 @@ def handle_mrd_sample(sampleID, send_email=True):
     project_type = get_project_type(project_name)
 
     if not project_type:
-        logger.error(
-            f'The sample ID {sampleID} does not belong to the MRD detection, and no primer design is required.')
+        msg = f'The sample ID {sampleID} does not belong to the MRD detection, and no primer design is required.'
+        logger.error(msg)
         if send_email:
             subject = f"样本项目检查警告 - {sampleID}"
             message = f"警告：样本ID {sampleID} 项目检查\n提示：样本不属于迈锐达检测，不进行引物设计。\n请检查样本项目配置。"
-            emit(subject, message)
-        sys.exit(0)
+            emit(subject, message, reason='not_mrd', sample_id=sampleID)
+        raise SampleStopped(msg, sampleID, status='skipped')
 
 
 def read_loci_file(file_path):
@@ -269,21 +569,21 @@ def read_loci_file(file_path):
 
     :param file_path: Path to the file to be read.
     :return: A pandas DataFrame containing the file's content.
+    :raises LociFileError: If the file type is not supported or the file cannot be read.
     """
-    try:
-        file_extension = file_path.split('.')[-1].lower()
+    file_extension = file_path.split('.')[-1].lower()
+    if file_extension not in ['xlsx', 'csv', 'tsv', 'txt']:
+        raise LociFileError(f'ERROR: Unknown file type or does not match expected file types for file: {file_path}.')
 
+    try:
         if file_extension in ['xlsx']:
             df = pd.read_excel(file_path).drop_duplicates()
-        elif file_extension in ['csv', 'tsv', 'txt']:
+        else:
             # For CSV, TSV, and TXT, try to automatically detect delimiter
             try:
                 df = pd.read_csv(file_path, sep=None, engine='python').drop_duplicates()
             except UnicodeDecodeError:
                 df = pd.read_csv(file_path, sep=None, engine='python', encoding='gbk').drop_duplicates()
-        else:
-            logger.error(f'ERROR: Unknown file type or does not match expected file types for file: {file_path}.')
-            sys.exit(1)
 
         # 检查第二行是否包含中文标题关键字
         keywords = ['样本编码', '项目简称', '染色体', '起始位置']
@@ -293,8 +593,7 @@ def read_loci_file(file_path):
         return df
 
     except Exception as e:
-        logger.error(f'ERROR: Unable to read file {file_path}, The error log is {e}.')
-        sys.exit(1)
+        raise LociFileError(f'ERROR: Unable to read file {file_path}, The error log is {e}.') from e
 
 
 def read_hots_file():
@@ -303,21 +602,25 @@ def read_hots_file():
 
     :return: A pandas DataFrame containing the hotspots data.
     """
+    global hots_cache
     loci_hots = config['loci_hots']
     try:
-        df_hots = pd.read_excel(loci_hots)
-        cancer_ids = df_hots['CANCER_TYPE_ID'].unique().tolist()
-        return df_hots, cancer_ids
+        # 热点文件在进程内只解析一次（常驻的 worker_pool.py 进程中所有样本共用），文件修改后重新解析
+        stat = os.stat(loci_hots)
+        version = (os.path.abspath(loci_hots), stat.st_mtime_ns, stat.st_size)
+        if hots_cache is None or hots_cache[0] != version:
+            df_hots = pd.read_excel(loci_hots)
+            hots_cache = (version, df_hots, df_hots['CANCER_TYPE_ID'].unique().tolist())
+        return hots_cache[1].copy(), list(hots_cache[2])
     except Exception as e:
-        logger.error(f'ERROR: Failed to retrieve the hotspots file, the specific reason is: {e}')
-        sys.exit(1)
+        raise HotspotFileError(f'ERROR: Failed to retrieve the hotspots file, the specific reason is: {e}') from e
 
 
 def validate_cancer_type(df_snp, hots_cancer_ids, cancer_id=None):
     """
     Validates if the DataFrame has 'cancer_type_ID' column and its value is valid,
     or uses the provided cancer_id if 'cancer_type_ID' is missing, 'unknown', or invalid.
-    It issues a warning if no valid cancer_type_ID is found but terminates the program if
+    It issues a warning if no valid cancer_type_ID is found but raises LociFileError if
     'cancer_type_ID' is missing and no default cancer_id is provided.
 
     :param df_snp: The DataFrame containing SNP loci data.
@@ -325,7 +628,6 @@ def validate_cancer_type(df_snp, hots_cancer_ids, cancer_id=None):
     :param cancer_id: Default cancer type ID if not present, 'unknown', or invalid in the DataFrame.
     :return: A list of resolved cancer IDs.
     """
-    import sys
 
     def check_id(type_id):
         # 判断cancer_type_ID属于热点文件中CANCER_TYPE_ID哪个cancer tree
@@ -344,7 +646,7 @@ def validate_cancer_type(df_snp, hots_cancer_ids, cancer_id=None):
             sampleSn = df_snp["sampleSn"].iloc[0] if "sampleSn" in df_snp.columns else "UnknownSample"
             subject = f'样本 cancer_type_ID 检查警告 - {sampleSn}'
             message = f'警告：DataFrame 中 "cancer_type_ID" 为 unknown 或为空，且未提供默认的 cancer_id。\n提示：样本ID {sampleSn} 的 cancer_type_ID 未知，可能无法为其样本增加热点引物。请检查相关数据以确保样本的准确性。'
-            emit(subject, message)
+            emit(subject, message, reason='cancer_type', sample_id=sampleSn)
     elif cancer_id:
         cancer_res_id = [check_id(cancer_id)]
     else:
@@ -352,21 +654,19 @@ def validate_cancer_type(df_snp, hots_cancer_ids, cancer_id=None):
         subject = f'缺少 cancer_type_ID 和默认 cancer_id - {sampleSn}'
         message = f'错误：DataFrame 中缺少 "cancer_type_ID" 列，且未提供默认的 cancer_id。无法进行进一步分析。'
         emit(subject, message)
-        sys.exit(1)
+        raise LociFileError('ERROR: The loci file has no cancer_type_ID column and no cancer_id is given.', sampleSn)
 
     return cancer_res_id
 
 
-def process_hotspots(df_hots, df_loci, cancer_res_id):
+def prepare_hotspots(df_hots, cancer_res_id):
     """
-    Processes hotspots and loci DataFrames and merges them based on cancer research IDs.
+    Selects the hotspots of the given cancer types and converts them to the loci column layout.
 
     :param df_hots: DataFrame containing hotspots data.
-    :param df_loci: DataFrame containing loci data.
     :param cancer_res_id: List of cancer research IDs.
-    :return: A DataFrame with the combined and processed data.
+    :return: A DataFrame of hotspot loci.
     """
-
     # Filter hotspots based on cancer research IDs and remove duplicates
     df_hot = df_hots[df_hots['CANCER_TYPE_ID'].isin(cancer_res_id)].drop_duplicates(
         ['primer_design_chrom', 'primer_design_start', 'primer_design_end'])
@@ -388,6 +688,57 @@ def process_hotspots(df_hots, df_loci, cancer_res_id):
                'hots']
     df_hot = df_hot[columns]
 
+    return df_hot
+
+
+def hotspot_template_ids(df_hot):
+    """
+    Computes the TemplateIDs that add_templateID will assign to hotspot loci.
+
+    :param df_hot: DataFrame of hotspot loci returned by prepare_hotspots.
+    :return: A Series of TemplateIDs aligned with df_hot.
+    """
+    return df_hot['chrom'] + ':' + (df_hot['pos'].astype(int) - 1).astype(str) + '-' + (
+            df_hot['stop'].astype(int) + 1).astype(str)
+
+
+def rank_hotspots_by_atlas(df_hot, url=None):
+    """
+    Orders hotspots by what the primer atlas knows about them: hotspots with known-good primers come first
+    and hotspots that never produced primers when designed on their own (see exclude_failing_loci) are dropped,
+    so they do not take multiplex slots. Losses in a multiplex never drop a hotspot.
+
+    :param df_hot: DataFrame of hotspot loci returned by prepare_hotspots.
+    :param url: URL of the design service the sample is designed with.
+    :return: The filtered and reordered DataFrame.
+    """
+    if locus_db is None or df_hot.empty:
+        return df_hot
+
+    template_ids = hotspot_template_ids(df_hot)
+    known, unknown, failing = locus_db.validate_panel(template_ids.tolist(), *locus_key(url),
+                                                      min_attempts=locus_min_attempts())
+    logger.info(f'引物图谱: {len(known)} 个热点已有验证引物, {len(unknown)} 个热点未设计, '
+                f'{len(failing)} 个热点单独设计均失败已剔除 {failing}')
+
+    known = set(known)
+    rank = template_ids.map(lambda x: 0 if x in known else 1)
+    df_hot = df_hot[~template_ids.isin(failing)]
+    return df_hot.loc[rank[df_hot.index].sort_values(kind='stable').index]
+
+
+def process_hotspots(df_hots, df_loci, cancer_res_id, url=None):
+    """
+    Processes hotspots and loci DataFrames and merges them based on cancer research IDs.
+
+    :param df_hots: DataFrame containing hotspots data.
+    :param df_loci: DataFrame containing loci data.
+    :param cancer_res_id: List of cancer research IDs.
+    :param url: URL of the design service, used to look the hotspots up in the primer atlas.
+    :return: A DataFrame with the combined and processed data.
+    """
+    df_hot = rank_hotspots_by_atlas(prepare_hotspots(df_hots, cancer_res_id), url=url)
+
     # Mark non-hotspots in df_loci
     df_loci = df_loci.assign(hots=0)
 
@@ -408,7 +759,8 @@ def process_hotspots(df_hots, df_loci, cancer_res_id):
     return df_combined
 
 
-def loci_examined(df_loci, skip_snp_design, skip_hot_design, skip_driver_design, cancer_id=None, send_email=True):
+def loci_examined(df_loci, skip_snp_design, skip_hot_design, skip_driver_design, cancer_id=None, send_email=True,
+                  url=None):
     """
     Examines loci in a given DataFrame and performs various checks and processes based on the parameters provided.
 
@@ -418,8 +770,10 @@ def loci_examined(df_loci, skip_snp_design, skip_hot_design, skip_driver_design,
     :param skip_driver_design: Boolean flag to skip driver design.
     :param cancer_id: Optional cancer ID for further analysis.
     :param send_email: Flag indicating whether to send an email.
+    :param url: URL of the design service, used to look hotspots up in the primer atlas.
 
     :return: Processed DataFrame based on the given parameters and conditions.
+    :raises SampleStopped: If there are too few loci and the sample is handed to the reviewers.
     """
 
     # Sample ID
@@ -436,10 +790,9 @@ def loci_examined(df_loci, skip_snp_design, skip_hot_design, skip_driver_design,
     def process_hotspots_logic():
         df_hots, cancer_ids = read_hots_file()
         if cancer_id and cancer_id not in cancer_ids:
-            logger.error(f'ERROR: The cancer_id "{cancer_id}" is not present in the HOTS file.')
-            sys.exit(1)
+            raise LociFileError(f'ERROR: The cancer_id "{cancer_id}" is not present in the HOTS file.', sampleSn)
         cancer_res_id = validate_cancer_type(df_loci, cancer_ids, cancer_id)
-        return process_hotspots(df_hots, df_loci, cancer_res_id)
+        return process_hotspots(df_hots, df_loci, cancer_res_id, url=url)
 
     # Decision-making
     if loci_count < 8:
@@ -452,8 +805,9 @@ def loci_examined(df_loci, skip_snp_design, skip_hot_design, skip_driver_design,
             if send_email:
                 subject = f'样本位点数量检查警告 - {sampleSn}'
                 message = f'警告：样本ID {sampleSn} 位点数量不足。\n质控结果：SNP位点为: {snp_count} 个，INDEL位点为: {indel_count} 个，SNP+INDEL位点数量为: {snp_count + indel_count} 。\n提示：当 SNP + INDEL 数量小于8，需要审核人员审核处理！\n'
-                emit(subject, message)
-            sys.exit(0)
+                emit(subject, message, reason='loci_count', sample_id=sampleSn)
+            raise SampleStopped(f'Sample {sampleSn} has fewer than 8 SNP + INDEL loci and is handed to the reviewers.',
+                                sampleSn, status='held')
     elif 8 <= loci_count < 20:
         if not skip_hot_design:
             return process_hotspots_logic()
@@ -536,6 +890,23 @@ def select_site(df_source, df_res=None, not_used=None, num=20, driver=None):
         return handle_selection(df_filtered, num)
 
 
+def get_mfe_session(url):
+    """
+    Returns the MFEPrimer session for the given URL, creating it on first use.
+
+    :param url: URL for the web service for primer design.
+    :return: An MfeSession instance shared by all iterations and samples of this process.
+    """
+    if url not in mfe_sessions:
+        session_config = config.get('mfe_session') or {}
+        mfe_sessions[url] = mfe_session.MfeSession(url,
+                                                   token_ttl=int(session_config.get('token_ttl_minutes', 0)) * 60,
+                                                   check_interval=session_config.get('check_interval', 3),
+                                                   max_wait=int(session_config.get('max_wait_minutes', 30)) * 60,
+                                                   pool_size=session_config.get('pool_size', 10))
+    return mfe_sessions[url]
+
+
 def design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix='driver'):
     """
     Core function for primer design. It selects sites, fetches web data, prepares and posts data for primer design,
@@ -556,18 +927,40 @@ def design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix='
 
     PRIMER_PARAMS = config['PRIMER_PARAMS']
 
-    # Select sites and prepare data for posting
-    headers, cookies, token = pt.fetch_web_data(url=url, method='requests')
-    post_data = pt.prepare_post_data(token, result_string, custom_params=PRIMER_PARAMS)
+    # Look up the submission in the result cache
+    cache_key = primer_cache.make_key(result_string, PRIMER_PARAMS, url)
+    df_res = result_cache.get(cache_key) if result_cache else None
+
+    archive = (config.get('mfe_session') or {}).get('archive', 'csv')
+    save_path = None
+    if archive in ['csv', 'gzip']:
+        save_path = os.path.join(sample_dir, f'{sampleID}-{file_suffix}.csv' + ('.gz' if archive == 'gzip' else ''))
+
+    data = result_cache.get_raw(cache_key) if df_res is not None else None
+    if data is not None:
+        logger.info(f'样本 - {sampleID} 第 {file_suffix} 次引物设计命中缓存: {cache_key[:12]}')
+        # Archive the same result file as an uncached design
+        if save_path:
+            mfe_session.write_archive(data, save_path, compress=archive == 'gzip')
+        df_res.attrs['cached'] = True
+    else:
+        if result_cache:
+            logger.info(f'样本 - {sampleID} 第 {file_suffix} 次引物设计未命中缓存: {cache_key[:12]}')
+
+        # Design primers over the shared session, holding a slot of the shared rate limiter
+        session = get_mfe_session(url)
 
-    # Design primers and download the results
-    down_url = pt.design_primers(post_data, method='requests', headers=headers, cookies=cookies)
-    save_path = os.path.join(sample_dir, f'{sampleID}-{file_suffix}.csv')
-    pt.download(down_url, save_path)
+        with design_limiter.slot(sampleID, priority=design_priority) if design_limiter else contextlib.nullcontext():
+            down_url = session.design(result_string, PRIMER_PARAMS)
 
-    # Read and log the result
-    file_reader = pt.FileReader()
-    df_res = file_reader.read_csv(save_path)
+            # Stream the result into memory, archiving it in the background
+            data = session.fetch_result(down_url, archive_path=save_path, compress=archive == 'gzip')
+
+        # Parse the result
+        df_res = mfe_session.read_result(data, label=save_path or down_url)
+
+        if result_cache:
+            result_cache.put(cache_key, df_res, raw=data)
 
     # Add a column to distinguish file_suffix results and sampleID
     df_res.insert(0, 'sampleID', len(df_res) * [sampleID])
@@ -589,6 +982,46 @@ def save_to_database(df_res, table_name):
     db_handler.insert_df(table_name, df_res)
 
 
+def save_mfe_primers(df_res, sampleID, file_suffix):
+    """
+    Saves a design result to the mfe_primers table. A result served from the result cache is only saved when
+    the sample has no rows for that iteration yet, so repeated hits (reruns, --resume) add no duplicate rows.
+
+    :param df_res: DataFrame returned by design_primers_core.
+    :param sampleID: Sample ID the result belongs to.
+    :param file_suffix: Iteration of the result, the Suffix column.
+    """
+    if df_res.attrs.get('cached'):
+        query = text('SELECT 1 FROM mfe_primers WHERE sampleID = :sample_id AND Suffix = :suffix LIMIT 1')
+        try:
+            with db_handler.get_engine().connect() as conn:
+                saved = conn.execute(query, {'sample_id': sampleID, 'suffix': str(file_suffix)}).fetchone()
+        except SQLAlchemyError:
+            saved = None
+        if saved:
+            logger.info(f'样本 - {sampleID} 第 {file_suffix} 次缓存结果已在 mfe_primers 中，不重复写入')
+            return
+    save_to_database(df_res, 'mfe_primers')
+
+
+def record_locus_primers(df_res, result_string, sampleID, url):
+    """
+    Records the primer pairs of a design result in the cross-sample locus store.
+
+    :param df_res: DataFrame containing the results of primer design.
+    :param result_string: BED string that was submitted for the design.
+    :param sampleID: Sample ID the result belongs to.
+    :param url: URL of the design service the result came from.
+    """
+    if locus_db is None:
+        return
+
+    try:
+        locus_db.record(df_res, *locus_key(url), submitted_ids=locus_store.bed_template_ids(result_string), sample_id=sampleID)
+    except Exception as e:
+        logger.warning(f'Failed to record primer pairs in the locus store: {e}')
+
+
 def first_check_driver(df_driver, url, outcome_dir, sampleID):
     """
     Checks the number of driver genes in the given DataFrame and performs actions accordingly.
@@ -615,11 +1048,24 @@ def first_check_driver(df_driver, url, outcome_dir, sampleID):
     df_res, save_path = design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix='driver')
 
     # Save the DataFrame to a table in the database.
-    save_to_database(df_res, 'mfe_primers')
+    save_mfe_primers(df_res, sampleID, 'driver')
+    record_locus_primers(df_res, result_string, sampleID, url)
 
     return df_res['TemplateID'].to_list()
 
 
+def convert_driver_to_string(lst):
+    """
+    Converts driver TemplateIDs into BED lines that are prepended to every submission.
+
+    :param lst: List of TemplateIDs, e.g. ['chr1:100-102'].
+    :return: BED string with one line per TemplateID.
+    """
+    return ''.join(
+        [f"{item.split(':')[0]}\t{item.split(':')[1].split('-')[0]}\t{item.split(':')[1].split('-')[1]}\n" for item
+         in lst])
+
+
 def process_driver(df_loci, url, outcome_dir, sampleID, skip_driver_design):
     """
     Process the provided DataFrame to filter out driver genes, calculate the number of designs needed,
@@ -633,11 +1079,6 @@ def process_driver(df_loci, url, outcome_dir, sampleID, skip_driver_design):
     :return: Tuple containing DataFrame without driver genes, number of designs needed, and list of driver genes.
     """
 
-    def convert_driver_to_string(lst):
-        return ''.join(
-            [f"{item.split(':')[0]}\t{item.split(':')[1].split('-')[0]}\t{item.split(':')[1].split('-')[1]}\n" for item
-             in lst])
-
     # Convert 'driver' column to numeric, replacing non-numeric values with 0
     df_loci['driver'] = pd.to_numeric(df_loci['driver'], errors='coerce').fillna(0)
 
@@ -653,6 +1094,68 @@ def process_driver(df_loci, url, outcome_dir, sampleID, skip_driver_design):
     return df_no_driver, design_num, driver_list, driver_str
 
 
+def speculative_driver_design(df_loci, url, outcome_dir, sampleID):
+    """
+    Runs the driver compatibility check and a speculative first main-panel design concurrently. The speculative
+    panel assumes that every driver passes the check. When the check finishes, the speculative result is kept
+    as the first iteration if all drivers passed, or if the failed drivers did not cost the panel any other
+    locus (their rows are then removed); otherwise it is discarded.
+
+    :param df_loci: DataFrame containing loci information.
+    :param url: URL for the web service for primer design.
+    :param outcome_dir: Directory to save the outcome files.
+    :param sampleID: Sample ID for the primer design.
+    :return: Tuple of (df_no_driver, design_num, driver_list, driver_str, first_iteration). first_iteration is a
+             tuple (result_string, not_used, df_res) to use as the first iteration, or None if the speculation
+             was discarded.
+    """
+
+    df_loci['driver'] = pd.to_numeric(df_loci['driver'], errors='coerce').fillna(0)
+    df_driver = df_loci[df_loci['driver'] == 1]
+    df_no_driver = df_loci[~(df_loci['driver'] == 1)]
+
+    # Panel of the first iteration if every driver passes the check
+    all_drivers = df_driver['TemplateID'].head(20).to_list()
+    result_string, not_used = select_site_logic(df_no_driver, None, None, max(20 - len(all_drivers), 0), all_drivers,
+                                                convert_driver_to_string(all_drivers), 1, url=url)
+
+    # Create the shared session before both jobs use it
+    get_mfe_session(url)
+    logger.info(f'样本 - {sampleID} driver 兼容性检测与第 1 次引物设计并行提交')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        driver_future = executor.submit(first_check_driver, df_driver, url, outcome_dir, sampleID)
+        main_future = executor.submit(design_primers_core, url, outcome_dir, sampleID, result_string, '1')
+        driver_list = driver_future.result()
+        try:
+            df_spec, _ = main_future.result()
+            record_locus_primers(df_spec, result_string, sampleID, url)
+        except Exception as e:
+            logger.warning(f'样本 - {sampleID} 第 1 次推测设计失败，将重新设计: {e}')
+            df_spec = None
+
+    driver_str = convert_driver_to_string(driver_list)
+    design_num = max(20 - len(driver_list), 0)
+    if df_spec is None:
+        return df_no_driver, design_num, driver_list, driver_str, None
+
+    failed_drivers = set(all_drivers) - set(driver_list)
+    lost_main = set(locus_store.bed_template_ids(result_string)) - set(all_drivers) - set(df_spec['TemplateID'])
+
+    if failed_drivers and lost_main:
+        # The failed drivers may have knocked out the lost loci, so the panel is designed again without them
+        logger.info(f'样本 - {sampleID} driver {sorted(failed_drivers)} 未通过检测且推测设计丢失 {len(lost_main)} '
+                    f'个位点，丢弃推测结果')
+        return df_no_driver, design_num, driver_list, driver_str, None
+
+    logger.info(f'样本 - {sampleID} 推测设计结果作为第 1 次引物设计结果'
+                + (f'，剔除未通过检测的 driver {sorted(failed_drivers)}' if failed_drivers else ''))
+    df_spec = df_spec[~df_spec['TemplateID'].isin(failed_drivers)].reset_index(drop=True)
+    result_string = '\n'.join(line for line, template_id in zip(result_string.splitlines(),
+                                                                 locus_store.bed_template_ids(result_string))
+                              if template_id not in failed_drivers)
+    return df_no_driver, design_num, driver_list, driver_str, (result_string, not_used, df_spec)
+
+
 def update_primer_design(df_res, driver_list, design_num):
     """
     Updates the number of designs needed and driver list based on the current results.
@@ -668,10 +1171,34 @@ def update_primer_design(df_res, driver_list, design_num):
     return updated_design_num, current_drivers
 
 
-def select_site_logic(df_no_driver, df_res, not_used, design_num, driver_list, driver_str, num):
+def exclude_failing_loci(df_source, url):
+    """
+    Validates the candidate loci against the locus store and removes the loci it knows to be undesignable,
+    i.e. loci submitted on their own at least locus_store.min_attempts times without ever getting primers,
+    so that they do not take a multiplex slot and an iteration.
+
+    :param df_source: DataFrame of candidate loci with TemplateID.
+    :param url: URL of the design service the loci are designed with.
+    :return: The DataFrame without the undesignable loci.
+    """
+    if locus_db is None or df_source.empty:
+        return df_source
+
+    known, unknown, failing = locus_db.validate_panel(df_source['TemplateID'].drop_duplicates().tolist(),
+                                                      *locus_key(url), min_attempts=locus_min_attempts())
+    if failing:
+        logger.info(f'位点引物库: {len(known)} 个位点已有引物, {len(unknown)} 个位点未知, '
+                    f'{len(failing)} 个位点单独设计均失败已剔除 {failing}')
+    return df_source[~df_source['TemplateID'].isin(failing)]
+
+
+def select_site_logic(df_no_driver, df_res, not_used, design_num, driver_list, driver_str, num, url=None):
     """
-    Logic for selecting sites for primer design.
+    Logic for selecting sites for primer design. The candidates are validated against the locus store of the
+    design service at url.
     """
+    df_no_driver = exclude_failing_loci(df_no_driver, url)
+
     if num == 1:
         result_string, not_used = select_site(df_no_driver, num=design_num)
         primer_string = driver_str + result_string if driver_str else result_string
@@ -697,29 +1224,368 @@ def should_exit_loop(df_res, not_used):
     return False
 
 
-def perform_primer_design(df_no_driver, sampleID, url, outcome_dir, design_num, driver_list, driver_str):
+def checkpoint_path(outcome_dir, sampleID):
+    return os.path.join(outcome_dir, sampleID, 'checkpoint.json')
+
+
+def write_checkpoint_frame(df, path):
+    """
+    Writes a DataFrame of a checkpoint to parquet. Object columns mixing value types (e.g. chromosomes read
+    from Excel as 1, 2, X) cannot be stored by parquet, their values are stored as strings.
+
+    :param df: DataFrame to write.
+    :param path: Path of the parquet file.
+    """
+    mixed = [col for col in df.columns if df[col].dtype == object and df[col].dropna().map(type).nunique() > 1]
+    if mixed:
+        df = df.copy()
+        for col in mixed:
+            df[col] = df[col].map(lambda value: value if pd.isna(value) else str(value))
+    df.to_parquet(path, index=False)
+
+
+def design_hash(df_design):
+    """
+    Returns a hash of the loci to be designed, used to make sure a checkpoint belongs to the same input.
+
+    :param df_design: DataFrame containing the loci with TemplateID.
+    :return: Hex digest of the loci.
+    """
+    return hashlib.sha256(df_design.to_csv(index=False).encode('utf-8')).hexdigest()
+
+
+def save_checkpoint(outcome_dir, sampleID, checkpoint):
+    """
+    Atomically writes the state of the design loop to primer_outcome/<sampleID>/checkpoint.json.
+    DataFrame values are written to parquet files next to it, named by a generation number so that the
+    files of the previous checkpoint stay valid until checkpoint.json is replaced; all other values must be
+    plain JSON data.
+
+    :param outcome_dir: Directory to save the outcome files.
+    :param sampleID: Sample ID for the primer design.
+    :param checkpoint: Dictionary holding the loop state.
+    """
+    path = checkpoint_path(outcome_dir, sampleID)
+    sample_dir = os.path.dirname(path)
+    os.makedirs(sample_dir, exist_ok=True)
+    checkpoint['generation'] = checkpoint.get('generation', 0) + 1
+
+    state, frames = {}, {}
+    for key, value in checkpoint.items():
+        if isinstance(value, pd.DataFrame):
+            frames[key] = f'checkpoint-{key}.{checkpoint["generation"]}.parquet'
+            write_checkpoint_frame(value, os.path.join(sample_dir, frames[key]))
+        else:
+            state[key] = value
+    state['frames'] = frames
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    # 删除上一次断点的 parquet 文件
+    for name in os.listdir(sample_dir):
+        if name.startswith('checkpoint-') and name.endswith('.parquet') and name not in frames.values():
+            os.remove(os.path.join(sample_dir, name))
+
+
+def load_checkpoint(outcome_dir, sampleID, input_hash):
+    """
+    Loads the design loop state written by a previous run of the same sample.
+
+    :param outcome_dir: Directory to save the outcome files.
+    :param sampleID: Sample ID for the primer design.
+    :param input_hash: Hash of the current loci, see design_hash.
+    :return: The checkpoint dictionary, or None if there is no usable checkpoint.
+    """
+    path = checkpoint_path(outcome_dir, sampleID)
+    if not os.path.exists(path):
+        logger.info(f'No checkpoint found for sample {sampleID}, starting from the beginning.')
+        return None
+
+    try:
+        with open(path, encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        for key, name in checkpoint.pop('frames', {}).items():
+            checkpoint[key] = pd.read_parquet(os.path.join(os.path.dirname(path), name))
+    except Exception as e:
+        logger.warning(f'Unable to read checkpoint {path}, starting from the beginning: {e}')
+        return None
+
+    if checkpoint.get('params_hash') != primer_cache.params_hash(config['PRIMER_PARAMS']):
+        logger.warning(f'PRIMER_PARAMS changed since checkpoint {path} was written, starting from the beginning.')
+        return None
+    if checkpoint.get('input_hash') != input_hash:
+        logger.warning(f'Input loci changed since checkpoint {path} was written, starting from the beginning.')
+        return None
+
+    logger.info(f'Resuming sample {sampleID} from checkpoint after iteration {checkpoint["num"]}.')
+    return checkpoint
+
+
+def isolate_incompatible_loci(url, outcome_dir, sampleID, template_ids, num, workers=4):
+    """
+    Finds the loci responsible for losses in a multiplex by bisection. The failing set is split into halves
+    that are designed concurrently; halves that lose loci are split again. A locus that fails on its own is
+    blacklisted, and in a failing pair whose loci both design on their own the surviving locus, which knocked
+    the other one out, is blacklisted.
+
+    :param url: URL for the web service for primer design.
+    :param outcome_dir: Directory to save the outcome files.
+    :param sampleID: Sample ID for the primer design.
+    :param template_ids: TemplateIDs of the multiplex that lost loci.
+    :param num: Iteration number, used in the result file names.
+    :param workers: Number of sub-jobs designed concurrently.
+    :return: Set of blacklisted TemplateIDs.
+    :raises Exception: Errors of a sub-job other than an empty result abort the isolation.
+    """
+    def design_subset(subset, name):
+        result_string = '\n'.join(f"{x.split(':')[0]}\t{x.split(':')[1].split('-')[0]}\t{x.split(':')[1].split('-')[1]}"
+                                  for x in subset)
+        try:
+            df_sub, _ = design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix=name)
+        except mfe_session.EmptyResult as e:
+            # MFEPrimer returns an unreadable file when no locus of the subset gets primers
+            logger.warning(f'样本 - {sampleID} 隔离子任务 {name} 无引物结果: {e}')
+            return set()
+        record_locus_primers(df_sub, result_string, sampleID, url)
+        return set(df_sub['TemplateID'])
+
+    blacklist = set()
+    failing = [(list(template_ids), None)]
+    level = 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        while failing:
+            level += 1
+            jobs = []
+            for subset, returned in failing:
+                if len(subset) == 2:
+                    # Remember which locus survived in the failing pair
+                    jobs.extend(([x], subset, returned) for x in subset)
+                else:
+                    half = len(subset) // 2
+                    jobs.extend((part, subset, None) for part in (subset[:half], subset[half:]))
+
+            futures = [executor.submit(design_subset, part, f'{num}-iso{level}-{i + 1}')
+                       for i, (part, _, _) in enumerate(jobs)]
+            logger.info(f'样本 - {sampleID} 第 {num} 次引物设计隔离第 {level} 轮: 并行提交 {len(jobs)} 个子任务')
+
+            failing, pair_results = [], {}
+            for future, (part, parent, parent_returned) in zip(futures, jobs):
+                try:
+                    returned = future.result()
+                except Exception as e:
+                    # 网络、令牌或限流等错误不能当作无引物，否则会剔除正常位点，放弃本次隔离
+                    for pending in futures:
+                        pending.cancel()
+                    logger.error(f'样本 - {sampleID} 第 {num} 次引物设计隔离中止: {e}')
+                    raise
+                if len(part) == 1:
+                    if not returned:
+                        blacklist.add(part[0])
+                    pair_results.setdefault(tuple(parent), (parent_returned, []))[1].append(bool(returned))
+                elif len(returned) < len(part):
+                    failing.append((part, returned))
+
+            # Both loci of a failing pair design on their own: the survivor knocked out its partner
+            for pair, (pair_returned, alone) in pair_results.items():
+                if len(pair) == 2 and all(alone) and pair_returned:
+                    blacklist.update(pair_returned)
+
+    logger.info(f'样本 - {sampleID} 第 {num} 次引物设计隔离完成，共 {level} 轮，剔除位点: {sorted(blacklist)}')
+    return blacklist
+
+
+class DesignConvergence:
+    """
+    Tracks the accepted primer count and loci churn of every iteration of the design loop, keeps the best panel
+    seen so far and decides when further iterations are not expected to improve it.
+    """
+
+    def __init__(self, patience=3, target=20):
+        """
+        :param patience: Iterations without a larger panel after which the loop stops.
+        :param target: Panel size at which no improvement is possible.
+        """
+        self.patience = patience
+        self.target = target
+        self.history = []
+        self.best = None
+        self.best_num = 0
+        self.last_ids = set()
+        self.seen = set()
+        self.submitted_new = 0
+        self.accepted_new = 0
+
+    def state(self):
+        """
+        :return: Dictionary of plain data from which from_state restores the tracker, without the best panel.
+        """
+        return {'patience': self.patience, 'target': self.target, 'history': self.history,
+                'best_num': self.best_num, 'last_ids': sorted(self.last_ids), 'seen': sorted(self.seen),
+                'submitted_new': self.submitted_new, 'accepted_new': self.accepted_new}
+
+    @classmethod
+    def from_state(cls, state, best):
+        """
+        Restores a tracker saved with state.
+
+        :param state: Dictionary returned by state.
+        :param best: DataFrame of the best panel seen so far.
+        """
+        convergence = cls(patience=state['patience'], target=state['target'])
+        convergence.history = state['history']
+        convergence.best = best
+        convergence.best_num = state['best_num']
+        convergence.last_ids = set(state['last_ids'])
+        convergence.seen = set(state['seen'])
+        convergence.submitted_new = state['submitted_new']
+        convergence.accepted_new = state['accepted_new']
+        return convergence
+
+    def update(self, num, df_res, submitted, not_used):
+        """
+        Records the result of an iteration.
+
+        :param num: Iteration number.
+        :param df_res: DataFrame with the primer design results of the iteration.
+        :param submitted: TemplateIDs submitted in the iteration.
+        :param not_used: TemplateIDs still available for later iterations.
+        """
+        ids = set(df_res['TemplateID'])
+        new = [x for x in submitted if x not in self.seen]
+        self.seen.update(submitted)
+        self.submitted_new += len(new)
+        self.accepted_new += len(ids.intersection(new))
+
+        self.history.append({'num': num, 'accepted': len(ids), 'added': len(ids - self.last_ids),
+                             'removed': len(self.last_ids - ids), 'not_used': len(not_used or [])})
+        self.last_ids = ids
+
+        # A panel of the same size replaces the best one, as the loop used to return the last panel
+        if self.best is None or len(ids) >= self.best.shape[0]:
+            if self.best is None or len(ids) > self.best.shape[0]:
+                self.best_num = num
+            self.best = df_res
+
+    def predicted_ceiling(self):
+        """
+        Predicts the largest reachable panel from the success rate of loci submitted for the first time.
+        """
+        rate = self.accepted_new / self.submitted_new if self.submitted_new else 1
+        return min(self.target, self.best.shape[0] + rate * self.history[-1]['not_used'])
+
+    def should_stop(self):
+        """
+        :return: Tuple of (stop, reason).
+        """
+        last = self.history[-1]
+        if self.best.shape[0] >= self.target:
+            return True, f'已达到 {self.target} 个引物'
+        if last['num'] - self.best_num >= self.patience:
+            return True, f'连续 {last["num"] - self.best_num} 次未提升（最佳为第 {self.best_num} 次 {self.best.shape[0]} 个）'
+        ceiling = self.predicted_ceiling()
+        if ceiling < self.best.shape[0] + 1:
+            return True, f'预计上限 {ceiling:.1f} 个，剩余候选位点无法再提升'
+        return False, ''
+
+
+def perform_primer_design(df_no_driver, sampleID, url, outcome_dir, design_num, driver_list, driver_str,
+                          checkpoint=None, isolate=False, first_iteration=None):
     """
     Perform primer design based on the given data.
+
+    If a checkpoint dictionary is given, the loop continues after its last completed iteration
+    and writes its state back after every iteration. If isolate is set, loci that make a multiplex
+    lose other loci are identified by isolate_incompatible_loci and excluded for this sample.
+    first_iteration is a (result_string, not_used, df_res) tuple from speculative_driver_design
+    that is used instead of designing the first iteration.
     """
     num = 0
     df_res = pd.DataFrame()
     not_used = []
+    blacklist = set()
+
+    if checkpoint and checkpoint.get('num'):
+        num, df_res, not_used = checkpoint['num'], checkpoint['df_res'], checkpoint['not_used']
+        blacklist = set(checkpoint.get('blacklist', []))
+        df_no_driver = df_no_driver[~df_no_driver['TemplateID'].isin(blacklist)]
+        if checkpoint.get('stage') == 'done':
+            logger.info(f'样本 - {sampleID} 引物设计已在第 {num} 次完成，直接使用断点结果')
+            return df_res
+
+    isolation_config = config.get('isolation') or {}
+    convergence_config = config.get('convergence') or {}
+    convergence = None
+    if convergence_config.get('enabled', False):
+        if (checkpoint or {}).get('convergence'):
+            convergence = DesignConvergence.from_state(checkpoint['convergence'], checkpoint['convergence_best'])
+        else:
+            convergence = DesignConvergence(patience=int(convergence_config.get('patience', 3)))
 
     while True:
         num += 1
         logger.info(f'样本 - {sampleID} 第 {num} 次引物设计')
 
-        # Select sites for primer design
-        result_string, not_used = select_site_logic(df_no_driver, df_res, not_used, design_num, driver_list, driver_str,
-                                                    num)
-
-        # Design primers and process results
-        df_res, save_path = design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix=str(num))
-
-        # Save the DataFrame to a table in the database.
-        save_to_database(df_res, 'mfe_primers')
-
-        if should_exit_loop(df_res, not_used):
+        if num == 1 and first_iteration:
+            # The speculative first iteration already ran next to the driver check
+            result_string, not_used, df_res = first_iteration
+            save_mfe_primers(df_res, sampleID, str(num))
+        else:
+            # Select sites for primer design
+            result_string, not_used = select_site_logic(df_no_driver, df_res, not_used, design_num, driver_list,
+                                                        driver_str, num, url=url)
+
+            # Design primers and process results
+            df_res, save_path = design_primers_core(url, outcome_dir, sampleID, result_string, file_suffix=str(num))
+
+            # Save the DataFrame to a table in the database.
+            save_mfe_primers(df_res, sampleID, str(num))
+            record_locus_primers(df_res, result_string, sampleID, url)
+
+        exit_loop = should_exit_loop(df_res, not_used)
+
+        # Stop early when the panel stopped improving and continue from the best panel seen so far
+        if convergence:
+            convergence.update(num, df_res, locus_store.bed_template_ids(result_string), not_used)
+            logger.info(f'样本 - {sampleID} 第 {num} 次引物设计收敛情况: {convergence.history[-1]}')
+            stop, reason = convergence.should_stop()
+            if stop and not exit_loop:
+                logger.info(f'样本 - {sampleID} 第 {num} 次后提前结束引物设计: {reason}')
+                exit_loop = True
+            if exit_loop and convergence.best is not df_res:
+                logger.info(f'样本 - {sampleID} 使用第 {convergence.best_num} 次起的最佳结果 '
+                            f'({convergence.best.shape[0]} 个) 替代第 {num} 次结果 ({df_res.shape[0]} 个)')
+                df_res = convergence.best
+
+        # Isolate the loci that knock out others instead of swapping in new loci one iteration at a time
+        submitted = locus_store.bed_template_ids(result_string)
+        lost = len(submitted) - df_res.shape[0]
+        if isolate and not exit_loop and lost >= int(isolation_config.get('min_losses', 2)):
+            isolated = isolate_incompatible_loci(url, outcome_dir, sampleID, submitted, num,
+                                                 workers=int(isolation_config.get('workers', 4)))
+            isolated -= set(driver_list or [])
+            blacklist |= isolated
+            df_no_driver = df_no_driver[~df_no_driver['TemplateID'].isin(blacklist)]
+            df_res = df_res[~df_res['TemplateID'].isin(blacklist)]
+
+        report_progress('design', iteration=num, primers=int(df_res.shape[0]), unused=len(not_used))
+
+        # Persist the loop state so that an interrupted run can be resumed
+        if checkpoint is not None:
+            checkpoint.update(num=num, df_res=df_res, not_used=list(not_used or []), blacklist=sorted(blacklist),
+                              convergence=convergence.state() if convergence else None,
+                              convergence_best=convergence.best if convergence else None,
+                              stage='done' if exit_loop else 'loop')
+            for key in ['first_result_string', 'first_not_used', 'first_df_res']:
+                checkpoint.pop(key, None)
+            save_checkpoint(outcome_dir, sampleID, checkpoint)
+
+        if exit_loop:
             break
 
     return df_res
@@ -735,15 +1601,16 @@ def process_primer_results(df_res, df_design, sampleID, skip_snp_design, send_em
     :param skip_snp_design: Boolean flag to skip SNP design.
     :param send_email: Flag indicating whether to send an email.
     :return: Processed DataFrame df_sample.
+    :raises QcError: If there are too few primer results or too few own loci among them.
     """
 
     def send_quality_control_email(reason, sample_count):
         subject = f'样本引物结果检查警告 - {sampleID}'
         message = f"警告：样本ID {sampleID} 引物结果检查\n质控结果：{reason}数量为 {sample_count}\n提示：当引物结果数量小于12个或是自身位点小于8个时，不满足质控要求，需要审核人员审核处理。\n程序将自动退出以防止进一步的数据处理。\n请立即检查相关数据并采取适当措施。"
         if send_email:
-            emit(subject, message)
+            emit(subject, message, reason='primer_qc', sample_id=sampleID)
         doError(f'样本ID：{sampleID}, 引物结果未通过质控，请立即检查相关数据并采取适当措施！')
-        sys.exit(1)
+        raise QcError(f'Primer results of {sampleID} failed the quality control: {reason} {sample_count}.', sampleID)
 
     if not skip_snp_design:
         if df_res.shape[0] < 12:
@@ -875,190 +1742,59 @@ def process_primer_order(df, mold):
     return df_combined
 
 
-def write_sh_order(df_sample, dataframe, order_path, sampleID):
-    os.makedirs(order_path, exist_ok=True)
+def write_vendor_order(mold, df_order, df_combined, order_dir, sampleID):
+    """
+    Writes a primer order into the vendor template of the given mold, laid out as configured in
+    config['order_layouts'], and saves it.
+
+    :param mold: Vendor key of the order template and layout (e.g. 'sh', 'hz', 'sg', 'dg').
+    :param df_order: DataFrame containing the primer order data from process_primer_order.
+    :param df_combined: DataFrame containing the primer pairs written to the trial sheet.
+    :param order_dir: Directory where the output Excel file will be saved.
+    :param sampleID: Sample identifier used as part of the output file name.
+    :return: The path of the saved Excel workbook.
+    """
+    os.makedirs(order_dir, exist_ok=True)
     try:
-        order_template = config['order_template']['sh']
-        wb = openpyxl.load_workbook(order_template)
+        order_template = config['order_template'][mold]
+        layout = config['order_layouts'][mold]
+        wb = template_cache.load_template(order_template)
     except Exception as e:
         doError(f'ERROR: {e}')
-        sys.exit(1)
-
-    ws_dna = wb['DNA合成订购表']
-
-    def write_to_sheet(data, column, start_row, sequence_prefix=None):
-        for i, value in enumerate(data):
-            if value.islower():
-                value = value.upper()
-            if sequence_prefix:
-                value = sequence_prefix + value
-            ws_dna.cell(start_row + i, column).value = value
-            ws_dna.cell(start_row + i, 5).value = 'PAGE'
-            ws_dna.cell(start_row + i, 8).value = 1
-            ws_dna.cell(start_row + i, 10).value = 2
-            ws_dna.cell(start_row + i, 11).value = 'BLG白色标签'
-            ws_dna.cell(start_row + i, 12).value = '1.5ml离心管'
-            ws_dna.cell(start_row + i, 13).value = 50
-            ws_dna.cell(start_row + i, 14).value = 'H+M'
-            ws_dna.cell(start_row + i, 15).value = '1*TE 稀释'
-
-    # Write the 'F_id' data to the sheet
-    write_to_sheet(df_sample['F_id'], 3, 20)
-
-    # Leave a blank row after writing the 'F_id' data
-    ws_dna.cell(20 + len(df_sample['F_id']), 3).value = None
-
-    # Write the 'R_id' data to the sheet
-    write_to_sheet(df_sample['R_id'], 3, 21 + len(df_sample['F_id']))
-
-    # Write the 'ForwardPrimer(Fp)' data to the sheet
-    write_to_sheet(df_sample['ForwardPrimer(Fp)'], 4, 20, "GTTCAGAGTTCTACAGTCCGACGATCNNWNNW")
-
-    # Leave a blank row after writing the 'ForwardPrimer(Fp)' data
-    ws_dna.cell(20 + len(df_sample['ForwardPrimer(Fp)']), 4).value = None
-
-    # Write the 'ReversePrimer(Rp)' data to the sheet
-    write_to_sheet(df_sample['ReversePrimer(Rp)'], 4, 21 + len(df_sample['ForwardPrimer(Fp)']),
-                   "CTTGGCACCCGAGAATTCCANNWNNW")
-    ws_trial = wb['实验用引物对（不需要订购合成）']
-
-    row_index = 1
-    # Iterate through the rows of the dataframe
-    for r in dataframe.iterrows():
-        # Get the row data
-        row_data = r[1]
-        # Get the cell values
-        values = row_data.tolist()
-        # Write the data to the sheet
-        ws_trial.append(values)
-        # Increment the row index
-        row_index += 1
-
-    # Save the workbook
-    save_file = os.path.join(order_path, '{}_{}_{}.xlsx'.format(sampleID, os.path.basename(
-        (config['order_template']['sh']).split('.')[0]), datetime.datetime.now().strftime("%Y%m%d%H%M%S")))
-    wb.save(save_file)
-    return save_file
+        raise OrderError(f'ERROR: Order template of {mold} cannot be loaded: {e}', sampleID) from e
 
+    save_file = os.path.join(order_dir,
+                             f'{sampleID}_{os.path.basename(order_template).split(".")[0]}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.xlsx')
 
-def write_hz_order(df_sample, dataframe, order_path, sampleID):
-    os.makedirs(order_path, exist_ok=True)
-    try:
-        order_template = config['order_template']['hz']
-        wb = openpyxl.load_workbook(order_template)
-    except Exception as e:
-        doError(f'ERROR: {e}')
-        sys.exit(1)
-    ws_dna = wb['DNA合成订购表']
-
-    # Define a function to write the data to the sheet
-    def write_to_sheet(data, column, start_row, sequence_prefix=None):
-        for i, value in enumerate(data):
-            if value.islower():
-                value = value.upper()
-            if sequence_prefix:
-                value = sequence_prefix + value
-            ws_dna.cell(start_row + i, column).value = value
-            ws_dna.cell(start_row + i, 5).value = 2
-            ws_dna.cell(start_row + i, 7).value = 'PAGE'
-            ws_dna.cell(start_row + i, 8).value = 2
-            ws_dna.cell(start_row + i, 11).value = '1管TE溶解为50uM浓度，1管干粉'
-
-    # Write the 'F_id' data to the sheet
-    write_to_sheet(df_sample['F_id'], 2, 20)
-
-    # Leave a blank row after writing the 'F_id' data
-    ws_dna.cell(20 + len(df_sample['F_id']), 2).value = None
-
-    # Write the 'R_id' data to the sheet
-    write_to_sheet(df_sample['R_id'], 2, 21 + len(df_sample['F_id']))
-
-    # Write the 'ForwardPrimer(Fp)' data to the sheet
-    write_to_sheet(df_sample['ForwardPrimer(Fp)'], 3, 20, "GTTCAGAGTTCTACAGTCCGACGATCNNWNNW")
-
-    # Leave a blank row after writing the 'ForwardPrimer(Fp)' data
-    ws_dna.cell(20 + len(df_sample['ForwardPrimer(Fp)']), 3).value = None
-
-    # Write the 'ReversePrimer(Rp)' data to the sheet
-    write_to_sheet(df_sample['ReversePrimer(Rp)'], 3, 21 + len(df_sample['ForwardPrimer(Fp)']),
-                   "CTTGGCACCCGAGAATTCCANNWNNW")
-
-    ws_trial = wb['实验用引物对（不需要订购合成）']
-
-    row_index = 1
-    # Iterate through the rows of the dataframe
-    for r in dataframe.iterrows():
-        # Get the row data
-        row_data = r[1]
-        # Get the cell values
-        values = row_data.tolist()
-        # Write the data to the sheet
-        ws_trial.append(values)
-        # Increment the row index
-        row_index += 1
-
-    # Save the workbook
-    save_file = os.path.join(order_path, '{}_{}_{}.xlsx'.format(sampleID, os.path.basename(
-        (config['order_template']['hz']).split('.')[0]), datetime.datetime.now().strftime("%Y%m%d%H%M%S")))
-    wb.save(save_file)
-    return save_file
+    # Large orders are streamed to disk instead of being built up in the template workbook
+    export_config = config.get('order_export') or {}
+    mode = export_config.get('mode', 'auto')
+    if mode == 'stream' or (mode == 'auto' and df_order.shape[0] >= int(export_config.get('stream_min_rows', 1000))):
+        logger.info(f'Streaming {df_order.shape[0]} order rows to {save_file}.')
+        order_layout.stream_order(save_file, wb, layout, df_order, df_combined)
+    else:
+        order_layout.render_order(wb, layout, df_order, df_combined)
+        wb.save(save_file)
 
+    sidecars = export_config.get('sidecars') or []
+    if sidecars:
+        order_layout.write_sidecars(df_order, os.path.splitext(save_file)[0], sidecars)
 
-def write_dg_order(df_sample, dataframe, order_path, sampleID):
-    os.makedirs(order_path, exist_ok=True)
-    try:
-        order_template = config['order_template']['dg']
-        wb = openpyxl.load_workbook(order_template)
-    except Exception as e:
-        doError(f'ERROR: {e}')
-        sys.exit(1)
-    ws_dna = wb['订单表格']
-
-    # Define a function to write the data to the sheet
-    def write_to_sheet(data, column, start_row, sequence_prefix=None):
-        for i, value in enumerate(data):
-            if value.islower():
-                value = value.upper()
-            if sequence_prefix:
-                value = sequence_prefix + value
-            ws_dna.cell(start_row + i, column).value = value
-            # ws_dna.cell(start_row + i, 5).value = 2
-            ws_dna.cell(start_row + i, 8).value = 'PAGE'
-            ws_dna.cell(start_row + i, 14).value = 2
-            ws_dna.cell(start_row + i, 13).value = '1管TE溶解为50uM浓度，1管干粉'
-
-    # Write the 'F_id' data to the sheet
-    write_to_sheet(df_sample['F_id'], 5, 16)
-
-    # Write the 'R_id' data to the sheet
-    write_to_sheet(df_sample['R_id'], 5, 16 + len(df_sample['F_id']))
-
-    # Write the 'ForwardPrimer(Fp)' data to the sheet
-    write_to_sheet(df_sample['ForwardPrimer(Fp)'], 6, 16, "GTTCAGAGTTCTACAGTCCGACGATCNNWNNW")
-
-    # Write the 'ReversePrimer(Rp)' data to the sheet
-    write_to_sheet(df_sample['ReversePrimer(Rp)'], 6, 16 + len(df_sample['ForwardPrimer(Fp)']),
-                   "CTTGGCACCCGAGAATTCCANNWNNW")
-
-    ws_trial = wb['实验用引物对（不需要订购合成）']
-    row_index = 1
-    # Iterate through the rows of the dataframe
-    for r in dataframe.iterrows():
-        # Get the row data
-        row_data = r[1]
-        # Get the cell values
-        values = row_data.tolist()
-        # Write the data to the sheet
-        ws_trial.append(values)
-        # Increment the row index
-        row_index += 1
-    # Save the workbook
-    save_file = os.path.join(order_path, '{}_{}_{}.xlsx'.format(sampleID, os.path.basename(
-        (config['order_template']['dg']).split('.')[0]), datetime.datetime.now().strftime("%Y%m%d%H%M%S")))
-    wb.save(save_file)
     return save_file
 
 
+def write_sh_order(df_order, df_combined, order_dir, sampleID):
+    return write_vendor_order('sh', df_order, df_combined, order_dir, sampleID)
+
+
+def write_hz_order(df_order, df_combined, order_dir, sampleID):
+    return write_vendor_order('hz', df_order, df_combined, order_dir, sampleID)
+
+
+def write_dg_order(df_order, df_combined, order_dir, sampleID):
+    return write_vendor_order('dg', df_order, df_combined, order_dir, sampleID)
+
+
 def write_sg_order(df_order, df_combined, order_dir, sampleID):
     """
     Writes primer order data to an Excel workbook based on a template and saves it.
@@ -1069,36 +1805,7 @@ def write_sg_order(df_order, df_combined, order_dir, sampleID):
     :param sampleID: Sample identifier used as part of the output file name.
     :return: The path of the saved Excel workbook.
     """
-    try:
-        order_template = config['order_template']['sg']
-        wb = openpyxl.load_workbook(order_template)
-    except Exception as e:
-        raise e
-
-    ws_dna = wb['引物合成订购表']
-
-    def write_to_sheet(dataframe, start_row):
-        """ Helper function to write data to the Excel sheet """
-        for i, raw in dataframe.iterrows():
-            ws_dna.cell(start_row + i, 2, raw['PrimerName'])
-            ws_dna.cell(start_row + i, 3, raw['Sequence'])
-            ws_dna.cell(start_row + i, 5, raw['TubeCount'])
-            ws_dna.cell(start_row + i, 7, raw['PurificationMethod'])
-            ws_dna.cell(start_row + i, 8, raw['Nmoles'])
-            ws_dna.cell(start_row + i, 12, raw['Remarks'])
-
-    write_to_sheet(df_order, 18)
-
-    ws_trial = wb['实验用引物对（不需要订购合成）']
-    ws_trial.append(df_combined.columns.tolist())  # Write the column names
-    for index, row in df_combined.iterrows():
-        ws_trial.append(row.tolist())  # Write the data
-
-    save_file = os.path.join(order_dir,
-                             f'{sampleID}_{os.path.basename(order_template).split(".")[0]}_{datetime.datetime.now().strftime("%Y%m%d%H%M%S")}.xlsx')
-    wb.save(save_file)
-
-    return save_file
+    return write_vendor_order('sg', df_order, df_combined, order_dir, sampleID)
 
 
 def upsert_to_database(df, table_name, unique_col, update_cols):
@@ -1174,21 +1881,12 @@ def write_order(sampleID, df_design, df_res, order_dir, mold, skip_snp_design, s
     # Added order format information
     df_order = process_primer_order(df_processed, mold)
 
-    # The mold value is mapped to the corresponding function
-    order_functions = {
-        'sh': write_sh_order,
-        'hz': write_hz_order,
-        'sg': write_sg_order,
-        'dg': write_dg_order
-    }
-
-    # appropriate function is called and logged
-    if mold in order_functions:
-        primer_result = order_functions[mold](df_order, df_processed, order_dir, sampleID)
+    # Every mold with a template and a layout in config.yaml can be written
+    if mold in config['order_template'] and mold in (config.get('order_layouts') or {}):
+        primer_result = write_vendor_order(mold, df_order, df_processed, order_dir, sampleID)
         logger.info(f'Primer design {mold.upper()} order template writing completed.')
     else:
-        logger.error(f'Unknown mold: {mold}')
-        sys.exit(1)
+        raise OrderError(f'Unknown mold: {mold}', sampleID)
 
     df_order_info = pd.DataFrame({
         "SampleID": [sampleID],  # 样本ID
@@ -1201,11 +1899,27 @@ def write_order(sampleID, df_design, df_res, order_dir, mold, skip_snp_design, s
     }, index=[0])
 
     # Write or update order history
+    ensure_monitor_schema()
     upsert_to_database(df_order_info, 'monitor_order', 'SampleID', ['OrderFile', 'DesignDate'])
 
     return primer_result
 
 
+def ensure_monitor_schema():
+    """
+    Applies the pending monitor_order schema migrations (unique SampleID, pending order index) once per process.
+    """
+    global monitor_schema_ready
+    if monitor_schema_ready:
+        return
+    try:
+        monitor_schema.migrate(db_handler.get_engine())
+    except SQLAlchemyError as e:
+        # e.g. an account without DDL privileges; the queries work without the indexes, only slower
+        logger.warning(f'monitor_order schema migrations not applied: {e}')
+    monitor_schema_ready = True
+
+
 def check_email_sent(sample_id, table_name):
     """
     Checks the email sent status for a given sample ID.
@@ -1216,29 +1930,34 @@ def check_email_sent(sample_id, table_name):
              Returns 0 if an email has not been sent, 1 if sent, 2 if not required,
              and None if no record is found or for any other unexpected value.
     """
-    engine = db_handler.get_engine()
+    return get_email_status_many([sample_id], table_name).get(sample_id)
+
+
+def get_email_status_many(sample_ids, table_name):
+    """
+    Reads the email sent status of many samples with a single SELECT statement.
+
+    :param sample_ids: List of sample IDs in the database.
+    :param table_name: The name of the table in the database.
+    :return: Dictionary of sample ID -> 0 (not sent), 1 (sent), 2 (not required) or None (no record or an
+             unexpected value).
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+    if not sample_ids:
+        return {}
+    ensure_monitor_schema()
 
-    # Construct the SQL query using text()
     query = text(f"""
-        SELECT EmailSent FROM {table_name}
-        WHERE SampleID = :sample_id
-    """)
+        SELECT SampleID, EmailSent FROM {table_name}
+        WHERE SampleID IN :sample_ids
+    """).bindparams(bindparam('sample_ids', expanding=True))
 
-    # Execute the query and fetch the result
-    with engine.connect() as connection:
-        result = connection.execute(query, {'sample_id': sample_id}).fetchone()
+    with db_handler.get_engine().connect() as connection:
+        rows = connection.execute(query, {'sample_ids': sample_ids}).fetchall()
 
-        # Check if the sample ID was found and return the appropriate value
-        if result:
-            # If result is a tuple, the EmailSent column is assumed to be at index 0
-            email_sent_status = result[0]
-            if email_sent_status in [0, 1, 2]:
-                return email_sent_status
-            else:
-                return None  # This covers empty or any other unexpected value
-        else:
-            # If no result is found for the sample ID, also return None
-            return None
+    found = {sample_id: email_sent for sample_id, email_sent in rows}
+    return {sample_id: found.get(sample_id) if found.get(sample_id) in [0, 1, 2] else None
+            for sample_id in sample_ids}
 
 
 def update_email_status(sample_id, table_name, review_status=None, email_sent=1):
@@ -1263,7 +1982,7 @@ def update_email_status(sample_id, table_name, review_status=None, email_sent=1)
     """)
 
     # Prepare a reference dictionary
-    order_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    order_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     params = {
         "email_sent": email_sent,
         "order_date": order_date,
@@ -1283,6 +2002,51 @@ def update_email_status(sample_id, table_name, review_status=None, email_sent=1)
         logger.info(update_msg)
 
 
+def update_email_status_many(sample_ids, table_name, review_status=None, email_sent=1):
+    """
+    Updates the email sent status and order date of many samples with a single UPDATE statement.
+
+    :param sample_ids: List of sample IDs in the database.
+    :param table_name: The name of the table in the database.
+    :param review_status: Optional. A review status for all samples, or a dictionary of sample ID -> review status.
+    :param email_sent: The status to set for EmailSent. Default is 1.
+    :return: Number of updated rows.
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+    if not sample_ids:
+        return 0
+
+    order_date = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    params = {'email_sent': email_sent, 'order_date': order_date, 'sample_ids': sample_ids}
+    update_values = "EmailSent = :email_sent, OrderDate = :order_date"
+
+    if isinstance(review_status, dict):
+        # One CASE expression keeps per-sample review statuses in the same statement
+        cases = []
+        for i, (sample_id, status) in enumerate(review_status.items()):
+            cases.append(f"WHEN :case_id_{i} THEN :case_status_{i}")
+            params[f'case_id_{i}'] = sample_id
+            params[f'case_status_{i}'] = status
+        if cases:
+            update_values += f", ReviewStatus = CASE SampleID {' '.join(cases)} ELSE ReviewStatus END"
+    elif review_status is not None:
+        update_values += ", ReviewStatus = :review_status"
+        params['review_status'] = review_status
+
+    update_stmt = text(f"""
+        UPDATE {table_name}
+        SET {update_values}
+        WHERE SampleID IN :sample_ids
+    """).bindparams(bindparam('sample_ids', expanding=True))
+
+    engine = db_handler.get_engine()
+    with engine.begin() as conn:
+        result = conn.execute(update_stmt, params)
+    logger.info(f"EmailSent updated to {email_sent} and OrderDate set to {order_date} for {result.rowcount} "
+                f"SampleIDs: {', '.join(sample_ids)}")
+    return result.rowcount
+
+
 def generate_testing_periods(cycle, max_cycle):
     periods = [cycle]
     for i in range(cycle * 2, max_cycle + 1, cycle):
@@ -1292,6 +2056,46 @@ def generate_testing_periods(cycle, max_cycle):
     return periods
 
 
+def send_approved_order(sampleID, primer_result, review_status, send_email=True):
+    """
+    Sends the order email of a sample that passed the CMS review and marks it as sent in monitor_order.
+
+    :param sampleID: The unique identifier for the sample.
+    :param primer_result: The file path of the primer order attached to the email.
+    :param review_status: Review status recorded in monitor_order, e.g. 'YSH(已审核)'.
+    :param send_email: Boolean flag indicating whether to send the email. Default is True.
+    """
+    toaddrs = config['emails']['setup']['log_toaddrs'] if DEBUG else config['emails']['setup']['order_toaddrs']
+    cc = config['emails']['setup']['log_cc'] if DEBUG else config['emails']['setup']['cc']
+
+    pro_subject = f'样本引物合成订购 (自动发送) - {sampleID} '
+    pro_message = f'样本ID：{sampleID}\nCMS审核结果：已通过\n引物结果：{os.path.basename(primer_result)}（见附件）'
+
+    if send_email:
+        emit(pro_subject, pro_message, attachments=[primer_result], to_addrs=toaddrs, cc_addrs=cc,
+             sample_id=sampleID, kind='order', once=True)
+        update_email_status(sampleID, 'monitor_order', review_status=review_status, email_sent=0 if DEBUG else 1)
+    logger.info('Complete the sample primer design and send the order!')
+
+
+def report_review_anomaly(sampleID, review_status, send_email=True):
+    """
+    Warns the QC team that the review of a sample ended abnormally and marks its order as not to be sent.
+
+    :param sampleID: The unique identifier for the sample.
+    :param review_status: Review status recorded in monitor_order.
+    :param send_email: Boolean flag indicating whether to send the email. Default is True.
+    """
+    qc_toaddrs = config['emails']['setup']['log_toaddrs'] if DEBUG else config['emails']['setup']['qc_toaddrs']
+
+    end_subject = f'样本状态检测异常警告 - {sampleID}'
+    end_message = f'警告：样本ID {sampleID} 样本状态检测异常。\nCMS审核状态：{review_status}\n提示：程序将自动退出以防止进一步的数据处理。\n请立即检查相关数据并采取适当措施。'
+    if send_email:
+        emit(end_subject, end_message, to_addrs=qc_toaddrs, sample_id=sampleID, kind='review_anomaly', once=True)
+        update_email_status(sampleID, 'monitor_order', review_status=review_status, email_sent=2)
+    logger.error(f'Sample ID {sampleID} review status {review_status} is abnormal; the order will not be sent.')
+
+
 def check_order(sampleID, primer_result, skip_review, send_email=True):
     """
     Monitors and manages the process of checking sample audit status, sending emails, and updating database.
@@ -1304,7 +2108,11 @@ def check_order(sampleID, primer_result, skip_review, send_email=True):
     The function implements a while loop that continuously checks the audit status of the sample.
     If the sample passes the audit, an email is sent, and the database is updated.
     If the sample is still under review, the function waits for a predefined interval before rechecking.
-    If the sample fails the audit or experiences an anomaly, an alert email is sent, and the function exits.
+    If the sample fails the audit or experiences an anomaly, an alert email is sent and ReviewTerminated is raised.
+
+    :return: 'sent' when the order email was sent, 'callback' when a review status callback sent it meanwhile,
+             'expired' when the review did not finish within max_interval_days, 'already_sent' or 'not_required'
+             when monitor_order says the order was sent before or is not to be sent.
     """
     check_toaddrs = config['emails']['setup']['log_toaddrs']
     qc_toaddrs = config['emails']['setup']['qc_toaddrs']
@@ -1319,49 +2127,68 @@ def check_order(sampleID, primer_result, skip_review, send_email=True):
     test_subject = f'样本引物合成订购 ( 预先订购 | 位点追加 | 项目测试 | 科研项目) - {sampleID} '
     test_message = f'样本ID：{sampleID}\n注：该引物合成用于(预先订购 | 位点追加 | 项目测试 | 科研项目)其中之一。\n引物结果：{os.path.basename(primer_result)}（见附件）'
 
-    pro_subject = f'样本引物合成订购 (自动发送) - {sampleID} '
-    pro_message = f'样本ID：{sampleID}\nCMS审核结果：已通过\n引物结果：{os.path.basename(primer_result)}（见附件）'
-
     email_status = check_email_sent(sampleID, 'monitor_order')
 
     if email_status == 0:
         # 如果EmailSent是0，发送邮件并更新数据库
         if skip_review:
             if send_email:
-                emit(test_subject, test_message, attachments=[primer_result], to_addrs=toaddrs, cc_addrs=cc)
+                emit(test_subject, test_message, attachments=[primer_result], to_addrs=toaddrs, cc_addrs=cc,
+                     sample_id=sampleID, kind='order', once=True)
                 update_email_status(sampleID, 'monitor_order', email_sent=0 if DEBUG else 1)
+            return 'sent'
         else:
             program_time = datetime.datetime.now()
             start_time = datetime.datetime.now()
-            check_interval_minutes = int(config['check_interval_minutes'])  # 检测时间
+            # 启用审核状态回调时，轮询只作为低频兜底
+            webhook_config = config.get('review_webhook') or {}
+            use_webhook = webhook_config.get('enabled', False)
+            check_interval_minutes = int(webhook_config.get('fallback_interval_minutes', 180)) \
+                if use_webhook else int(config['check_interval_minutes'])  # 检测时间
             check_frequency = datetime.timedelta(minutes=check_interval_minutes)  # min转换s
             email_cycle = int(config['email_interval_days'])  # 邮件预警周期
             max_days_to_check = int(config['max_interval_days'])  # 最大检测周期
             email_days = generate_testing_periods(email_cycle, max_days_to_check)  # 周期内天数
             is_first_check = True  # 持续监测预警
             last_email_sent = None  # 发送邮件标志
+            last_status, status_since = None, program_time  # 当前审核状态及首次检测到的时间
 
             while True:
-                status_abbr, status_desc = get_audit_status(sampleID)
+                # 订单可能已由审核状态回调 (review_webhook.py) 发送
+                if not is_first_check and check_email_sent(sampleID, 'monitor_order') != 0:
+                    logger.info(f'The order of {sampleID} was handled by a review status callback.')
+                    return 'callback'
+
+                polled = poll_audit_status(sampleID)
+                if polled is None:
+                    # 本周期 CMS 请求预算已用完，下一周期再检测
+                    time.sleep(get_cms_budget().seconds_to_next_cycle())
+                    continue
+                status_abbr, status_desc = polled
                 review_status = f'{status_abbr}({status_desc})'
+                if status_abbr != last_status:
+                    last_status, status_since = status_abbr, datetime.datetime.now()
 
                 # 审核通过
-                if status_abbr in ['YWC', 'YSH', 'BGYSH']:
-                    if send_email:
-                        emit(pro_subject, pro_message, attachments=[primer_result], to_addrs=toaddrs, cc_addrs=cc)
-                        update_email_status(sampleID, 'monitor_order', review_status=review_status, email_sent=0 if DEBUG else 1)
-                    logger.info('Complete the sample primer design and send the order!')
-                    break
+                if status_abbr in REVIEW_APPROVED:
+                    send_approved_order(sampleID, primer_result, review_status, send_email=send_email)
+                    return 'sent'
 
                 # 检测中
-                elif status_abbr in ['JCZ', 'DSH', 'BGDSH']:
+                elif status_abbr in REVIEW_PENDING:
                     if is_first_check:
                         check_subject = f'样本审核状态持续检测 - {sampleID}'
                         check_message = f'样本ID {sampleID} 审核状态持续检测中···\n目前样本审核状态：{review_status}。\n注意：在订单发送之前，审核人员可查看附件的引物订单检查错误，并告知程序管理人员终止自动发送程序。\n提示：程序会按照自定义时间检测CMS系统审核状态，等待审核状态发生改变，该引物订单会自动发送订购。'
                         if send_email:
-                            emit(check_subject, check_message, attachments=[primer_result], to_addrs=qc_toaddrs)
+                            emit(check_subject, check_message, attachments=[primer_result], to_addrs=qc_toaddrs,
+                                 sample_id=sampleID, kind='review_check', once=True)
                         is_first_check = False
 
+                    # 未启用回调时按历史审核时长安排下一次检测：审核不太可能时稀疏，预计状态变化前后密集
+                    if not use_webhook:
+                        check_frequency = datetime.timedelta(
+                            minutes=next_check_minutes(status_abbr, status_since, program_time))
+
                     # 根据自定义时间间隔等待下一次检测
                     current_time = datetime.datetime.now()
 
@@ -1388,17 +2215,19 @@ def check_order(sampleID, primer_result, skip_review, send_email=True):
                                     tip_subject = f'样本审核状态超过 {days_since_last_email} 天未更新提醒 - {sampleID} '
                                     tip_message = f'样本ID：{sampleID}\nCMS审核结果：检测到已经超过 {days_since_last_email} 天未通过审核，请审核人员检查并更新状态！\n检测时间：{program_time_formatted} —— {current_time_formatted}\n 。'
                                     if send_email:
-                                        emit(tip_subject, tip_message, to_addrs=qc_toaddrs)
+                                        emit(tip_subject, tip_message, to_addrs=qc_toaddrs, sample_id=sampleID,
+                                             kind='review_reminder', once=True)
                                     last_email_sent = current_time
                             else:
                                 if last_email_sent is None or (current_time - last_email_sent).days >= email_cycle:
                                     warning_subject = f'样本审核状态超过半个月未更新警告 - {sampleID} '
                                     warning_message = f'样本ID：{sampleID}\nCMS审核结果：检测到已经超过半个月未通过审核，请审核人员检查并更新状态！\n检测时间：{program_time_formatted} —— {current_time_formatted}\n警告：该样本审核状态最后一次检测，程序将自动退出以防止进一步的数据处理。\n请立即检查相关数据并采取适当措施。'
                                     if send_email:
-                                        emit(warning_subject, warning_message, to_addrs=qc_toaddrs)
+                                        emit(warning_subject, warning_message, to_addrs=qc_toaddrs,
+                                             sample_id=sampleID, kind='review_warning', once=True)
                                     logger.info(
                                         f'The program has been running for more than {max_days_to_check} days. Exiting program.')
-                                    break
+                                    return 'expired'
                         # 重置 start_time
                         start_time = datetime.datetime.now()
 
@@ -1409,15 +2238,10 @@ def check_order(sampleID, primer_result, skip_review, send_email=True):
 
                 # 检测终止
                 else:
-                    end_subject = f'样本状态检测异常警告 - {sampleID}'
-                    end_message = f'警告：样本ID {sampleID} 样本状态检测异常。\nCMS审核状态：{review_status}\n提示：程序将自动退出以防止进一步的数据处理。\n请立即检查相关数据并采取适当措施。'
-                    if send_email:
-                        emit(end_subject, end_message, to_addrs=qc_toaddrs)
-                        update_email_status(sampleID, 'monitor_order', review_status=review_status,
-                                            email_sent=2)
-                    logger.error(
-                        f'Sample ID {sampleID} Detect the anomaly and exit the program. Please check the relevant data immediately and take appropriate action.')
-                    sys.exit(1)
+                    report_review_anomaly(sampleID, review_status, send_email=send_email)
+                    raise ReviewTerminated(
+                        f'Sample ID {sampleID} Detect the anomaly and exit the program. Please check the relevant data immediately and take appropriate action.',
+                        sampleID)
 
     elif email_status in [1, 2]:
         # 如果EmailSent是1，已经发送过邮件了，如果DEBUG为True还会发送至测试邮箱
@@ -1428,23 +2252,135 @@ def check_order(sampleID, primer_result, skip_review, send_email=True):
                 logger.info(f"Email sent to DEBUG addresses for SampleID: {sampleID}.")
         else:
             logger.info(f"No action needed for SampleID: {sampleID} as EmailSent is {email_status}")
-        sys.exit(0)
+        return 'already_sent' if email_status == 1 else 'not_required'
 
     else:
         # 如果EmailSent是None或其他值，发送错误消息并退出程序
-        logger.error(f"Unexpected EmailSent status for SampleID: {sampleID}")
-        sys.exit(1)
+        raise OrderError(f"Unexpected EmailSent status for SampleID: {sampleID}", sampleID)
 
 
-def execute(args):
+def init_result_cache(no_cache=False, refresh=False):
+    """
+    Initializes the MFEPrimer result cache from the configuration.
+
+    :param no_cache: Disable the cache entirely if set.
+    :param refresh: Ignore cached results but store the new ones if set.
+    :return: A PrimerCache instance, or None if caching is disabled.
+    """
+    cache_config = config.get('primer_cache') or {}
+    if no_cache or not cache_config.get('enabled', True):
+        logger.info('MFEPrimer result cache is disabled.')
+        return None
+
+    return primer_cache.PrimerCache(cache_config.get('dir', './primer_cache'),
+                                    max_size_mb=cache_config.get('max_size_mb', 512),
+                                    max_entries=cache_config.get('max_entries', 5000),
+                                    max_age_days=cache_config.get('max_age_days', 30),
+                                    refresh=refresh)
+
+
+def init_rate_limiter():
+    """
+    Opens the rate limiter shared by all processes that submit design jobs, as configured in config.yaml.
+
+    :return: A RateLimiter instance, or None if the limiter is disabled.
+    """
+    limiter_config = config.get('rate_limiter') or {}
+    if not limiter_config.get('enabled', True):
+        return None
+    return rate_limiter.RateLimiter(limiter_config.get('path', './primer_cache/rate_limiter.sqlite'),
+                                    rate_per_minute=limiter_config.get('rate_per_minute', 30),
+                                    burst=limiter_config.get('burst', 5),
+                                    max_concurrency=limiter_config.get('max_concurrency', 8),
+                                    lease_seconds=int(limiter_config.get('lease_minutes', 60)) * 60,
+                                    poll_interval=limiter_config.get('poll_interval', 0.5))
+
+
+def sample_priority(sample_id, exit_threshold=None):
+    """
+    Returns the scheduling priority of a sample: the days left before it reaches the exit threshold.
+    Samples closest to the threshold are designed first.
+
+    :param sample_id: The sample ID, e.g., 'NGS231115-194WX'.
+    :param exit_threshold: Days after which the program exits for the sample, or None if disabled.
+    :return: Days left, or None if the sample has no date or there is no threshold.
+    """
+    date_match = re.search(r'NGS(\d{2})(\d{2})(\d{2})-', sample_id)
+    if not date_match or not exit_threshold:
+        return None
+    sample_date = datetime.datetime(int(date_match.group(1)) + 2000, int(date_match.group(2)),
+                                    int(date_match.group(3)))
+    return exit_threshold - (datetime.datetime.now() - sample_date).days
+
+
+def locus_key(url=None):
+    """
+    Returns the (reference, parameter hash, service) under which designs against a service are kept in the
+    locus store.
+
+    :param url: URL of the design service, defaults to the MFEPrimer URL of config.yaml.
+    :return: Tuple of (reference, params_hash, service).
+    """
+    PRIMER_PARAMS = config['PRIMER_PARAMS']
+    return (PRIMER_PARAMS['DB'], primer_cache.params_hash(PRIMER_PARAMS),
+            primer_cache.service_id(url or config['mfe_primer']))
+
+
+def locus_min_attempts():
+    return int((config.get('locus_store') or {}).get('min_attempts', 1))
+
+
+def init_locus_store():
+    """
+    Opens the cross-sample locus primer store configured in config.yaml.
+
+    :return: A LocusStore instance, or None if the store is disabled.
+    """
+    store_config = config.get('locus_store') or {}
+    if not store_config.get('enabled', True):
+        return None
+    return locus_store.LocusStore(store_config.get('path', './primer_cache/locus_store.sqlite'))
+
+
+def design_sample(sampleID, input_file, output_dir, mold, design_id=0, url=None, send_email=True, cancer_id=None,
+                  email_interval=10, exit_threshold=30, no_timeout=False, skip_snp=False, skip_hot=False,
+                  skip_driver=False, skip_check=False, skip_review=False, run_order=False, no_cache=False,
+                  refresh=False, resume=False, isolate=False, speculate=False, debug=False):
+    """
+    Designs the primers of a sample and writes its order. Failures raise DesignError subclasses instead of
+    ending the process, so that batch drivers and the worker pool can design many samples in one process.
+
+    :param sampleID: Sample ID for primer design.
+    :param input_file: Loci file of the sample.
+    :param output_dir: Output directory for primer results and orders.
+    :param mold: Order template, e.g. 'sh', 'hz', 'sg', 'dg'.
+    :param design_id: ID of the design reported back to the panel backend (-id).
+    :param url: URL of the MFEPrimer site. Default is mfe_primer of config.yaml.
+    :param run_order: Wait for the CMS review and send the order (check_order).
+    :param debug: Run in debug mode; False uses DEBUG of config.yaml.
+    The other parameters are the command line options of the same name.
+    :return: A SampleResult. Samples that need no design ('skipped') or go to the reviewers ('held') are
+             returned, not raised.
+    :raises DesignError: LociFileError, HotspotFileError, CmsError, QcError, OrderError or ReviewTerminated.
+    """
     global DEBUG
 
     global sid
 
-    sid = args.id
+    global result_cache
 
-    # 确定 DEBUG 模式：如果命令行参数指定了 --debug，则使用该参数，否则使用配置文件中的设置
-    DEBUG = args.debug if args.debug else config.get('DEBUG', False)
+    global locus_db
+
+    global design_limiter
+
+    global design_priority
+
+    start = time.time()
+    sid = design_id
+    url = url or config['mfe_primer']
+
+    # 确定 DEBUG 模式：如果指定了 debug，则使用该参数，否则使用配置文件中的设置
+    DEBUG = debug if debug else config.get('DEBUG', False)
 
     # 使用 DEBUG 变量
     if DEBUG:
@@ -1454,23 +2390,13 @@ def execute(args):
         # 运行非调试模式下的代码
         logger.info("Running in normal mode...")
 
-    # 设置参数变量
-    sampleID = args.sampleID
-    mold = args.mold
-    file_path = args.input_file
-    output_dir = args.output_dir
-    url = args.url
-    send_email = args.send_email
-    cancer_id = args.cancer_id
-    email_interval = args.email_interval
-    exit_threshold = args.exit_threshold
-    no_timeout = args.no_timeout
-    skip_snp_design = args.skip_snp
-    skip_hot_design = args.skip_hot
-    skip_driver_design = args.skip_driver
-    skip_check = args.skip_check
-    skip_review = args.skip_review
-    run_order = args.run_order
+    first_iteration = None
+
+    # 初始化引物设计结果缓存
+    result_cache = init_result_cache(no_cache=no_cache, refresh=refresh)
+    locus_db = init_locus_store()
+    design_limiter = init_rate_limiter()
+    design_priority = sample_priority(sampleID, None if no_timeout else exit_threshold)
 
     # 输出文件夹处理
     outcome_dir = os.path.join(os.path.abspath(output_dir), 'primer_outcome')
@@ -1478,46 +2404,128 @@ def execute(args):
     order_dir = os.path.join(os.path.abspath(output_dir), 'primer_order')
     os.makedirs(order_dir, exist_ok=True)
 
-    # 检查日期，默认10天发邮件提示，超过30天退出程序
-    if not no_timeout:
-        check_sample_date(sampleID, send_email=send_email, email_interval=email_interval, exit_threshold=exit_threshold)
-
-    # 是否跳过样本检查
-    if not skip_check:
-        # 检查样本项目
-        handle_mrd_sample(sampleID, send_email=send_email)
-
-    # 读取选点文件
-    df = read_loci_file(file_path)
-
-    # 判断和处理选点
-    df_loci = loci_examined(df, skip_snp_design, skip_hot_design, skip_driver_design, cancer_id=cancer_id,
-                            send_email=send_email)
+    try:
+        report_progress('checks')
+        # 检查日期，默认10天发邮件提示，超过30天退出
+        if not no_timeout:
+            check_sample_date(sampleID, send_email=send_email, email_interval=email_interval,
+                              exit_threshold=exit_threshold)
+
+        # 是否跳过样本检查
+        if not skip_check:
+            # 检查样本项目
+            handle_mrd_sample(sampleID, send_email=send_email)
+
+        # 读取选点文件
+        df = read_loci_file(input_file)
+
+        # 判断和处理选点
+        df_loci = loci_examined(df, skip_snp, skip_hot, skip_driver, cancer_id=cancer_id, send_email=send_email,
+                                url=url)
+    except SampleStopped as e:
+        logger.info(str(e))
+        return SampleResult(sampleID, e.status, message=str(e), seconds=time.time() - start)
 
     # 添加 templateID
     df_design = add_templateID(df_loci)
-
-    # 优先 driver 基因进行引物设计
-    df_no_driver, design_num, driver_list, driver_str = process_driver(df_design, url, outcome_dir, sampleID,
-                                                                       skip_driver_design)
+    report_progress('loci', loci=int(df_design.shape[0]))
+
+    # 读取断点
+    input_hash = design_hash(df_design)
+    checkpoint = load_checkpoint(outcome_dir, sampleID, input_hash) if resume else None
+
+    if checkpoint:
+        df_design['driver'] = pd.to_numeric(df_design['driver'], errors='coerce').fillna(0)
+        df_no_driver, design_num = checkpoint['df_no_driver'], checkpoint['design_num']
+        driver_list, driver_str = checkpoint['driver_list'], checkpoint['driver_str']
+        if 'first_df_res' in checkpoint:
+            first_iteration = (checkpoint['first_result_string'], checkpoint['first_not_used'],
+                               checkpoint['first_df_res'])
+    else:
+        df_design['driver'] = pd.to_numeric(df_design['driver'], errors='coerce').fillna(0)
+        report_progress('driver', drivers=int((df_design['driver'] > 0).sum()))
+        if speculate and not skip_driver and df_design['driver'].sum() > 1:
+            # driver 兼容性检测与第 1 次引物设计并行
+            df_no_driver, design_num, driver_list, driver_str, first_iteration = speculative_driver_design(
+                df_design, url, outcome_dir, sampleID)
+        else:
+            # 优先 driver 基因进行引物设计
+            df_no_driver, design_num, driver_list, driver_str = process_driver(df_design, url, outcome_dir, sampleID,
+                                                                               skip_driver)
+        checkpoint = {
+            'params_hash': primer_cache.params_hash(config['PRIMER_PARAMS']),
+            'input_hash': input_hash,
+            'stage': 'driver',
+            'num': 0,
+            'df_no_driver': df_no_driver,
+            'design_num': design_num,
+            'driver_list': driver_list,
+            'driver_str': driver_str,
+        }
+        if first_iteration:
+            # 推测的第 1 次引物设计一并保存，续跑时不再重复提交
+            checkpoint['first_result_string'], checkpoint['first_not_used'], checkpoint['first_df_res'] = (
+                first_iteration[0], list(first_iteration[1] or []), first_iteration[2])
+        save_checkpoint(outcome_dir, sampleID, checkpoint)
 
     # 循环设计引物
-    df_res = perform_primer_design(df_no_driver, sampleID, url, outcome_dir, design_num, driver_list, driver_str)
+    df_res = perform_primer_design(df_no_driver, sampleID, url, outcome_dir, design_num, driver_list, driver_str,
+                                   checkpoint=checkpoint, isolate=isolate, first_iteration=first_iteration)
+
+    if result_cache:
+        logger.info(f'MFEPrimer result cache: {result_cache.hits} hits, {result_cache.misses} misses.')
+    if url in mfe_sessions:
+        mfe_sessions[url].log_stats()
+    if design_limiter:
+        design_limiter.log_stats()
 
     # 写入订单表
-    primer_result = write_order(sampleID, df_design, df_res, order_dir, mold, skip_snp_design, send_email=send_email)
+    report_progress('order', primers=int(df_res.shape[0]))
+    primer_result = write_order(sampleID, df_design, df_res, order_dir, mold, skip_snp, send_email=send_email)
 
     # 检查订单状态
+    review = None
     if run_order:
-        check_order(sampleID, primer_result, skip_review, send_email)
-
-    # 返回订单表
-    print(primer_result)
+        report_progress('review', order_file=primer_result)
+        review = check_order(sampleID, primer_result, skip_review, send_email)
 
     doBack('', primer_result)
 
+    return SampleResult(sampleID, 'ordered', order_file=primer_result, primers=int(df_res.shape[0]), review=review,
+                        seconds=time.time() - start)
 
-def main():
+
+def sample_kwargs(args):
+    """
+    Converts the parsed command line of build_parser into the keyword arguments of design_sample.
+    """
+    return {
+        'sampleID': args.sampleID, 'input_file': args.input_file, 'output_dir': args.output_dir, 'mold': args.mold,
+        'design_id': args.id, 'url': args.url, 'send_email': args.send_email, 'cancer_id': args.cancer_id,
+        'email_interval': args.email_interval, 'exit_threshold': args.exit_threshold, 'no_timeout': args.no_timeout,
+        'skip_snp': args.skip_snp, 'skip_hot': args.skip_hot, 'skip_driver': args.skip_driver,
+        'skip_check': args.skip_check, 'skip_review': args.skip_review, 'run_order': args.run_order,
+        'no_cache': args.no_cache, 'refresh': args.refresh, 'resume': args.resume, 'isolate': args.isolate,
+        'speculate': args.speculate, 'debug': args.debug,
+    }
+
+
+def execute(args):
+    """
+    Runs design_sample for a parsed command line and turns its outcome into the exit code of the process.
+    """
+    try:
+        result = design_sample(**sample_kwargs(args))
+    except DesignError as e:
+        logger.error(str(e))
+        sys.exit(e.exit_code)
+
+    # 返回订单表
+    if result.order_file:
+        print(result.order_file)
+
+
+def build_parser():
     # 设置命令行参数
     parser = argparse.ArgumentParser(description='Automatic primer design.')
 
@@ -1526,7 +2534,8 @@ def main():
                         help='ID for primer design.')
     parser.add_argument('-s', '--sample-id', required=True, dest='sampleID',
                         help='Sample ID for primer design.')
-    parser.add_argument('-m', '--mold', required=True, dest='mold', choices=['sh', 'hz', 'sg', 'dg'],
+    parser.add_argument('-m', '--mold', required=True, dest='mold',
+                        choices=[mold for mold in config['order_layouts'] if mold in config['order_template']],
                         help='Currently, the order template is only available in sh(上海百力格), hz(湖州河马), sg(上海生工), dg(上海迪赢).')
     parser.add_argument('-i', '--input_file', required=True, dest='input_file',
                         help='Input file path for primer design.')
@@ -1558,11 +2567,24 @@ def main():
                         help='Skip review process if set.')
     parser.add_argument('--run-order', action='store_true', dest='run_order',
                         help='Run the check_order function if set.')
+    parser.add_argument('--no-cache', action='store_true', dest='no_cache',
+                        help='Do not read or write the MFEPrimer result cache.')
+    parser.add_argument('--refresh', action='store_true', dest='refresh',
+                        help='Ignore cached MFEPrimer results and overwrite them with new ones.')
+    parser.add_argument('--resume', action='store_true', dest='resume',
+                        help='Continue primer design from the last completed iteration of a previous run.')
+    parser.add_argument('--isolate', action='store_true', dest='isolate',
+                        help='Isolate loci that knock out others by bisection with parallel sub-jobs.')
+    parser.add_argument('--speculate', action='store_true', dest='speculate',
+                        help='Design the first main panel while the driver check is running.')
     parser.add_argument('--debug', action='store_true', dest='debug',
                         help='Run in debug mode.')
+    return parser
+
 
+def main():
     # 解析命令行参数
-    args = parser.parse_args()
+    args = build_parser().parse_args()
     execute(args)
 
 
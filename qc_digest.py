@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/25 09:20
+@Author  : lbfeng
+@File    : qc_digest.py
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+import datetime
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Notification reasons that can be collected into a digest, with their heading in the digest email
+REASONS = {
+    'date_warning': '样本日期检查警告',
+    'not_mrd': '样本项目检查警告',
+    'cancer_type': '样本 cancer_type_ID 检查警告',
+    'loci_count': '样本位点数量检查警告',
+    'primer_qc': '样本引物结果检查警告',
+}
+
+
+class QcDigest:
+    """
+    Buffer of non-critical QC notifications shared by every process of the host through a SQLite database.
+    Buffered notifications are sent as one digest email per recipient list, grouped by sample and reason,
+    once the oldest one has waited interval_minutes or when a flush is forced at the end of a batch.
+    """
+
+    def __init__(self, db_path, interval_minutes=60):
+        """
+        :param db_path: Path of the SQLite database file.
+        :param interval_minutes: Maximum time a notification waits in the buffer.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.interval = float(interval_minutes) * 60
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS notices (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    recipients TEXT NOT NULL,
+                    sample_id TEXT,
+                    reason TEXT NOT NULL,
+                    subject TEXT NOT NULL,
+                    message TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def add(self, reason, sample_id, subject, message, to_addrs):
+        """
+        Buffers a notification for the next digest.
+        """
+        with self._connect() as conn:
+            conn.execute("""
+                INSERT INTO notices (recipients, sample_id, reason, subject, message, created) VALUES (?, ?, ?, ?, ?, ?)
+            """, (json.dumps(sorted(to_addrs)), sample_id, reason, subject, message, time.time()))
+        logger.info(f"Notification '{subject}' buffered for the QC digest.")
+
+    def due(self):
+        """
+        Checks whether the oldest buffered notification has waited the digest interval.
+        """
+        with self._connect() as conn:
+            oldest = conn.execute('SELECT MIN(created) FROM notices').fetchone()[0]
+        return oldest is not None and time.time() - oldest >= self.interval
+
+    def take(self):
+        """
+        Removes all buffered notifications and returns them.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute("""
+                SELECT id, recipients, sample_id, reason, subject, message, created FROM notices ORDER BY id
+            """).fetchall()
+            conn.execute('DELETE FROM notices WHERE id <= ?', (rows[-1][0],) if rows else (0,))
+            conn.execute('COMMIT')
+        return rows
+
+    def restore(self, rows):
+        """
+        Puts notifications taken by take back into the buffer.
+        """
+        with self._connect() as conn:
+            conn.executemany("""
+                INSERT INTO notices (id, recipients, sample_id, reason, subject, message, created)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def flush(self, send, force=False):
+        """
+        Sends the buffered notifications as digest emails.
+
+        :param send: Callable send(subject, message, to_addrs) that sends one email.
+        :param force: Send even if the digest interval has not passed, e.g. at the end of a batch.
+        :return: Number of notifications sent.
+        """
+        if not force and not self.due():
+            return 0
+        rows = self.take()
+        if not rows:
+            return 0
+
+        by_recipients = {}
+        for row in rows:
+            by_recipients.setdefault(row[1], []).append(row)
+
+        sent = []
+        try:
+            for recipients, notices in by_recipients.items():
+                subject, message = render_digest(notices)
+                send(subject, message, json.loads(recipients))
+                sent.extend(notices)
+        except Exception:
+            # Notifications of digests that were not sent stay in the buffer
+            self.restore([row for row in rows if row not in sent])
+            raise
+
+        logger.info(f'QC digest with {len(rows)} notifications sent in {len(by_recipients)} emails.')
+        return len(rows)
+
+
+def render_digest(notices):
+    """
+    Renders one digest email of notifications, grouped by sample and then by reason.
+
+    :param notices: List of notice rows (id, recipients, sample_id, reason, subject, message, created).
+    :return: Tuple of (subject, message).
+    """
+    samples = {}
+    for _, _, sample_id, reason, subject, message, created in notices:
+        samples.setdefault(sample_id or '未知样本', {}).setdefault(reason, []).append((created, message))
+
+    start = datetime.datetime.fromtimestamp(min(row[6] for row in notices)).strftime('%Y-%m-%d %H:%M:%S')
+    end = datetime.datetime.fromtimestamp(max(row[6] for row in notices)).strftime('%Y-%m-%d %H:%M:%S')
+
+    counts = {}
+    for row in notices:
+        counts[row[3]] = counts.get(row[3], 0) + 1
+    summary = '\n'.join(f'{REASONS.get(reason, reason)}：{count} 条' for reason, count in counts.items())
+
+    sections = []
+    for sample_id, reasons in samples.items():
+        lines = [f'==== 样本ID：{sample_id} ====']
+        for reason, items in reasons.items():
+            lines.append(f'【{REASONS.get(reason, reason)}】')
+            for created, message in items:
+                lines.append(f"{datetime.datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')}\n{message}")
+        sections.append('\n'.join(lines))
+
+    subject = f'样本质控通知汇总 - {len(samples)} 个样本 {len(notices)} 条'
+    message = f'汇总时间：{start} —— {end}\n{summary}\n\n' + '\n\n'.join(sections)
+    return subject, message
+
+
+def open_digest(config):
+    """
+    Opens the QC digest configured in the qc_digest section of config.yaml.
+
+    :return: A QcDigest instance, or None if the digest is disabled.
+    """
+    digest_config = config.get('qc_digest') or {}
+    if not digest_config.get('enabled', True):
+        return None
+    return QcDigest(digest_config.get('path', './primer_cache/qc_digest.sqlite'),
+                    interval_minutes=digest_config.get('interval_minutes', 60))
+
+
+def main():
+    import primer_design
+
+    parser = argparse.ArgumentParser(description='Send the buffered QC notifications as digest emails.')
+    parser.add_argument('--force', action='store_true', dest='force',
+                        help='Send the digest now, e.g. at the end of a batch, instead of only when it is due.')
+    parser.add_argument('--debug', action='store_true', dest='debug',
+                        help='Run in debug mode.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    # emit reads the debug flag of primer_design
+    primer_design.DEBUG = args.debug if args.debug else primer_design.config.get('DEBUG', False)
+    count = primer_design.flush_qc_digest(force=args.force)
+    logger.info(f'{count} buffered notifications sent.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/22 10:10
+@Author  : lbfeng
+@File    : rate_limiter.py
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import logging
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Priority of jobs without a sample deadline, e.g. atlas jobs; lower values are served first
+LOWEST_PRIORITY = 1e9
+
+
+def pid_alive(pid):
+    """
+    Checks whether a process of this host is still running.
+    """
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class RateLimiter:
+    """
+    Cross-process token bucket and concurrency limiter for remote primer design jobs, shared through a
+    SQLite database by every primer_design.py process of the host (or of a shared file system).
+
+    Waiting jobs are granted in order of (running jobs of the same sample, priority, arrival), so a sample
+    with many sub-jobs in flight yields to other samples and, among equals, the most urgent sample goes first.
+    """
+
+    def __init__(self, db_path, rate_per_minute=30, burst=5, max_concurrency=8, lease_seconds=3600,
+                 poll_interval=0.5, history=1000, label='设计任务'):
+        """
+        :param db_path: Path of the SQLite database file.
+        :param rate_per_minute: Job submissions allowed per minute across all processes.
+        :param burst: Submissions that may be made at once after an idle period.
+        :param max_concurrency: Jobs allowed to run on the remote service at the same time.
+        :param lease_seconds: A granted job holding its slot longer than this is treated as abandoned.
+        :param poll_interval: Seconds between two checks of a waiting job.
+        :param history: Number of finished jobs kept for the wait time metrics.
+        :param label: Name of the limited jobs in log messages.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.rate = float(rate_per_minute) / 60
+        self.burst = float(burst)
+        self.max_concurrency = int(max_concurrency)
+        self.lease_seconds = float(lease_seconds)
+        self.poll_interval = float(poll_interval)
+        self.history = int(history)
+        self.label = label
+        self.host = socket.gethostname()
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS bucket (
+                    name TEXT PRIMARY KEY,
+                    tokens REAL NOT NULL,
+                    updated REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS tickets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sample_id TEXT NOT NULL,
+                    priority REAL NOT NULL,
+                    enqueued REAL NOT NULL,
+                    granted REAL,
+                    host TEXT,
+                    pid INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS waits (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    sample_id TEXT NOT NULL,
+                    priority REAL NOT NULL,
+                    finished REAL NOT NULL,
+                    wait REAL NOT NULL,
+                    held REAL NOT NULL
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def _reap(self, conn, now):
+        """
+        Removes the tickets of processes that died and of granted jobs that exceeded their lease.
+        """
+        for ticket_id, pid in conn.execute('SELECT id, pid FROM tickets WHERE host = ?', (self.host,)).fetchall():
+            if not pid_alive(pid):
+                conn.execute('DELETE FROM tickets WHERE id = ?', (ticket_id,))
+        conn.execute('DELETE FROM tickets WHERE granted IS NOT NULL AND granted < ?', (now - self.lease_seconds,))
+
+    def _take_token(self, conn, now):
+        """
+        Refills the bucket for the elapsed time and takes one token if available.
+
+        :return: Seconds until a token is available; 0 if one was taken.
+        """
+        row = conn.execute("SELECT tokens, updated FROM bucket WHERE name = 'design'").fetchone()
+        tokens, updated = row if row else (self.burst, now)
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        if tokens < 1:
+            conn.execute("INSERT OR REPLACE INTO bucket (name, tokens, updated) VALUES ('design', ?, ?)",
+                         (tokens, now))
+            return (1 - tokens) / self.rate if self.rate else self.poll_interval
+        conn.execute("INSERT OR REPLACE INTO bucket (name, tokens, updated) VALUES ('design', ?, ?)",
+                     (tokens - 1, now))
+        return 0
+
+    def _try_grant(self, ticket_id, now):
+        """
+        Grants the ticket if it is at the head of the queue and a slot and a token are free.
+
+        :return: Tuple of (granted, queue depth, seconds to sleep).
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._reap(conn, now)
+                depth = conn.execute('SELECT COUNT(*) FROM tickets WHERE granted IS NULL').fetchone()[0]
+                in_flight = conn.execute('SELECT COUNT(*) FROM tickets WHERE granted IS NOT NULL').fetchone()[0]
+                head = conn.execute("""
+                    SELECT t.id FROM tickets t WHERE t.granted IS NULL
+                    ORDER BY (SELECT COUNT(*) FROM tickets g WHERE g.granted IS NOT NULL AND g.sample_id = t.sample_id),
+                             t.priority, t.enqueued, t.id
+                    LIMIT 1
+                """).fetchone()
+
+                if in_flight >= self.max_concurrency or not head or head[0] != ticket_id:
+                    conn.execute('COMMIT')
+                    return False, depth, self.poll_interval
+
+                delay = self._take_token(conn, now)
+                if delay:
+                    conn.execute('COMMIT')
+                    return False, depth, min(max(delay, 0.01), self.poll_interval)
+
+                conn.execute('UPDATE tickets SET granted = ? WHERE id = ?', (now, ticket_id))
+                conn.execute('COMMIT')
+                return True, depth - 1, 0
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def acquire(self, sample_id, priority=None, timeout=None):
+        """
+        Waits until a design job of the sample may be submitted.
+
+        :param sample_id: Sample the job belongs to; used for fair sharing.
+        :param priority: Lower values are served first, e.g. days left before the sample's exit threshold.
+        :param timeout: Maximum number of seconds to wait, or None to wait indefinitely.
+        :return: Ticket to pass to release.
+        """
+        priority = LOWEST_PRIORITY if priority is None else float(priority)
+        enqueued = time.time()
+        with self._connect() as conn:
+            ticket_id = conn.execute("""
+                INSERT INTO tickets (sample_id, priority, enqueued, host, pid) VALUES (?, ?, ?, ?, ?)
+            """, (sample_id, priority, enqueued, self.host, os.getpid())).lastrowid
+
+        try:
+            while True:
+                now = time.time()
+                granted, depth, delay = self._try_grant(ticket_id, now)
+                if granted:
+                    wait = now - enqueued
+                    if wait >= 1:
+                        logger.info(f'样本 - {sample_id} {self.label}排队 {wait:.1f}s 后提交，当前队列深度 {depth}')
+                    return {'id': ticket_id, 'sample_id': sample_id, 'priority': priority,
+                            'enqueued': enqueued, 'granted': now}
+                if timeout is not None and now - enqueued > timeout:
+                    raise TimeoutError(f'Design job of {sample_id} waited more than {timeout} seconds for a slot.')
+                time.sleep(delay)
+        except BaseException:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM tickets WHERE id = ?', (ticket_id,))
+            raise
+
+    def release(self, ticket):
+        """
+        Frees the slot of a finished job and records its wait and run time.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM tickets WHERE id = ?', (ticket['id'],))
+            conn.execute('INSERT INTO waits (sample_id, priority, finished, wait, held) VALUES (?, ?, ?, ?, ?)',
+                         (ticket['sample_id'], ticket['priority'], now, ticket['granted'] - ticket['enqueued'],
+                          now - ticket['granted']))
+            conn.execute('DELETE FROM waits WHERE id <= (SELECT MAX(id) FROM waits) - ?', (self.history,))
+            conn.execute('COMMIT')
+
+    @contextlib.contextmanager
+    def slot(self, sample_id, priority=None, timeout=None):
+        """
+        Context manager holding a design slot for the duration of the block.
+        """
+        ticket = self.acquire(sample_id, priority=priority, timeout=timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        """
+        Returns the current queue depth, running jobs and the wait time distribution of recent jobs.
+        """
+        with self._connect() as conn:
+            depth = conn.execute('SELECT COUNT(*) FROM tickets WHERE granted IS NULL').fetchone()[0]
+            in_flight = conn.execute('SELECT COUNT(*) FROM tickets WHERE granted IS NOT NULL').fetchone()[0]
+            samples = conn.execute('SELECT COUNT(DISTINCT sample_id) FROM tickets').fetchone()[0]
+            waits = [row[0] for row in conn.execute('SELECT wait FROM waits')]
+            held = [row[0] for row in conn.execute('SELECT held FROM waits')]
+
+        return {
+            'queue_depth': depth,
+            'in_flight': in_flight,
+            'samples': samples,
+            'jobs': len(waits),
+            'wait_mean': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_p50': round(percentile(waits, 50), 3),
+            'wait_p95': round(percentile(waits, 95), 3),
+            'wait_max': round(max(waits), 3) if waits else 0.0,
+            'held_p50': round(percentile(held, 50), 3),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(f"Design limiter: queue depth {stats['queue_depth']}, {stats['in_flight']} jobs running, "
+                    f"wait p50 {stats['wait_p50']}s / p95 {stats['wait_p95']}s over the last {stats['jobs']} jobs.")
+
+
+def main():
+    import argparse
+    from primer_design import init_rate_limiter
+
+    parser = argparse.ArgumentParser(description='Print the queue depth and wait time metrics of the shared '
+                                                 'rate limiter of remote primer design jobs.')
+    parser.parse_args()
+
+    limiter = init_rate_limiter()
+    if limiter is None:
+        parser.error('The rate limiter is disabled in config.yaml.')
+    print(json.dumps(limiter.stats(), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/27 09:50
+@Author  : lbfeng
+@File    : review_schedule.py
+"""
+import os
+import json
+import math
+import time
+import bisect
+import sqlite3
+import logging
+import argparse
+import datetime
+import contextlib
+import pandas as pd
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Key of the latencies measured from DesignDate, used for statuses with too little history
+DESIGN = 'design'
+
+
+class LatencyModel:
+    """
+    Empirical distribution of the time left until a sample is approved, per CMS review status.
+
+    The next check of a sample is placed where the approvals still to come, given the time already waited,
+    reach the step quantile: checks are dense while approvals are frequent and sparse while they are unlikely.
+    """
+
+    def __init__(self, latencies, min_samples=20, step=0.02, min_minutes=5, max_minutes=240, default_minutes=30):
+        """
+        :param latencies: Dictionary status abbreviation (or DESIGN) -> list of hours until approval.
+        :param min_samples: Minimum history of a status before its distribution is used.
+        :param step: Share of the remaining approvals covered by one check interval.
+        :param min_minutes: Shortest check interval.
+        :param max_minutes: Longest check interval.
+        :param default_minutes: Interval used when there is not enough history.
+        """
+        self.latencies = {key: sorted(values) for key, values in latencies.items()}
+        self.min_samples = min_samples
+        self.step = step
+        self.min_minutes = min_minutes
+        self.max_minutes = max_minutes
+        self.default_minutes = default_minutes
+
+    def next_interval(self, status_abbr, status_hours, design_hours):
+        """
+        Returns the minutes to wait before the next check of a sample.
+
+        :param status_abbr: Current review status abbreviation.
+        :param status_hours: Hours since the sample was first seen in the current status.
+        :param design_hours: Hours since the sample design finished.
+        """
+        if len(self.latencies.get(status_abbr, [])) >= self.min_samples:
+            history, elapsed = self.latencies[status_abbr], status_hours
+        elif len(self.latencies.get(DESIGN, [])) >= self.min_samples:
+            history, elapsed = self.latencies[DESIGN], design_hours
+        else:
+            return self.default_minutes
+
+        remaining = history[bisect.bisect_right(history, elapsed):]
+        if not remaining:
+            # Waited longer than any sample in the history
+            return self.max_minutes
+        if len(remaining) < self.min_samples:
+            # Too few samples waited this long for the quantile to be meaningful
+            return self.default_minutes
+        target = remaining[max(0, math.ceil(self.step * len(remaining)) - 1)]
+        return min(self.max_minutes, max(self.min_minutes, (target - elapsed) * 60))
+
+    def summary(self):
+        """
+        Returns the number of samples and the median / 90th percentile of the hours to approval per status.
+        """
+        return {key: {'samples': len(values),
+                      'p50_hours': round(values[len(values) // 2], 2),
+                      'p90_hours': round(values[min(len(values) - 1, int(len(values) * 0.9))], 2)}
+                for key, values in self.latencies.items() if values}
+
+
+def load_latencies(engine, approved, history_days=180):
+    """
+    Reads the hours until approval of the orders sent within history_days.
+
+    The time from DesignDate to OrderDate is collected under DESIGN; when review_status_log exists, the time
+    from the first observation of each status to OrderDate is collected under the status abbreviation.
+
+    :param engine: SQLAlchemy engine of the monitor database.
+    :param approved: Status abbreviations that count as approved.
+    :param history_days: Days of history to read.
+    :return: Dictionary status abbreviation (or DESIGN) -> list of hours.
+    """
+    since = (datetime.datetime.now() - datetime.timedelta(days=history_days)).strftime('%Y-%m-%d %H:%M:%S')
+    with engine.connect() as conn:
+        df_order = pd.read_sql(text("""
+            SELECT SampleID, ReviewStatus, DesignDate, OrderDate FROM monitor_order
+            WHERE EmailSent = 1 AND OrderDate IS NOT NULL AND DesignDate >= :since
+        """), conn, params={'since': since})
+        has_log = engine.dialect.has_table(conn, 'review_status_log')
+        df_log = pd.read_sql(text("""
+            SELECT SampleID, Status, MIN(ObservedAt) AS ObservedAt FROM review_status_log
+            WHERE ObservedAt >= :since GROUP BY SampleID, Status
+        """), conn, params={'since': since}) if has_log else None
+
+    # Orders sent without review (skip_review) have no approved status
+    status = df_order['ReviewStatus'].fillna('').str.split('(').str[0]
+    df_order = df_order[status.isin(approved)]
+    order_date = pd.to_datetime(df_order['OrderDate'])
+
+    hours = (order_date - pd.to_datetime(df_order['DesignDate'])).dt.total_seconds() / 3600
+    latencies = {DESIGN: hours[hours >= 0].tolist()}
+
+    if df_log is not None and not df_log.empty:
+        df = df_log.merge(df_order[['SampleID', 'OrderDate']], on='SampleID')
+        df['hours'] = (pd.to_datetime(df['OrderDate']) - pd.to_datetime(df['ObservedAt'])).dt.total_seconds() / 3600
+        df = df[(df['hours'] >= 0) & ~df['Status'].isin(approved)]
+        for status_abbr, values in df.groupby('Status')['hours']:
+            latencies[status_abbr] = values.tolist()
+    return latencies
+
+
+class CmsBudget:
+    """
+    Number of CMS status requests allowed per cycle, shared by every process of the host through a SQLite
+    database. Requests beyond the budget are postponed to the next cycle.
+    """
+
+    def __init__(self, db_path, calls_per_cycle=120, cycle_minutes=30):
+        """
+        :param db_path: Path of the SQLite database file.
+        :param calls_per_cycle: CMS requests allowed per cycle across all processes.
+        :param cycle_minutes: Length of a cycle.
+        """
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.calls_per_cycle = int(calls_per_cycle)
+        self.cycle = float(cycle_minutes) * 60
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS cycles (
+                    cycle INTEGER PRIMARY KEY,
+                    calls INTEGER NOT NULL,
+                    denied INTEGER NOT NULL DEFAULT 0
+                );
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def take(self):
+        """
+        Takes one request from the budget of the current cycle.
+
+        :return: True if the request may be made.
+        """
+        cycle = int(time.time() // self.cycle)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT calls FROM cycles WHERE cycle = ?', (cycle,)).fetchone()
+            calls = row[0] if row else 0
+            allowed = calls < self.calls_per_cycle
+            conn.execute("""
+                INSERT INTO cycles (cycle, calls, denied) VALUES (?, ?, ?)
+                ON CONFLICT(cycle) DO UPDATE SET calls = excluded.calls, denied = denied + excluded.denied
+            """, (cycle, calls + 1 if allowed else calls, 0 if allowed else 1))
+            conn.execute('DELETE FROM cycles WHERE cycle < ?', (cycle - 1000,))
+            conn.execute('COMMIT')
+        return allowed
+
+    def seconds_to_next_cycle(self):
+        return self.cycle - time.time() % self.cycle
+
+    def stats(self, cycles=48):
+        """
+        Returns the requests made and denied in the most recent cycles.
+        """
+        with self._connect() as conn:
+            rows = conn.execute('SELECT cycle, calls, denied FROM cycles ORDER BY cycle DESC LIMIT ?',
+                                (cycles,)).fetchall()
+        return [{'start': datetime.datetime.fromtimestamp(cycle * self.cycle).strftime('%Y-%m-%d %H:%M'),
+                 'calls': calls, 'denied': denied} for cycle, calls, denied in rows]
+
+
+def open_budget(config):
+    """
+    Opens the CMS request budget configured in the review_schedule section of config.yaml.
+
+    :return: A CmsBudget instance, or None if the budget is disabled.
+    """
+    schedule_config = config.get('review_schedule') or {}
+    if not schedule_config.get('budget_per_cycle'):
+        return None
+    return CmsBudget(schedule_config.get('budget_path', './primer_cache/cms_budget.sqlite'),
+                     calls_per_cycle=schedule_config['budget_per_cycle'],
+                     cycle_minutes=schedule_config.get('cycle_minutes', 30))
+
+
+def build_model(config, engine, approved):
+    """
+    Builds the latency model from the order history with the parameters of the review_schedule section.
+    """
+    schedule_config = config.get('review_schedule') or {}
+    latencies = load_latencies(engine, approved, history_days=schedule_config.get('history_days', 180))
+    return LatencyModel(latencies,
+                        min_samples=schedule_config.get('min_samples', 20),
+                        step=schedule_config.get('step', 0.02),
+                        min_minutes=schedule_config.get('min_minutes', 5),
+                        max_minutes=schedule_config.get('max_minutes', 240),
+                        default_minutes=int(config['check_interval_minutes']))
+
+
+def main():
+    import primer_design
+
+    parser = argparse.ArgumentParser(description='Show the review latency history behind the adaptive polling '
+                                                 'and the CMS request budget.')
+    parser.add_argument('--cycles', type=int, default=12, dest='cycles',
+                        help='Number of recent budget cycles to show.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    model = primer_design.get_review_model()
+    budget = primer_design.get_cms_budget()
+    print(json.dumps({
+        'latency': model.summary() if model else None,
+        'budget': budget.stats(args.cycles) if budget else None,
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
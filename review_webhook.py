@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/26 10:40
+@Author  : lbfeng
+@File    : review_webhook.py
+"""
+import os
+import hmac
+import json
+import time
+import hashlib
+import logging
+import argparse
+import threading
+import yaml
+import requests
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import text
+import primer_design
+from primer_design import db_handler, update_email_status, send_approved_order, report_review_anomaly, \
+    record_review_status, REVIEW_APPROVED, REVIEW_PENDING
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+SIGNATURE_HEADER = 'X-TopGen-Signature'
+TIMESTAMP_HEADER = 'X-TopGen-Timestamp'
+
+
+def sign(secret, timestamp, body):
+    """
+    Signs a callback body: HMAC-SHA256 of '<timestamp>.<body>' with the shared secret, hex encoded.
+    """
+    return hmac.new(secret.encode('utf-8'), f'{timestamp}.'.encode('utf-8') + body, hashlib.sha256).hexdigest()
+
+
+def verify(secret, timestamp, signature, body, tolerance_seconds=300):
+    """
+    Checks the signature of a callback and that it is recent, so that a captured callback cannot be replayed later.
+    """
+    try:
+        age = abs(time.time() - float(timestamp))
+    except (TypeError, ValueError):
+        return False
+    if age > tolerance_seconds:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature or '')
+
+
+def resolve_status(status):
+    """
+    Maps a CMS review status, given as abbreviation ('BGYSH') or description ('报告已审核'), to (abbr, description).
+
+    :return: Tuple of (status_abbr, status_desc), or None if the status is not in review_status of config.yaml.
+    """
+    status_dict = config['review_status']
+    if status in status_dict:
+        return status, status_dict[status]
+    abbr = next((abbr for abbr, desc in status_dict.items() if desc == status), None)
+    return (abbr, status) if abbr else None
+
+
+def order_record(sample_id):
+    """
+    Reads the EmailSent status and the order file of a sample from monitor_order.
+
+    :return: Tuple of (EmailSent, OrderFile), or None if the sample has no record.
+    """
+    query = text("""
+        SELECT EmailSent, OrderFile FROM monitor_order WHERE SampleID = :sample_id
+    """)
+    with db_handler.get_engine().connect() as conn:
+        row = conn.execute(query, {'sample_id': sample_id}).fetchone()
+    return tuple(row) if row else None
+
+
+# Callbacks of the same sample are handled one at a time, so a repeated callback sees the first one's update
+_handle_lock = threading.Lock()
+
+
+def handle_review(sample_id, status):
+    """
+    Applies a review status change of a sample: an approved sample gets its order email sent at once, a sample
+    still under review gets its ReviewStatus updated, and a terminated sample gets the anomaly warning.
+    Callbacks for samples whose order was already handled are acknowledged without action.
+
+    :param sample_id: The sample ID.
+    :param status: CMS review status, abbreviation or description.
+    :return: Tuple of (HTTP status code, response dictionary).
+    """
+    resolved = resolve_status(status)
+    if resolved is None:
+        return 400, {'error': f'unknown review status: {status}'}
+    status_abbr, status_desc = resolved
+    review_status = f'{status_abbr}({status_desc})'
+
+    with _handle_lock:
+        record = order_record(sample_id)
+        if record is None:
+            return 404, {'error': f'unknown sample: {sample_id}'}
+        email_sent, order_file = record
+        # Callbacks carry the exact time of the status change for the polling schedule
+        record_review_status(sample_id, status_abbr, status_desc)
+
+        if email_sent != 0:
+            action = 'ignored'
+        elif status_abbr in REVIEW_APPROVED:
+            if not order_file or not os.path.isfile(order_file):
+                return 409, {'error': f'order file of {sample_id} not found: {order_file}'}
+            send_approved_order(sample_id, order_file, review_status)
+            action = 'ordered'
+        elif status_abbr in REVIEW_PENDING:
+            update_email_status(sample_id, 'monitor_order', review_status=review_status, email_sent=0)
+            action = 'updated'
+        else:
+            report_review_anomaly(sample_id, review_status)
+            action = 'terminated'
+
+    logger.info(f'Review callback {sample_id} {review_status}: {action}')
+    return 200, {'sampleSn': sample_id, 'reviewStatus': review_status, 'action': action}
+
+
+class ReviewHandler(BaseHTTPRequestHandler):
+    secret = None
+    tolerance_seconds = 300
+
+    def log_message(self, fmt, *args):
+        logger.debug(fmt % args)
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path.rstrip('/') != '/health':
+            return self._send(404, {'error': 'not found'})
+        return self._send(200, {'status': 'ok'})
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip('/') != '/review':
+            return self._send(404, {'error': 'not found'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        if not verify(self.secret, self.headers.get(TIMESTAMP_HEADER), self.headers.get(SIGNATURE_HEADER), body,
+                      self.tolerance_seconds):
+            logger.warning(f'Rejected review callback with an invalid signature from {self.client_address[0]}')
+            return self._send(403, {'error': 'invalid signature'})
+
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            sample_id, status = str(payload['sampleSn']).strip(), str(payload['status']).strip()
+        except (ValueError, KeyError, TypeError):
+            return self._send(400, {'error': 'expected JSON with sampleSn and status'})
+
+        try:
+            code, response = handle_review(sample_id, status)
+        except Exception as e:
+            # The CMS retries the callback; the polling fallback of check_order picks the sample up otherwise
+            logger.error(f'Review callback of {sample_id} failed: {e}')
+            return self._send(500, {'error': str(e)})
+        return self._send(code, response)
+
+
+def serve(host, port, secret, tolerance_seconds=300):
+    """
+    Creates the callback server.
+
+    :param host: Interface to listen on.
+    :param port: Port to listen on.
+    :param secret: Shared secret of the callback signatures.
+    :param tolerance_seconds: Maximum age of a callback.
+    :return: The server instance; call serve_forever to handle callbacks.
+    """
+    if not secret:
+        raise ValueError('review_webhook.secret is not set in config.yaml.')
+    ReviewHandler.secret = secret
+    ReviewHandler.tolerance_seconds = tolerance_seconds
+    server = ThreadingHTTPServer((host, port), ReviewHandler)
+    logger.info(f'Review status callbacks accepted on http://{host}:{server.server_port}/review')
+    return server
+
+
+def notify(url, secret, sample_id, status, timeout=10):
+    """
+    Posts a signed review status callback, standing in for the CMS when testing.
+
+    :return: Tuple of (HTTP status code, response dictionary).
+    """
+    body = json.dumps({'sampleSn': sample_id, 'status': status}, ensure_ascii=False).encode('utf-8')
+    timestamp = str(int(time.time()))
+    response = requests.post(url, data=body, timeout=timeout, headers={
+        'Content-Type': 'application/json; charset=utf-8',
+        TIMESTAMP_HEADER: timestamp,
+        SIGNATURE_HEADER: sign(secret, timestamp, body),
+    })
+    return response.status_code, response.json()
+
+
+def main():
+    webhook_config = config.get('review_webhook') or {}
+    host = webhook_config.get('host', '127.0.0.1')
+    port = int(webhook_config.get('port', 8091))
+
+    parser = argparse.ArgumentParser(description='Receive CMS review status callbacks and send approved orders '
+                                                 'immediately.')
+    parser.add_argument('--host', default=host, dest='host',
+                        help='Interface to listen on.')
+    parser.add_argument('--port', type=int, default=port, dest='port',
+                        help='Port to listen on.')
+    parser.add_argument('--notify', nargs=2, metavar=('SAMPLE', 'STATUS'), dest='notify',
+                        help='Post a signed callback to a running receiver instead of serving, e.g. for testing.')
+    parser.add_argument('--url', default=None, dest='url',
+                        help='Receiver URL used with --notify. Default http://HOST:PORT/review.')
+    parser.add_argument('--debug', action='store_true', dest='debug',
+                        help='Run in debug mode.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    secret = os.environ.get('REVIEW_WEBHOOK_SECRET') or webhook_config.get('secret')
+
+    if args.notify:
+        url = args.url or f'http://{args.host}:{args.port}/review'
+        status_code, response = notify(url, secret, *args.notify)
+        print(json.dumps(response, ensure_ascii=False))
+        raise SystemExit(0 if status_code == 200 else 1)
+
+    # emit and the order helpers read the debug flag of primer_design
+    primer_design.DEBUG = args.debug if args.debug else config.get('DEBUG', False)
+    server = serve(args.host, args.port, secret, webhook_config.get('tolerance_seconds', 300))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -11,8 +11,9 @@ import sys
 import argparse
 import logging
 import yaml
-import primkit as pt
-from primer_design import emit, check_email_sent, get_audit_status, update_email_status
+import primer_design
+from primer_design import emit, check_email_sent, poll_audit_status, update_email_status, send_approved_order, \
+    CmsError, REVIEW_APPROVED, REVIEW_PENDING
 
 logger = logging.getLogger(__name__)
 
@@ -28,17 +29,11 @@ def check_order(sampleID, primer_result, debug):
     :param primer_result: The file path of the primer result that will be attached to the email.
     :param debug: A boolean flag to enable debug mode.
     """
-    email_manager = pt.EmailManager(config['emails']['login'], use_yagmail=True)
-    subject_prefix = '【MRD引物设计-测试】' if debug else '【MRD引物设计】'
+    # emit adds the subject prefix of the debug mode and sends through the mail outbox
+    primer_design.DEBUG = debug
 
     test_toaddrs = config['emails']['setup']['log_toaddrs']
     qc_toaddrs = config['emails']['setup']['qc_toaddrs']
-    order_toaddrs = config['emails']['setup']['order_toaddrs']
-    order_cc = config['emails']['setup']['cc']
-    test_cc = config['emails']['setup']['log_cc']
-
-    toaddrs = test_toaddrs if DEBUG else order_toaddrs
-    cc = test_cc if DEBUG else order_cc
 
     subject = f'样本引物合成订购 (自动发送) - {sampleID} '
     message = f'样本ID：{sampleID}\nCMS审核结果：已通过\n引物结果：{os.path.basename(primer_result)}（见附件）'
@@ -46,21 +41,30 @@ def check_order(sampleID, primer_result, debug):
     email_status = check_email_sent(sampleID, 'monitor_order')
 
     if email_status == 0:
-        status_abbr, status_desc = get_audit_status(sampleID)
+        try:
+            polled = poll_audit_status(sampleID)
+        except CmsError as e:
+            logger.error(str(e))
+            sys.exit(1)
+        if polled is None:
+            logger.info('CMS request budget of this cycle is spent, the review status is checked in the next run.')
+            sys.exit(1)
+        status_abbr, status_desc = polled
         review_status = f'{status_abbr}({status_desc})'
 
         # 审核通过
-        if status_abbr in ['YWC', 'YSH', 'BGYSH']:
-            email_manager.send_email(to_addrs=toaddrs, subject=subject_prefix + subject, message=message, cc_addrs=cc, attachments=[primer_result])
-            update_email_status(sampleID, 'monitor_order', review_status=review_status, email_sent=0 if DEBUG else 1)
+        if status_abbr in REVIEW_APPROVED:
+            send_approved_order(sampleID, primer_result, review_status)
             logger.info('Primer design order has been sent.')
             sys.exit(0)
 
         # 检测中
-        elif status_abbr in ['JCZ', 'DSH', 'BGDSH']:
+        elif status_abbr in REVIEW_PENDING:
             subject = f'样本审核状态持续检测 - {sampleID}'
             message = f'样本ID {sampleID} 审核状态持续检测中···\n目前样本审核状态：{review_status}。\n请检查样本审核状态并进行更新。'
-            email_manager.send_email(to_addrs=qc_toaddrs, subject=subject_prefix + subject, message=message, attachments=[primer_result])
+            # The reminder goes out at most once a day, however often the script runs
+            emit(subject, message, attachments=[primer_result], to_addrs=qc_toaddrs, sample_id=sampleID,
+                 kind='review_check', once=1)
             logger.error('Primer order review status not updated, waiting for CMS review status update...')
             sys.exit(1)
 
@@ -68,7 +72,7 @@ def check_order(sampleID, primer_result, debug):
         else:
             subject = f'样本状态检测异常警告 - {sampleID}'
             message = f'警告：样本ID {sampleID} 样本状态检测异常。\nCMS审核状态：{review_status}\n请检查相关数据并采取适当措施。'
-            email_manager.send_email(to_addrs=qc_toaddrs, subject=subject_prefix + subject, message=message)
+            emit(subject, message, to_addrs=qc_toaddrs, sample_id=sampleID, kind='review_anomaly', once=True)
             update_email_status(sampleID, 'monitor_order', review_status=review_status,
                                 email_sent=2)
             logger.error(
@@ -79,7 +83,7 @@ def check_order(sampleID, primer_result, debug):
         # 如果EmailSent是1，已经发送过邮件了，如果DEBUG为True还会发送至测试邮箱
         # 如果EmailSent是2，不发送邮件，项目终止了
         if email_status == 1 and debug:
-            email_manager.send_email(to_addrs=test_toaddrs, subject=subject_prefix + subject, message=message, attachments=[primer_result])
+            emit(subject, message, attachments=[primer_result], to_addrs=test_toaddrs)
             logger.info(f"Email sent to DEBUG addresses for SampleID: {sampleID}.")
 
         logger.info(f"No action needed for SampleID: {sampleID} as EmailSent is {email_status}")
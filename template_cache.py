@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/22 16:20
+@Author  : lbfeng
+@File    : template_cache.py
+"""
+import io
+import os
+import time
+import pickle
+import logging
+import argparse
+import threading
+import yaml
+import openpyxl
+
+logger = logging.getLogger(__name__)
+
+
+class TemplateCache:
+    """
+    Process-wide cache of parsed order template workbooks. Each template is parsed once and kept as a pickled
+    workbook; every order gets its own copy unpickled from those bytes, which is several times faster than
+    parsing the styled xlsx again. An entry is parsed again when the template file's mtime or size changes.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.parses = 0
+        self.hits = 0
+
+    def load(self, path):
+        """
+        Returns a fresh, independent copy of the workbook at path.
+
+        :param path: Path of the xlsx template.
+        :return: openpyxl Workbook that the caller may modify and save.
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is None or entry[0] != version:
+                wb = openpyxl.load_workbook(path)
+                try:
+                    data = pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception as e:
+                    # Some workbooks cannot be pickled; they are parsed on every load instead
+                    logger.warning(f'Order template {path} cannot be cached: {e}')
+                    data = None
+                self._entries[path] = (version, data)
+                self.parses += 1
+                return wb if data is None else pickle.loads(data)
+            self.hits += 1
+            data = entry[1]
+
+        return openpyxl.load_workbook(path) if data is None else pickle.loads(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+template_cache = TemplateCache()
+
+
+def load_template(path):
+    """
+    Returns a copy of the order template at path from the process-wide template cache.
+    """
+    return template_cache.load(path)
+
+
+def fill_and_save(wb, rows=40):
+    """
+    Writes a typical order (primer names and sequences) into the first sheet and saves it in memory.
+    """
+    ws = wb.worksheets[0]
+    for i in range(rows):
+        ws.cell(20 + i, 3).value = f'P{i + 1}'
+        ws.cell(20 + i, 4).value = 'GTTCAGAGTTCTACAGTCCGACGATCNNWNNW' + 'ACGT' * 5
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getbuffer().nbytes
+
+
+def benchmark(templates, orders=100):
+    """
+    Times sequential orders per template, parsing the template every time versus using the template cache.
+
+    :param templates: Dictionary of mold -> template path.
+    :param orders: Number of orders written per template.
+    :return: Dictionary of mold -> (seconds without cache, seconds with cache).
+    """
+    results = {}
+    for mold, path in templates.items():
+        start = time.perf_counter()
+        for _ in range(orders):
+            fill_and_save(openpyxl.load_workbook(path))
+        uncached = time.perf_counter() - start
+
+        cache = TemplateCache()
+        start = time.perf_counter()
+        for _ in range(orders):
+            fill_and_save(cache.load(path))
+        cached = time.perf_counter() - start
+
+        results[mold] = (uncached, cached)
+        print(f'{mold}: {orders} orders {uncached:.2f}s without cache, {cached:.2f}s with cache '
+              f'({uncached / cached:.1f}x)')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark writing sequential orders with the order template cache.')
+    parser.add_argument('-n', '--orders', type=int, default=100, dest='orders',
+                        help='Number of sequential orders written per template.')
+    parser.add_argument('-m', '--mold', action='append', dest='molds', choices=['sh', 'hz', 'sg', 'dg'],
+                        help='Template to benchmark; may be repeated. Defaults to all templates.')
+    args = parser.parse_args()
+
+    with open('config.yaml', 'r', encoding='utf-8') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    templates = {mold: path for mold, path in config['order_template'].items() if not args.molds or mold in args.molds}
+    benchmark(templates, args.orders)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/29 10:20
+@Author  : lbfeng
+@File    : watch_folder.py
+"""
+import os
+import re
+import sys
+import json
+import time
+import select
+import shutil
+import signal
+import socket
+import struct
+import sqlite3
+import logging
+import argparse
+import subprocess
+import contextlib
+import concurrent.futures
+import yaml
+from rate_limiter import pid_alive
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+# inotify(7) event flags
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Inotify:
+    """
+    Minimal recursive inotify watch through libc, reporting files that were closed after writing or moved into
+    the watched tree. Only available on Linux; WatchFolder falls back to directory scans elsewhere.
+    """
+
+    def __init__(self, root):
+        import ctypes
+        import ctypes.util
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.dirs = {}
+        for path, _, _ in os.walk(root):
+            self.add_watch(path)
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE)
+        if wd >= 0:
+            self.dirs[wd] = path
+
+    def read(self, timeout):
+        """
+        Waits up to timeout seconds for events.
+
+        :return: Tuple of (list of completed file paths, whether events were lost and a full scan is needed).
+        """
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return [], False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+
+        paths, overflow, offset = [], False, 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if wd not in self.dirs:
+                continue
+            path = os.path.join(self.dirs[wd], os.fsdecode(name))
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files written into a new directory before its watch was added are found by the next scan
+                    self.add_watch(path)
+                    overflow = True
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                paths.append(path)
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class WatchQueue:
+    """
+    Persistent queue of the files found in the watch folder, so that a restart picks up the files that were
+    not processed. A file is identified by its path, size and modification time: repeated events of the same
+    file are ignored, a file written again under the same name is queued again.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = os.path.abspath(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.host = socket.gethostname()
+
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    work_path TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    enqueued REAL NOT NULL,
+                    started REAL,
+                    finished REAL,
+                    host TEXT,
+                    pid INTEGER,
+                    error TEXT,
+                    UNIQUE (path, size, mtime)
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_status ON files (status, id);
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return contextlib.closing(conn)
+
+    def add(self, path, size, mtime):
+        """
+        Queues a completed file.
+
+        :return: True if the file was queued, False if it is already known.
+        """
+        with self._connect() as conn:
+            cursor = conn.execute("""
+                INSERT OR IGNORE INTO files (path, size, mtime, enqueued) VALUES (?, ?, ?, ?)
+            """, (path, size, mtime, time.time()))
+        return cursor.rowcount > 0
+
+    def recover(self):
+        """
+        Queues again the files of daemons of this host that died while processing them.
+
+        :return: Number of files queued again.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute("SELECT id, pid FROM files WHERE status = 'running' AND host = ?",
+                                (self.host,)).fetchall()
+            dead = [file_id for file_id, pid in rows if not pid or not pid_alive(pid)]
+            conn.executemany("UPDATE files SET status = 'queued', pid = NULL WHERE id = ?",
+                             [(file_id,) for file_id in dead])
+            conn.execute('COMMIT')
+        if dead:
+            logger.warning(f'{len(dead)} files left by a stopped watcher are queued again.')
+        return len(dead)
+
+    def claim(self):
+        """
+        Takes the oldest queued file.
+
+        :return: Dictionary of the file row, or None if the queue is empty.
+        """
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("""
+                SELECT id, path, work_path, attempts FROM files WHERE status = 'queued' ORDER BY id LIMIT 1
+            """).fetchone()
+            if row:
+                conn.execute("""
+                    UPDATE files SET status = 'running', attempts = attempts + 1, started = ?, host = ?, pid = ?
+                    WHERE id = ?
+                """, (time.time(), self.host, os.getpid(), row[0]))
+            conn.execute('COMMIT')
+        if not row:
+            return None
+        return {'id': row[0], 'path': row[1], 'work_path': row[2], 'attempts': row[3] + 1}
+
+    def set_work_path(self, file_id, work_path):
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET work_path = ? WHERE id = ?', (work_path, file_id))
+
+    def finish(self, file_id, status, error=None):
+        """
+        Records the outcome of a file: 'done', 'failed', or 'queued' to try it again.
+        """
+        with self._connect() as conn:
+            conn.execute('UPDATE files SET status = ?, finished = ?, error = ?, pid = NULL WHERE id = ?',
+                         (status, time.time(), error, file_id))
+
+    def requeue_failed(self):
+        """
+        Queues the failed files again.
+
+        :return: Number of files queued.
+        """
+        with self._connect() as conn:
+            return conn.execute("UPDATE files SET status = 'queued', attempts = 0 WHERE status = 'failed'").rowcount
+
+    def stats(self):
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM files GROUP BY status').fetchall())
+            failed = conn.execute("""
+                SELECT path, attempts, error FROM files WHERE status = 'failed' ORDER BY finished DESC LIMIT 20
+            """).fetchall()
+        return {'counts': counts, 'failed': [{'path': p, 'attempts': a, 'error': e} for p, a, e in failed]}
+
+
+def sample_from_file(path):
+    """
+    Returns the sample ID of a loci file, e.g. NGS231206-124WX for NGS231206-124WX.mrd_selected.xlsx.
+    """
+    return os.path.basename(path).split('.')[0]
+
+
+def design_command(settings, sample_id, input_file):
+    """
+    Builds the primer_design.py command line of a watched file.
+    """
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'primer_design.py'),
+               '-id', str(settings.get('sid') or sample_id), '-s', sample_id, '-m', settings.get('mold', 'sg'),
+               '-i', input_file, '-o', settings['output_dir']]
+    return command + [str(arg) for arg in settings.get('args') or []]
+
+
+def process_file(job, queue, settings, notify):
+    """
+    Processes one watched file as process_file.sh did: moves it to the working directory, runs primer_design.py
+    with its own log file, and sends the start, completion and error notifications.
+
+    :param job: Dictionary of the file row from WatchQueue.claim.
+    :param queue: The WatchQueue.
+    :param settings: The watch_folder section of config.yaml.
+    :param notify: Callable notify(subject, message, attachments) sending a notification email.
+    :return: Tuple of (status, error).
+    """
+    work_path = job['work_path'] or os.path.join(settings['work_dir'], os.path.basename(job['path']))
+    sample_id = sample_from_file(work_path)
+
+    if not os.path.isfile(work_path):
+        if not os.path.isfile(job['path']):
+            return 'failed', 'file disappeared before processing'
+        os.makedirs(settings['work_dir'], exist_ok=True)
+        # The working path is recorded first, so that a restart finds the file after the move
+        queue.set_work_path(job['id'], work_path)
+        shutil.move(job['path'], work_path)
+        notify(f'{sample_id} 选点文件处理通知', f"文件 {os.path.basename(work_path)} 已被处理，请查看 {settings['work_dir']} 目录")
+
+    os.makedirs(settings['log_dir'], exist_ok=True)
+    log_path = os.path.join(settings['log_dir'], f'script_error_{sample_id}.log')
+    command = design_command(settings, sample_id, work_path)
+    if settings.get('use_pool'):
+        # A running worker_pool.py runs the sample in a warm worker instead of a new interpreter
+        import worker_pool
+
+        pool_config = config.get('worker_pool') or {}
+        reply = worker_pool.submit(pool_config.get('socket', './primer_cache/worker_pool.sock'), command[2:],
+                                   log_path=os.path.abspath(log_path))
+        returncode = reply.get('exit_code', 1)
+    else:
+        with open(log_path, 'ab') as log:
+            returncode = subprocess.call(command, stdout=log, stderr=subprocess.STDOUT,
+                                         cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    if returncode == 0:
+        notify(f'{sample_id} 引物设计任务已完成', f"{sample_id} 引物设计任务已完成，请查看 {settings['output_dir']} 结果文件目录")
+        return 'done', None
+    notify(f'{sample_id} 引物设计脚本 primer_design.py 错误',
+           f'primer_design.py 脚本发生错误 (退出码 {returncode})，请检查日志：{log_path}', [log_path])
+    return 'failed', f'exit code {returncode}'
+
+
+class WatchFolder:
+    """
+    Watches a folder for completed loci files and feeds them to a bounded pool of workers.
+
+    A file counts as complete once it was closed after writing or moved in (inotify) and its size and
+    modification time stayed the same for settle_seconds. Periodic scans catch files written while the
+    daemon was down, events lost to a queue overflow, and replace inotify where it is not available.
+    """
+
+    def __init__(self, settings, queue, worker, max_workers=10, settle_seconds=5, scan_interval=60,
+                 housekeeping=None):
+        """
+        :param settings: The watch_folder section of config.yaml.
+        :param queue: The WatchQueue.
+        :param worker: Callable worker(job) returning (status, error), run in the worker threads.
+        :param max_workers: Files processed at the same time.
+        :param settle_seconds: Seconds the size and modification time of a file must stay unchanged.
+        :param scan_interval: Seconds between full scans of the watch folder.
+        :param housekeeping: Callable run with every full scan, e.g. sending the QC digest once it is due.
+        """
+        self.watch_dir = os.path.abspath(settings['watch_dir'])
+        self.exclude = re.compile(settings['exclude']) if settings.get('exclude') else None
+        self.max_attempts = int(settings.get('max_attempts', 1))
+        self.queue = queue
+        self.worker = worker
+        self.max_workers = max_workers
+        self.settle = settle_seconds
+        self.scan_interval = scan_interval
+        self.housekeeping = housekeeping
+        self.candidates = {}
+        self.running = {}
+        self.stopping = False
+
+    def wanted(self, path):
+        return not (self.exclude and self.exclude.search(path))
+
+    def scan(self):
+        for root, _, files in os.walk(self.watch_dir):
+            for name in files:
+                self.observe(os.path.join(root, name))
+
+    def observe(self, path):
+        """
+        Records the size and modification time of a candidate file.
+        """
+        if not self.wanted(path):
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            self.candidates.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime)
+        previous = self.candidates.get(path)
+        if previous is None or previous[0] != signature:
+            self.candidates[path] = (signature, time.time())
+
+    def settle_candidates(self):
+        """
+        Queues the candidates whose size and modification time stayed unchanged for the settle time.
+        """
+        now = time.time()
+        for path, (signature, since) in list(self.candidates.items()):
+            if now - since < self.settle:
+                continue
+            self.observe(path)
+            current = self.candidates.get(path)
+            if current is None:
+                continue
+            if current[0] == signature:
+                del self.candidates[path]
+                if self.queue.add(path, *signature):
+                    logger.info(f'Queued {path}')
+
+    def dispatch(self, executor):
+        """
+        Collects finished workers and starts queued files while workers are free; files wait in the
+        persistent queue, not in memory, when all workers are busy.
+        """
+        for future in [future for future in self.running if future.done()]:
+            job = self.running.pop(future)
+            try:
+                status, error = future.result()
+            except Exception as e:
+                status, error = 'failed', str(e)
+            if status == 'failed' and job['attempts'] < self.max_attempts:
+                status = 'queued'
+            self.queue.finish(job['id'], status, error)
+            logger.info(f"{job['path']}: {status}{f' ({error})' if error else ''}")
+
+        while not self.stopping and len(self.running) < self.max_workers:
+            job = self.queue.claim()
+            if job is None:
+                break
+            self.running[executor.submit(self.worker, job)] = job
+
+    def stop(self, *_):
+        logger.info('Stopping: no new files are started, running files are finished.')
+        self.stopping = True
+
+    def run(self):
+        os.makedirs(self.watch_dir, exist_ok=True)
+        self.queue.recover()
+        try:
+            inotify = Inotify(self.watch_dir) if sys.platform.startswith('linux') else None
+        except OSError as e:
+            logger.warning(f'inotify unavailable, scanning every {self.scan_interval}s: {e}')
+            inotify = None
+
+        logger.info(f'Watching {self.watch_dir} with {self.max_workers} workers.')
+        last_scan = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            try:
+                while not self.stopping or self.running:
+                    if not self.stopping and time.time() - last_scan >= self.scan_interval:
+                        self.scan()
+                        last_scan = time.time()
+                        if self.housekeeping:
+                            self.housekeeping()
+
+                    # Wake up at least once a second to settle candidates and collect finished workers
+                    if inotify is not None:
+                        paths, overflow = inotify.read(1)
+                        for path in paths:
+                            self.observe(path)
+                        if overflow:
+                            last_scan = 0
+                    else:
+                        time.sleep(min(1, self.scan_interval))
+
+                    self.settle_candidates()
+                    self.dispatch(executor)
+            finally:
+                if inotify is not None:
+                    inotify.close()
+                if self.housekeeping:
+                    self.housekeeping()
+
+
+def main():
+    settings = dict(config.get('watch_folder') or {})
+
+    parser = argparse.ArgumentParser(description='Watch a folder for loci files and run the primer design of each '
+                                                 'completed file.')
+    parser.add_argument('-w', '--watch-dir', default=settings.get('watch_dir'), dest='watch_dir',
+                        help='Folder to watch. Default from config.yaml.')
+    parser.add_argument('-j', '--workers', type=int, default=settings.get('max_workers', 10), dest='workers',
+                        help='Files processed at the same time.')
+    parser.add_argument('--stats', action='store_true', dest='stats',
+                        help='Print the queue counts and recent failures, then exit.')
+    parser.add_argument('--retry-failed', action='store_true', dest='retry_failed',
+                        help='Queue the failed files again, then exit.')
+    parser.add_argument('--debug', action='store_true', dest='debug',
+                        help='Run in debug mode.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    queue = WatchQueue(settings.get('queue_path', './primer_cache/watch_queue.sqlite'))
+    if args.stats:
+        print(json.dumps(queue.stats(), ensure_ascii=False, indent=2))
+        return
+    if args.retry_failed:
+        logger.info(f'{queue.requeue_failed()} failed files queued again.')
+        return
+
+    import primer_design
+
+    # emit reads the debug flag of primer_design
+    primer_design.DEBUG = args.debug if args.debug else config.get('DEBUG', False)
+    if primer_design.DEBUG:
+        settings['args'] = list(settings.get('args') or []) + ['--debug']
+    settings['watch_dir'] = args.watch_dir
+
+    def notify(subject, message, attachments=None):
+        primer_design.emit(subject, message, attachments=attachments,
+                           to_addrs=config['emails']['setup']['log_toaddrs'])
+
+    watcher = WatchFolder(settings, queue, lambda job: process_file(job, queue, settings, notify),
+                          max_workers=args.workers, settle_seconds=settings.get('settle_seconds', 5),
+                          scan_interval=settings.get('scan_interval', 60),
+                          housekeeping=primer_design.flush_qc_digest)
+    signal.signal(signal.SIGTERM, watcher.stop)
+    signal.signal(signal.SIGINT, watcher.stop)
+    watcher.run()
+
+
+if __name__ == '__main__':
+    main()
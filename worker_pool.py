@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Project : TopGen
+@Time    : 2026/10/30 09:40
+@Author  : lbfeng
+@File    : worker_pool.py
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import traceback
+import socketserver
+import multiprocessing
+import yaml
+
+logger = logging.getLogger(__name__)
+
+with open('config.yaml', 'r', encoding='utf-8') as f:
+    config = yaml.load(f, Loader=yaml.FullLoader)
+
+
+def warm_up():
+    """
+    Loads everything a sample job needs before the workers are forked, so that every worker starts with it:
+    the pandas / numpy / openpyxl / SQLAlchemy / primkit imports, config.yaml, the database engine,
+    the hotspot file and the order templates.
+
+    :return: Seconds spent.
+    """
+    start = time.time()
+    import primer_design
+
+    primer_design.db_handler.get_engine()
+    primer_design.read_hots_file()
+    for mold, path in config['order_template'].items():
+        try:
+            primer_design.template_cache.load_template(path)
+        except FileNotFoundError:
+            logger.warning(f'Order template of {mold} not found: {path}')
+    return time.time() - start
+
+
+def job_exit_code(code):
+    """
+    Converts the argument of sys.exit into an exit code.
+    """
+    if code is None:
+        return 0
+    return code if isinstance(code, int) else 1
+
+
+def run_job(argv, log_path=None, kwargs=None):
+    """
+    Designs one sample inside a worker from a primer_design.py command line or design_sample keyword arguments.
+
+    :param argv: Arguments of primer_design.py, without the program name.
+    :param log_path: Optional file that receives the log of the job.
+    :param kwargs: Keyword arguments of design_sample, used instead of argv.
+    :return: Tuple of (exit code, outcome): the SampleResult as a dictionary, or the error and its type.
+    """
+    import primer_design
+
+    handler = None
+    try:
+        if log_path:
+            os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+            handler = logging.FileHandler(log_path, encoding='utf-8')
+            handler.setFormatter(logging.Formatter(
+                '%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s'))
+            logging.getLogger().addHandler(handler)
+        if kwargs is None:
+            kwargs = primer_design.sample_kwargs(primer_design.build_parser().parse_args(argv))
+        result = primer_design.design_sample(**kwargs)
+        return 0, result.to_dict()
+    except primer_design.DesignError as e:
+        logger.error(str(e))
+        return e.exit_code, {'error': str(e), 'error_type': type(e).__name__}
+    except SystemExit as e:
+        # Invalid arguments: argparse exits after printing the usage
+        return job_exit_code(e.code), {'error': f'invalid arguments: {argv}', 'error_type': 'ArgumentError'}
+    except Exception as e:
+        logger.error(f'Job {argv} failed:\n{traceback.format_exc()}')
+        return 1, {'error': str(e), 'error_type': type(e).__name__}
+    finally:
+        if handler is not None:
+            logging.getLogger().removeHandler(handler)
+            handler.close()
+
+
+def worker_main(tasks, results, max_jobs):
+    """
+    Loop of a forked worker: runs up to max_jobs jobs, then exits so that the pool forks a fresh worker.
+    """
+    import primer_design
+
+    # Connections of the parent's pool must not be shared with the forked process
+    primer_design.db_handler.get_engine().dispose(close=False)
+    # Neither the outbox worker thread of the parent, which sends its QC digests
+    primer_design.mail_service, primer_design.mail_service_ready = None, False
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    for _ in range(max_jobs):
+        job = tasks.get()
+        if job is None:
+            break
+        results.put(('start', job['id'], os.getpid(), time.time(), None))
+        primer_design.progress_hook = lambda stage, info, job_id=job['id']: results.put(
+            ('progress', job_id, dict(info, stage=stage), time.time(), None))
+        code, outcome = run_job(job['argv'], job.get('log'), kwargs=job.get('kwargs'))
+        primer_design.progress_hook = None
+        results.put(('done', job['id'], code, time.time(), outcome))
+
+    # Emails queued by the jobs are delivered before the worker exits; multiprocessing skips atexit handlers
+    if primer_design.mail_service is not None:
+        primer_design.mail_service.flush()
+
+
+class WorkerPool:
+    """
+    Pool of pre-forked worker processes that run sample jobs without paying the interpreter start, the imports
+    and the loading of configuration, database engine, hotspot file and templates for every sample.
+    A worker is replaced after max_jobs jobs to bound memory growth, or when it dies; a job whose worker died
+    is reported as failed.
+    """
+
+    def __init__(self, workers=4, max_jobs=20):
+        self.size = workers
+        self.max_jobs = max_jobs
+        self.context = multiprocessing.get_context('fork')
+        self.tasks = self.context.Queue()
+        # Written without a feeder thread, so that the events of a worker that crashes are not lost
+        self.results = self.context.SimpleQueue()
+        self.processes = []
+        self.jobs = {}
+        self.lock = threading.Condition()
+        # Job IDs are unique across restarts of the pool, so that a client never reads another job's status
+        self.token = f'{int(time.time()):x}'
+        self.next_id = 0
+        self.closing = False
+
+    def start(self):
+        logger.info(f'Warm-up took {warm_up():.2f}s.')
+        for _ in range(self.size):
+            self._fork()
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def _fork(self):
+        process = self.context.Process(target=worker_main, args=(self.tasks, self.results, self.max_jobs),
+                                       daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    def submit(self, argv, log_path=None, kwargs=None):
+        """
+        Queues a job.
+
+        :param argv: Arguments of primer_design.py, without the program name.
+        :param log_path: Optional file that receives the log of the job.
+        :param kwargs: Keyword arguments of design_sample, used instead of argv.
+        :return: Job ID.
+        """
+        with self.lock:
+            self.next_id += 1
+            job_id = f'{self.token}-{self.next_id}'
+            self.jobs[job_id] = {'argv': argv, 'kwargs': kwargs, 'status': 'queued', 'submitted': time.time()}
+        self.tasks.put({'id': job_id, 'argv': argv, 'kwargs': kwargs, 'log': log_path})
+        return job_id
+
+    def wait(self, job_id, timeout=None):
+        """
+        Waits for a job to finish.
+
+        :return: Dictionary of the job: status, exit_code, pid, queued and run seconds, and the result or error.
+        """
+        with self.lock:
+            self.lock.wait_for(lambda: self.jobs[job_id]['status'] in ('done', 'failed'), timeout=timeout)
+            return dict(self.jobs[job_id])
+
+    def status(self, job_id):
+        with self.lock:
+            return dict(self.jobs[job_id])
+
+    def status_many(self, job_ids):
+        """
+        Returns the jobs of the given IDs; IDs the pool does not know (finished long ago or submitted to an
+        earlier pool) map to None.
+        """
+        with self.lock:
+            return {job_id: dict(self.jobs[job_id]) if job_id in self.jobs else None for job_id in job_ids}
+
+    def _collect(self):
+        while True:
+            try:
+                event, job_id, value, at, outcome = self.results.get()
+            except (EOFError, OSError):
+                return
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is None:
+                    continue
+                if event == 'start':
+                    job.update(status='running', pid=value, queued=round(at - job['submitted'], 3), started=at)
+                elif event == 'progress':
+                    job['progress'] = dict(value, at=at)
+                else:
+                    job.update(status='done' if value == 0 else 'failed', exit_code=value,
+                               run=round(at - job['started'], 3), finished=at)
+                    # The SampleResult of a finished job, the error and its type of a failed one
+                    job.update(outcome if 'error' in outcome else {'result': outcome})
+                    self.lock.notify_all()
+
+    def supervise(self):
+        """
+        Replaces workers that exited; called periodically from the main thread.
+        """
+        for process in [process for process in self.processes if not process.is_alive()]:
+            process.join()
+            self.processes.remove(process)
+            with self.lock:
+                for job in self.jobs.values():
+                    # A worker that exits normally reported all its jobs; only a crash loses the running one
+                    if process.exitcode != 0 and job['status'] == 'running' and job.get('pid') == process.pid:
+                        job.update(status='failed', exit_code=process.exitcode, finished=time.time(),
+                                   error=f'worker died with exit code {process.exitcode}')
+                self.lock.notify_all()
+            if process.exitcode not in (0, None):
+                logger.warning(f'Worker {process.pid} exited with code {process.exitcode}.')
+            if not self.closing:
+                self._fork()
+
+        # Finished jobs are kept for an hour for status requests
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items() if time.time() - job.get('finished', time.time()) > 3600]
+            for job_id in expired:
+                del self.jobs[job_id]
+
+    def stats(self):
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            queued = [job['queued'] for job in self.jobs.values() if 'queued' in job]
+        return {'workers': len(self.processes), 'jobs': counts,
+                'dispatch_ms_mean': round(sum(queued) / len(queued) * 1000, 1) if queued else 0.0}
+
+    def close(self, wait=True):
+        """
+        Stops the workers once the queued jobs are done (wait) or at once.
+        """
+        self.closing = True
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            if wait:
+                process.join()
+            else:
+                process.terminate()
+
+
+class PoolHandler(socketserver.StreamRequestHandler):
+    """
+    One JSON request per line, answered by one JSON line:
+
+    - {"argv": [...] or "kwargs": {...}, "log": optional path, "wait": true} queues a job and returns it,
+      finished if wait is set;
+    - {"status": [job IDs]} returns the jobs by ID, None for unknown IDs;
+    - {"stats": true} returns the pool statistics.
+    """
+    pool = None
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get('stats'):
+                    reply = self.pool.stats()
+                elif 'status' in request:
+                    reply = self.pool.status_many([str(job_id) for job_id in request['status']])
+                else:
+                    kwargs = request.get('kwargs')
+                    argv = None if kwargs is not None else [str(arg) for arg in request['argv']]
+                    job_id = self.pool.submit(argv, request.get('log'), kwargs=kwargs)
+                    reply = self.pool.wait(job_id) if request.get('wait', True) else self.pool.status(job_id)
+                    reply['id'] = job_id
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {'error': str(e)}
+            self.wfile.write((json.dumps(reply, ensure_ascii=False) + '\n').encode('utf-8'))
+
+
+class PoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def request(socket_path, payload, timeout=None):
+    """
+    Sends one request to a running pool and returns its reply.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall((json.dumps(payload, ensure_ascii=False) + '\n').encode('utf-8'))
+        return json.loads(sock.makefile('rb').readline())
+
+
+def submit(socket_path, argv, log_path=None, wait=True, timeout=None, kwargs=None):
+    """
+    Sends a job to a running pool and returns its reply.
+
+    :param socket_path: Path of the pool's Unix socket.
+    :param argv: Arguments of primer_design.py, without the program name.
+    :param log_path: Optional file that receives the log of the job.
+    :param wait: Wait for the job to finish.
+    :param timeout: Socket timeout in seconds, or None to wait indefinitely.
+    :param kwargs: Keyword arguments of design_sample, sent instead of argv.
+    :return: Dictionary of the job.
+    """
+    payload = {'kwargs': kwargs} if kwargs is not None else {'argv': argv}
+    return request(socket_path, dict(payload, log=log_path, wait=wait), timeout=timeout)
+
+
+def job_status(socket_path, job_ids, timeout=30):
+    """
+    Reads the jobs of the given IDs from a running pool.
+
+    :return: Dictionary job ID -> job, None for IDs the pool does not know.
+    """
+    return request(socket_path, {'status': list(job_ids)}, timeout=timeout)
+
+
+def serve(socket_path, workers, max_jobs):
+    import primer_design
+
+    pool = WorkerPool(workers=workers, max_jobs=max_jobs)
+    pool.start()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    PoolHandler.pool = pool
+    server = PoolServer(socket_path, PoolHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f'{workers} workers ready on {socket_path}')
+
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    last_digest = time.time()
+    while not stopping.wait(1):
+        pool.supervise()
+        if time.time() - last_digest >= 60:
+            # 定期发送到期的质控通知汇总，不依赖新的通知触发
+            primer_design.flush_qc_digest()
+            last_digest = time.time()
+
+    logger.info('Stopping: running jobs are finished first.')
+    server.shutdown()
+    server.server_close()
+    os.remove(socket_path)
+    pool.close()
+
+
+def main():
+    pool_config = config.get('worker_pool') or {}
+
+    parser = argparse.ArgumentParser(description='Pool of pre-forked primer design workers.')
+    parser.add_argument('--socket', default=pool_config.get('socket', './primer_cache/worker_pool.sock'),
+                        dest='socket', help='Unix socket of the pool.')
+    parser.add_argument('-j', '--workers', type=int, default=pool_config.get('workers', 4), dest='workers',
+                        help='Number of worker processes.')
+    parser.add_argument('--max-jobs', type=int, default=pool_config.get('max_jobs_per_worker', 20),
+                        dest='max_jobs', help='Jobs a worker runs before it is replaced.')
+    parser.add_argument('--submit', nargs=argparse.REMAINDER, dest='submit',
+                        help='Run a primer_design.py command line on a running pool, e.g. --submit -s ID -m sg ...')
+    parser.add_argument('--stats', action='store_true', dest='stats',
+                        help='Print the statistics of a running pool.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s - %(filename)s[line:%(lineno)d] - %(levelname)s - %(message)s')
+
+    if args.stats:
+        print(json.dumps(request(args.socket, {'stats': True}), ensure_ascii=False))
+        return
+    if args.submit is not None:
+        reply = submit(args.socket, args.submit)
+        print(json.dumps(reply, ensure_ascii=False))
+        sys.exit(reply.get('exit_code', 1))
+
+    serve(args.socket, args.workers, args.max_jobs)
+
+
+if __name__ == '__main__':
+    main()